@@ -19,6 +19,8 @@ const WS_CONFIG = {
     interval: 25000,
     timeout: 10000,
   },
+  // Ask the server to collect events for this long and send them as one frame
+  batchWindowMs: 50,
   debug: import.meta.env.DEV,
 };
 
@@ -106,7 +108,7 @@ class WebSocketService {
     this.isExplicitDisconnect = false;
     
     try {
-      const wsUrl = `${WS_CONFIG.getBaseUrl()}?token=${encodeURIComponent(this.token)}&userId=${encodeURIComponent(this.userId)}`;
+      const wsUrl = `${WS_CONFIG.getBaseUrl()}?token=${encodeURIComponent(this.token)}&userId=${encodeURIComponent(this.userId)}&batch=${WS_CONFIG.batchWindowMs}`;
       this.socket = new WebSocket(wsUrl);
 
       await new Promise((resolve, reject) => {
@@ -147,13 +149,17 @@ class WebSocketService {
       if (WS_CONFIG.debug) {
         console.log('[WebSocket] Message received:', message);
       }
+      // A batched frame carries several events, in order
+      const messages = message.type === 'events' && Array.isArray(message.data) ? message.data : [message];
       console.log('[WebSocket] Dispatching to', this.messageHandlers.size, 'handlers');
-      this.messageHandlers.forEach(handler => {
-        try {
-          handler(message);
-        } catch (error) {
-          console.error('[WebSocket] Error in message handler:', error);
-        }
+      messages.forEach(item => {
+        this.messageHandlers.forEach(handler => {
+          try {
+            handler(item);
+          } catch (error) {
+            console.error('[WebSocket] Error in message handler:', error);
+          }
+        });
       });
     } catch (error) {
       console.error('[WebSocket] Error parsing message:', error, event.data);
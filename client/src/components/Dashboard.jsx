@@ -121,6 +121,26 @@ function Dashboard() {
           });
           break;
 
+        case "notes_added": {
+          // Several notes at once: a bulk import (summaries without content)
+          // or inserts the server batched together (full notes)
+          const added = data?.notes;
+          if (!Array.isArray(added) || added.length === 0) return;
+          if (added.some((n) => n.content === undefined)) {
+            // Bodies aren't in the event; reload the first page to show them
+            loadNotes(true);
+            return;
+          }
+          setState((prev) => {
+            const known = new Set(prev.notes.map((n) => n.id));
+            const fresh = added.filter((n) => !known.has(n.id)).reverse();
+            if (fresh.length === 0) return prev;
+            const updated = [...fresh, ...prev.notes];
+            return { ...prev, notes: updated, skip: updated.length };
+          });
+          break;
+        }
+
         case "note_updated":
         case "note_update":
           if (!data) return;
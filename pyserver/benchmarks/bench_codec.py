@@ -0,0 +1,90 @@
+"""
+Cost of serving a cached page of notes and of encoding a WebSocket frame.
+
+Compares the previous path (json.loads of the cached string, then the default
+JSONResponse encoder) with the current one (cached bytes written as-is), and
+the stdlib encoder with utils.codec for WebSocket frames. Also reports the
+size and CPU cost of compressing the page for Redis with each available codec.
+
+    python -m benchmarks.bench_codec --notes 100 --iterations 2000
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from benchmarks.common import percentile, setup_env
+
+setup_env()
+
+from starlette.responses import JSONResponse  # noqa: E402
+
+from utils import compression  # noqa: E402
+from utils.codec import CODEC_NAME, RawJSONResponse, dumps, dumps_str  # noqa: E402
+
+
+def make_page(n: int, rng: random.Random) -> list:
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))) for _ in range(2000)]
+    return [{
+        "id": "%024x" % rng.getrandbits(96),
+        "title": " ".join(rng.choices(words, k=5)),
+        "content": " ".join(rng.choices(words, k=rng.randint(50, 400))),
+        "createdAt": "2024-05-01T12:00:00+00:00",
+        "updatedAt": "2024-05-02T08:30:00+00:00",
+        "rev": rng.randint(1, 10000),
+    } for _ in range(n)]
+
+
+def timed(fn, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t)
+    return timings
+
+
+def report(label: str, timings: list) -> None:
+    print(f"  {label:<34} p50 {percentile(timings, 50) * 1e6:8.1f} us   p99 {percentile(timings, 99) * 1e6:8.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100, help="notes per page")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    page = make_page(args.notes, random.Random(args.seed))
+    cached_str = json.dumps(page, default=str)
+    cached_bytes = dumps(page)
+    print(f"codec: {CODEC_NAME}, page of {args.notes} notes, {len(cached_bytes) / 1024:.1f} KiB")
+
+    print("cache hit -> response body")
+    report("json.loads + JSONResponse", timed(lambda: JSONResponse(json.loads(cached_str)).body, args.iterations))
+    report("RawJSONResponse (bytes as-is)", timed(lambda: RawJSONResponse(cached_bytes).body, args.iterations))
+
+    print("cache miss -> encode page")
+    report("json.dumps", timed(lambda: json.dumps(page, default=str), args.iterations))
+    report("codec.dumps", timed(lambda: dumps(page), args.iterations))
+
+    print("Redis value compression")
+    for codec, level in (("zstd", 3), ("zlib", 1), ("zlib", 6)):
+        if codec == "zstd" and compression.zstandard is None:
+            continue
+        compression.COMPRESSION_CODEC, compression.COMPRESSION_LEVEL = codec, level
+        packed = compression.compress(cached_bytes, "bench", 1)
+        print(f"  {codec}-{level}: {len(cached_bytes)} -> {len(packed)} bytes ({len(cached_bytes) / len(packed):.1f}x)")
+        report("compress", timed(lambda: compression.compress(cached_bytes, "bench", 1), args.iterations))
+        report("decompress", timed(lambda: compression.decompress(packed, "bench"), args.iterations))
+
+    event = {"type": "note_added", "data": page[0], "rev": page[0]["rev"],
+             "timestamp": "2024-05-02T08:30:00+00:00"}
+    print("WebSocket frame")
+    report("json.dumps", timed(lambda: json.dumps(event, default=str), args.iterations * 10))
+    report("codec.dumps_str", timed(lambda: dumps_str(event), args.iterations * 10))
+
+
+if __name__ == "__main__":
+    main()
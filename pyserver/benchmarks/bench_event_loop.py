@@ -0,0 +1,78 @@
+"""
+Event-loop latency under concurrent note writes.
+
+Compares the old pattern (synchronous driver calls inside async routes,
+modelled with a blocking sleep per round trip) with the async repository
+layer, at increasing numbers of concurrent writers. With the async layer the
+loop lag should stay flat; with blocking calls it grows with concurrency.
+
+    python -m benchmarks.bench_event_loop --rtt-ms 2 --requests 200
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import (
+    LoopLagProbe, install_stand_ins, make_token, percentile, setup_env,
+)
+
+setup_env()
+
+import httpx  # noqa: E402
+from main import app  # noqa: E402
+
+
+async def run_level(mode: str, concurrency: int, total: int, rtt: float) -> dict:
+    install_stand_ins(rtt=rtt, blocking=(mode == "blocking"))
+    headers = {"Authorization": f"Bearer {make_token('bench-user')}"}
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(i)
+
+        async def writer() -> None:
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                resp = await client.post("/notes", json={"title": f"t{i}", "content": "x" * 256}, headers=headers)
+                resp.raise_for_status()
+
+        probe = LoopLagProbe()
+        probe.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(writer() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await probe.stop()
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "req_per_s": total / elapsed,
+        "lag_p50_ms": percentile(probe.samples, 50) * 1000,
+        "lag_p99_ms": percentile(probe.samples, 99) * 1000,
+        "lag_max_ms": max(probe.samples, default=0.0) * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="simulated round-trip time per Mongo/Redis call")
+    parser.add_argument("--requests", type=int, default=200, help="writes per concurrency level")
+    parser.add_argument("--levels", default="1,8,32,128", help="comma separated writer counts")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(",")]
+    print(f"{'mode':<10}{'writers':>8}{'req/s':>10}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}  (ms)")
+    for mode in ("blocking", "async"):
+        for level in levels:
+            r = await run_level(mode, level, args.requests, args.rtt_ms / 1000.0)
+            print(f"{r['mode']:<10}{r['concurrency']:>8}{r['req_per_s']:>10.0f}"
+                  f"{r['lag_p50_ms']:>10.2f}{r['lag_p99_ms']:>10.2f}{r['lag_max_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
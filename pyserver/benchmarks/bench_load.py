@@ -0,0 +1,319 @@
+"""
+Load test of the REST and WebSocket paths of the app in main.py.
+
+Serves the app with uvicorn on a local port (stand-ins for MongoDB and Redis,
+in-process broker) and drives it over real sockets from the same process:
+
+1. seeds every user with --seed-notes notes;
+2. opens --subscribers WebSocket connections per user;
+3. runs --clients HTTP clients for --duration seconds, each picking list /
+   get / add / delete requests according to --mix;
+4. runs --storms reconnect storms: every subscriber drops, each user gets
+   --storm-writes new notes while they are offline, then all of them
+   reconnect at once with ?since= and wait until they are caught up.
+
+Reports throughput and p50/p99/p999 latency per operation, WebSocket
+delivery latency and event-loop lag, and writes them as JSON with --out.
+Compare two runs with benchmarks/compare.py.
+
+    python -m benchmarks.bench_load --duration 10 --out before.json
+    python -m benchmarks.bench_load --duration 10 --out after.json
+    python -m benchmarks.compare before.json after.json
+
+Client and server share one event loop, so absolute numbers include the
+client's own overhead, and mongomock scans the whole collection on every
+query (keep --seed-notes x --users modest); compare runs made with the same
+settings.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import (
+    LoopLagProbe, install_stand_ins, make_token, percentile, setup_env, start_server,
+)
+
+setup_env()
+
+import httpx  # noqa: E402
+import websockets  # noqa: E402
+from main import app  # noqa: E402
+from utils.codec import CODEC_NAME, loads  # noqa: E402
+from utils.notes_repository import notes_repo  # noqa: E402
+from utils.websocket_manager import manager  # noqa: E402
+
+# Per-connection INFO logs would dominate the profile during reconnect storms
+logging.getLogger().setLevel(logging.WARNING)
+
+# Statuses that are a normal outcome for each operation (deletes race with each other)
+EXPECTED = {"list": {200}, "get": {200, 404}, "add": {200}, "delete": {200, 404}}
+EVENT_TYPES = {"note_added", "notes_added", "note_deleted"}
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "p999_ms": percentile(samples, 99.9) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in EXPECTED:
+            raise SystemExit(f"unknown operation in --mix: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class Subscriber:
+    """One WebSocket client; records delivery latency and the last revision it saw."""
+
+    def __init__(self, port: int, user_id: str, token: str, stats: Dict[str, Any]) -> None:
+        self.port = port
+        self.user_id = user_id
+        self.token = token
+        self.stats = stats
+        self.rev = 0
+        self.rev_seen = asyncio.Event()
+        self.ws = None
+        self.reader: Optional[asyncio.Task] = None
+
+    async def connect(self, since: Optional[int] = None) -> None:
+        url = f"ws://127.0.0.1:{self.port}/ws?token={self.token}&userId={self.user_id}"
+        if since is not None:
+            url += f"&since={since}"
+        self.ws = await websockets.connect(url, max_size=None)
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        try:
+            async for frame in self.ws:
+                received = time.time()
+                message = loads(frame)
+                self.stats["messages"] += 1
+                if message.get("type") == "sync":
+                    self.rev = max(self.rev, message["data"]["rev"])
+                elif message.get("type") in EVENT_TYPES:
+                    sent = datetime.fromisoformat(message["timestamp"]).timestamp()
+                    self.stats["delivery"].append(received - sent)
+                    if isinstance(message.get("rev"), int):
+                        self.rev = max(self.rev, message["rev"])
+                self.rev_seen.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def wait_for_rev(self, rev: int) -> None:
+        while self.rev < rev:
+            self.rev_seen.clear()
+            await self.rev_seen.wait()
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+            await self.reader
+            self.ws = None
+
+
+async def seed(users: List[str], count: int, content: str) -> Dict[str, List[str]]:
+    pools: Dict[str, List[str]] = {}
+    for user_id in users:
+        notes = [{"title": f"seed {i}", "content": content} for i in range(count)]
+        for start in range(0, count, 500):
+            await notes_repo.insert_notes(user_id, notes[start:start + 500])
+        pools[user_id] = [str(note["_id"]) for note in notes]
+    return pools
+
+
+async def run_workload(base_url: str, args, users: List[str], headers: Dict[str, dict],
+                       pools: Dict[str, List[str]], content: str) -> Dict[str, Any]:
+    weights = parse_mix(args.mix)
+    ops, cum = list(weights), []
+    total = 0.0
+    for op in ops:
+        total += weights[op]
+        cum.append(total)
+    latencies: Dict[str, List[float]] = {op: [] for op in EXPECTED}
+    errors: Dict[str, int] = {op: 0 for op in EXPECTED}
+    rng = random.Random(args.seed)
+    # One client (one keep-alive connection) per worker: a single shared httpx
+    # pool spends more CPU picking connections than the server spends serving.
+    # Built up front, since each one loads an SSL context.
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=60) for _ in range(args.clients)]
+
+    async def worker(n: int, client: httpx.AsyncClient) -> None:
+        user_id = users[n % len(users)]
+        pool = pools[user_id]
+        next_cursor = None
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, cum_weights=cum)[0]
+            if op == "delete" and not pool:
+                op = "add"
+            start = time.perf_counter()
+            try:
+                if op == "list":
+                    params = {"limit": 20, "view": args.view}
+                    if next_cursor and rng.random() < 0.3:
+                        params["cursor"] = next_cursor
+                    resp = await client.get("/notes", params=params, headers=headers[user_id])
+                    next_cursor = resp.headers.get("X-Next-Cursor")
+                elif op == "get":
+                    note_id = rng.choice(pool) if pool else "0" * 24
+                    resp = await client.get(f"/notes/{note_id}", headers=headers[user_id])
+                elif op == "add":
+                    resp = await client.post("/notes", json={"title": f"load {n}", "content": content},
+                                             headers=headers[user_id])
+                    if resp.status_code == 200:
+                        pool.append(resp.json()["note"]["id"])
+                else:
+                    note_id = pool.pop(rng.randrange(len(pool)))
+                    resp = await client.delete(f"/notes/{note_id}", headers=headers[user_id])
+                ok = resp.status_code in EXPECTED[op]
+            except httpx.HTTPError:
+                ok = False
+            latencies[op].append(time.perf_counter() - start)
+            if not ok:
+                errors[op] += 1
+
+    probe = LoopLagProbe()
+    probe.start()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(n, client) for n, client in enumerate(clients)))
+    elapsed = time.perf_counter() - start
+    await probe.stop()
+    await asyncio.gather(*(client.aclose() for client in clients))
+
+    http = {}
+    for op, samples in latencies.items():
+        if samples:
+            http[op] = dict(summarize(samples), errors=errors[op], rps=len(samples) / elapsed)
+    everything = [s for samples in latencies.values() for s in samples]
+    http["total"] = dict(summarize(everything), errors=sum(errors.values()), rps=len(everything) / elapsed)
+    return {"http": http, "loop_lag": summarize(probe.samples), "elapsed_s": elapsed}
+
+
+async def reconnect_storms(client: httpx.AsyncClient, args, users: List[str], headers: Dict[str, dict],
+                           subscribers: List[Subscriber], content: str) -> Dict[str, Any]:
+    connect_times: List[float] = []
+    catch_up_times: List[float] = []
+    errors = 0
+    for _ in range(args.storms):
+        await asyncio.gather(*(sub.close() for sub in subscribers))
+        # Writes the subscribers miss while offline, to be replayed on reconnect
+        target: Dict[str, int] = {}
+        for user_id in users:
+            for _ in range(args.storm_writes):
+                resp = await client.post("/notes", json={"title": "offline", "content": content},
+                                         headers=headers[user_id])
+                target[user_id] = resp.json()["note"]["rev"]
+
+        async def reconnect(sub: Subscriber) -> None:
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                await sub.connect(since=sub.rev)
+                connect_times.append(time.perf_counter() - start)
+                await asyncio.wait_for(sub.wait_for_rev(target.get(sub.user_id, sub.rev)), timeout=30)
+                catch_up_times.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+        await asyncio.gather(*(reconnect(sub) for sub in subscribers))
+    return {"storms": args.storms, "connections": len(subscribers), "errors": errors,
+            "connect": summarize(connect_times), "catch_up": summarize(catch_up_times)}
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"{'operation':<10}{'count':>8}{'rps':>9}{'p50':>9}{'p99':>9}{'p999':>9}{'max':>9}{'errors':>8}  (ms)")
+    for op, r in results["http"].items():
+        print(f"{op:<10}{r['count']:>8}{r['rps']:>9.0f}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['p999_ms']:>9.2f}{r['max_ms']:>9.2f}{r['errors']:>8}")
+    rows = [("ws deliv", results["ws"]["delivery"]), ("loop lag", results["loop_lag"])]
+    if results.get("reconnect"):
+        rows += [("reconnect", results["reconnect"]["connect"]), ("catch-up", results["reconnect"]["catch_up"])]
+    for label, r in rows:
+        print(f"{label:<10}{r['count']:>8}{'':>9}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['p999_ms']:>9.2f}{r['max_ms']:>9.2f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of mixed HTTP load")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=50, help="concurrent HTTP clients")
+    parser.add_argument("--subscribers", type=int, default=3, help="WebSocket connections per user")
+    parser.add_argument("--mix", default="list=60,get=20,add=15,delete=5", help="operation weights")
+    parser.add_argument("--view", choices=("full", "summary"), default="full")
+    parser.add_argument("--seed-notes", type=int, default=20, help="notes per user before the run")
+    parser.add_argument("--content-bytes", type=int, default=512)
+    parser.add_argument("--storms", type=int, default=3, help="reconnect storms after the load phase")
+    parser.add_argument("--storm-writes", type=int, default=5, help="notes per user written while offline")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="simulated round-trip time per Mongo/Redis call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    install_stand_ins(rtt=args.rtt_ms / 1000.0)
+    content = ("lorem ipsum dolor sit amet " * (args.content_bytes // 27 + 1))[:args.content_bytes]
+    users = [f"load-user-{u}" for u in range(args.users)]
+    headers = {user_id: {"Authorization": f"Bearer {make_token(user_id)}"} for user_id in users}
+    pools = await seed(users, args.seed_notes, content)
+
+    await manager.start()
+    server, serve_task, port = await start_server(app)
+    ws_stats: Dict[str, Any] = {"messages": 0, "delivery": []}
+    subscribers = [Subscriber(port, user_id, make_token(user_id), ws_stats)
+                   for user_id in users for _ in range(args.subscribers)]
+    try:
+        await asyncio.gather(*(sub.connect() for sub in subscribers))
+        base_url = f"http://127.0.0.1:{port}"
+        results = await run_workload(base_url, args, users, headers, pools, content)
+        results["ws"] = {"subscribers": len(subscribers), "messages": ws_stats["messages"],
+                         "delivery": summarize(ws_stats["delivery"])}
+        if args.storms:
+            async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+                results["reconnect"] = await reconnect_storms(client, args, users, headers, subscribers, content)
+    finally:
+        await asyncio.gather(*(sub.close() for sub in subscribers), return_exceptions=True)
+        server.should_exit = True
+        await serve_task
+        await manager.stop()
+
+    results = {
+        "benchmark": "load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "codec": CODEC_NAME,
+        "config": vars(args),
+        **results,
+    }
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Search latency of the in-process inverted index on a generated corpus.
+
+Builds an index for one user with N synthetic Markdown-ish notes (Zipf-like
+word frequencies) and times random 1-3 term queries.
+
+    python -m benchmarks.bench_search --notes 50000 --queries 2000
+"""
+import argparse
+import itertools
+import random
+import time
+
+from benchmarks.common import percentile, setup_env
+
+setup_env()
+
+from utils.search import InvertedIndex  # noqa: E402
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=80, help="average words per note body")
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = make_vocabulary(args.vocab, rng)
+    # Zipf-like weights: a few very common words, a long tail of rare ones
+    weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocab))))
+
+    index = InvertedIndex()
+    start = time.perf_counter()
+    for i in range(args.notes):
+        title = " ".join(rng.choices(vocab, cum_weights=weights, k=rng.randint(2, 6)))
+        body = " ".join(rng.choices(vocab, cum_weights=weights, k=max(1, int(rng.gauss(args.words, args.words / 3)))))
+        index.add(f"note{i}", title, body)
+    build = time.perf_counter() - start
+    print(f"indexed {args.notes} notes in {build:.2f}s ({args.notes / build:.0f} notes/s), "
+          f"{len(index.postings)} distinct terms")
+
+    # Queries mix common and rare terms, like real searches
+    timings = []
+    hits = 0
+    for _ in range(args.queries):
+        query = " ".join(rng.choice(vocab[:5000]) for _ in range(rng.randint(1, 3)))
+        t = time.perf_counter()
+        results = index.search(query, 20)
+        timings.append(time.perf_counter() - t)
+        hits += bool(results)
+
+    print(f"{args.queries} queries ({hits} with results): "
+          f"p50 {percentile(timings, 50) * 1000:.3f} ms, "
+          f"p99 {percentile(timings, 99) * 1000:.3f} ms, "
+          f"max {max(timings) * 1000:.3f} ms")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add(f"extra{i}", "new note", " ".join(rng.choices(vocab, cum_weights=weights, k=args.words)))
+    for i in range(1000):
+        index.remove(f"extra{i}")
+    print(f"incremental add+remove: {(time.perf_counter() - start) / 1000 * 1000:.3f} ms per note")
+
+
+if __name__ == "__main__":
+    main()
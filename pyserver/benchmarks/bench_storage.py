@@ -0,0 +1,114 @@
+"""
+Per-call latency of the storage backends, at the repository level.
+
+"sqlite" is the embedded database of the desktop build (a real file in a
+temporary directory, WAL mode). "mongo" is mongomock with --rtt-ms of
+simulated round-trip time per call (default 30 ms, a laptop talking to a
+hosted cluster), or a real server with --mongo-uri.
+
+    python -m benchmarks.bench_storage --notes 2000 --calls 500
+    python -m benchmarks.bench_storage --rtt-ms 0 --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.common import LatencyProxy, percentile, setup_env
+
+setup_env()
+
+from bson.objectid import ObjectId  # noqa: E402
+from utils.notes_repository import NotesRepository  # noqa: E402
+from utils.sqlite_db import SQLiteDatabase  # noqa: E402
+from utils.sqlite_repository import SQLiteNotesRepository  # noqa: E402
+
+USER = "bench-user"
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def mongo_repo(args) -> NotesRepository:
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(args.mongo_uri)["notes_bench"]
+        await db["notes"].drop()
+        await db["counters"].drop()
+        await db["note_revisions"].drop()
+        await db["tag_counts"].drop()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        db = AsyncMongoMockClient()["notes_bench"]
+    rtt = args.rtt_ms / 1000.0
+    repo = NotesRepository(LatencyProxy(db["notes"], rtt), LatencyProxy(db["counters"], rtt),
+                           revisions=LatencyProxy(db["note_revisions"], rtt),
+                           tag_counts=LatencyProxy(db["tag_counts"], rtt))
+    await repo.ensure_indexes()
+    return repo
+
+
+async def measure(calls: int, op: Callable[[int], Awaitable]) -> Dict[str, float]:
+    samples: List[float] = []
+    for i in range(calls):
+        t = time.perf_counter()
+        await op(i)
+        samples.append(time.perf_counter() - t)
+    return {"p50_ms": percentile(samples, 50) * 1000, "p99_ms": percentile(samples, 99) * 1000}
+
+
+async def run(name: str, repo, args) -> None:
+    note_ids: List[ObjectId] = []
+    for i in range(args.notes):
+        # 20 folders, plus a tag on every tenth note
+        tags = [f"folder{i % 20}"] + (["starred"] if i % 10 == 0 else [])
+        note = {"title": f"note {i}", "content": f"meeting notes about topic{i % 50} " * 20, "userId": USER,
+                "tags": tags, "createdAt": now()}
+        note_ids.append(ObjectId(await repo.insert_note(note)))
+
+    ops = {
+        "find_note": lambda i: repo.find_note(note_ids[i % len(note_ids)], USER),
+        "list_notes": lambda i: repo.list_notes(USER, 20, summary=True),
+        "list_tag": lambda i: repo.list_notes(USER, 20, summary=True, tag=f"folder{i % 20}"),
+        "list_tags": lambda i: repo.list_tags(USER),
+        "insert_note": lambda i: repo.insert_note({"title": f"new {i}", "content": "x" * 256, "userId": USER,
+                                                   "createdAt": now()}),
+        "update_content": lambda i: repo.update_note_content(note_ids[i % len(note_ids)], USER, f"edit {i}"),
+        "set_tags": lambda i: repo.set_tags(note_ids[i % len(note_ids)], USER, [f"folder{i % 20}", "moved"]),
+    }
+    if name == "sqlite":
+        # mongomock has no $text
+        async def search(i: int) -> None:
+            async for _ in repo.text_search(USER, f"topic{i % 50} meeting", 20):
+                pass
+        ops["text_search"] = search
+
+    print(f"{name}:")
+    for op_name, op in ops.items():
+        result = await measure(args.calls, op)
+        print(f"  {op_name:<16} p50 {result['p50_ms']:8.3f} ms   p99 {result['p99_ms']:8.3f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=2000, help="notes in the database before measuring")
+    parser.add_argument("--calls", type=int, default=500, help="calls per operation")
+    parser.add_argument("--rtt-ms", type=float, default=30.0, help="simulated round trip per Mongo call")
+    parser.add_argument("--mongo-uri", help="benchmark a real MongoDB server instead of mongomock")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = SQLiteDatabase(os.path.join(tmp, "notes.db"))
+        try:
+            await run("sqlite", SQLiteNotesRepository(database), args)
+        finally:
+            database.close()
+    await run("mongo", await mongo_repo(args), args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
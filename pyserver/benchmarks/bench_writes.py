@@ -0,0 +1,100 @@
+"""
+Insert throughput of POST /notes with and without write-behind batching.
+
+Each writer posts notes back to back; writers are spread over --users users
+so batches mix several users. Mongo is mongomock (with --rtt-ms of simulated
+round-trip time per call) unless --mongo-uri points at a real server.
+
+    python -m benchmarks.bench_writes --rtt-ms 2 --requests 2000
+    python -m benchmarks.bench_writes --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import install_stand_ins, make_token, percentile, setup_env
+
+setup_env()
+
+import httpx  # noqa: E402
+from main import app  # noqa: E402
+from routes import notes as notes_routes  # noqa: E402
+from utils.notes_repository import notes_repo  # noqa: E402
+from utils.write_batcher import WriteBatcher  # noqa: E402
+import utils.write_batcher  # noqa: E402
+
+
+async def use_real_mongo(uri: str) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    db = AsyncIOMotorClient(uri)["notes_bench"]
+    await db["notes"].drop()
+    await db["counters"].drop()
+    notes_repo.collection = db["notes"]
+    notes_repo.counters = db["counters"]
+
+
+async def run_level(batched: bool, concurrency: int, total: int, users: int, args) -> dict:
+    install_stand_ins(rtt=args.rtt_ms / 1000.0)
+    if args.mongo_uri:
+        await use_real_mongo(args.mongo_uri)
+    batcher = WriteBatcher(args.window_ms, args.max_ops)
+    notes_routes.write_batcher = batcher
+    notes_routes.WRITE_BATCHING = batched
+
+    headers = [{"Authorization": f"Bearer {make_token(f'bench-user-{u}')}"} for u in range(users)]
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(i)
+
+        async def writer(w: int) -> None:
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                t = time.perf_counter()
+                resp = await client.post("/notes", json={"title": f"t{i}", "content": "x" * 256},
+                                         headers=headers[w % users])
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    await batcher.stop()
+
+    stored = await notes_repo.collection.count_documents({})
+    assert stored == total, f"expected {total} notes, found {stored}"
+    return {
+        "mode": "batched" if batched else "direct",
+        "concurrency": concurrency,
+        "req_per_s": total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "avg_batch": batcher.get_metrics()["avg_batch"],
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="simulated round-trip time per Mongo/Redis call")
+    parser.add_argument("--mongo-uri", help="benchmark against this MongoDB instead of mongomock")
+    parser.add_argument("--requests", type=int, default=2000, help="writes per concurrency level")
+    parser.add_argument("--levels", default="8,64,256", help="comma separated writer counts")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--window-ms", type=float, default=utils.write_batcher.WRITE_BATCH_WINDOW_MS)
+    parser.add_argument("--max-ops", type=int, default=utils.write_batcher.WRITE_BATCH_MAX_OPS)
+    args = parser.parse_args()
+
+    print(f"{'mode':<9}{'writers':>8}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'batch':>8}")
+    for level in (int(x) for x in args.levels.split(",")):
+        for batched in (False, True):
+            r = await run_level(batched, level, args.requests, args.users, args)
+            print(f"{r['mode']:<9}{r['concurrency']:>8}{r['req_per_s']:>10.0f}"
+                  f"{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['avg_batch']:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""
+Frames, bytes and CPU of delivering a burst of note events, per batching window.
+
+A writer sends --events note_added events for one user back to back, yielding
+to the loop between events as a route would; the user has --sockets stand-in
+sockets that count what they receive and parse it the way a client would.
+Wire bytes are also reported with permessage-deflate (context takeover, as
+browsers negotiate it), modelled with zlib.
+
+    python -m benchmarks.bench_ws_batching --events 500 --windows 0,10,50
+"""
+import argparse
+import asyncio
+import time
+import zlib
+from datetime import datetime, timezone
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from utils.broker import InMemoryBroker  # noqa: E402
+from utils.codec import loads  # noqa: E402
+from utils.websocket_manager import ConnectionManager  # noqa: E402
+
+
+class CountingSocket:
+    def __init__(self) -> None:
+        self.frames = 0
+        self.events = 0
+        self.bytes = 0
+        self.deflated = 0
+        self._deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+    async def send_text(self, frame: str) -> None:
+        data = frame.encode()
+        self.frames += 1
+        self.bytes += len(data)
+        self.deflated += len(self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)) - 4
+        message = loads(frame)
+        self.events += len(message["data"]) if message["type"] == "events" else 1
+
+
+async def run(window_ms: int, args) -> dict:
+    manager = ConnectionManager(broker=InMemoryBroker(), max_connections_per_user=0)
+    sockets = [CountingSocket() for _ in range(args.sockets)]
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, "bench-user", f"device {i}", window_ms)
+    await asyncio.sleep(0.1)
+    for ws in sockets:
+        ws.__init__()
+
+    cpu, start = time.process_time(), time.perf_counter()
+    for i in range(args.events):
+        now = datetime.now(timezone.utc).isoformat()
+        note = {"id": f"{i:024x}", "title": f"Note {i}", "content": "x" * args.content_bytes,
+                "userId": "bench-user", "createdAt": now, "updatedAt": now, "rev": i + 1}
+        await manager.send_to_user("bench-user", {"type": "note_added", "data": note, "rev": i + 1,
+                                                  "timestamp": now})
+        await asyncio.sleep(args.interval_ms / 1000.0)
+    # Until every writer has drained its queue
+    while any(conn.queue is not None for conn in manager._by_user["bench-user"].values()):
+        await asyncio.sleep(0.001)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    await manager.stop()
+
+    frames = sum(ws.frames for ws in sockets)
+    return {
+        "window_ms": window_ms,
+        "frames": frames,
+        "events_per_frame": sum(ws.events for ws in sockets) / frames,
+        "dropped": manager.stats.dropped,
+        "KiB": sum(ws.bytes for ws in sockets) / 1024,
+        "KiB_deflate": sum(ws.deflated for ws in sockets) / 1024,
+        "cpu_ms": cpu * 1000,
+        "wall_ms": elapsed * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--sockets", type=int, default=3)
+    parser.add_argument("--content-bytes", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=0.0, help="pause between events")
+    parser.add_argument("--windows", default="0,10,50", help="batching windows to compare (ms)")
+    args = parser.parse_args()
+
+    print(f"{'window':>7} {'frames':>7} {'ev/frame':>8} {'KiB':>8} {'deflated':>9} {'cpu ms':>8} {'wall ms':>8} "
+          f"{'dropped':>8}")
+    for window_ms in (int(w) for w in args.windows.split(",")):
+        r = await run(window_ms, args)
+        print(f"{r['window_ms']:>7} {r['frames']:>7} {r['events_per_frame']:>8.1f} {r['KiB']:>8.1f} "
+              f"{r['KiB_deflate']:>9.1f} {r['cpu_ms']:>8.1f} {r['wall_ms']:>8.1f} {r['dropped']:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
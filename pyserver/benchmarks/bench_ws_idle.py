@@ -0,0 +1,65 @@
+"""
+Memory and heartbeat cost of idle WebSocket connections in the ConnectionManager.
+
+Registers --connections stand-in sockets (no network; nothing is ever sent
+to them) spread over --users users, and reports the manager's memory per
+connection (tracemalloc) and the time the heartbeat wheel spends on one
+bucket. Memory held by the server itself for each socket (uvicorn protocol,
+receive task) is not included.
+
+    python -m benchmarks.bench_ws_idle --connections 100000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from utils.broker import InMemoryBroker  # noqa: E402
+from utils.websocket_manager import ConnectionManager  # noqa: E402
+
+
+class IdleSocket:
+    async def send_text(self, frame: str) -> None:
+        pass
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    args = parser.parse_args()
+
+    manager = ConnectionManager(broker=InMemoryBroker(), max_connections_per_user=0)
+    sockets = [IdleSocket() for _ in range(args.connections)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, f"user-{i % args.users}", "bench device")
+    elapsed = time.perf_counter() - start
+    # Let the fire-and-forget publishes of the connects finish
+    while len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0.01)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"connections:         {args.connections}")
+    print(f"connect:             {elapsed / args.connections * 1e6:.1f} us each")
+    print(f"manager memory:      {held / 2**20:.1f} MiB ({held / args.connections:.0f} B per connection)")
+    print(f"tasks per socket:    {(len(asyncio.all_tasks()) - 1) / args.connections:.2f}")
+
+    bucket = max(manager.wheel.slots, key=len)
+    start = time.perf_counter()
+    manager._heartbeat(list(bucket))
+    print(f"heartbeat bucket:    {len(bucket)} connections in {(time.perf_counter() - start) * 1000:.2f} ms "
+          f"({len(manager.wheel.slots)} buckets)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+"""
+Shared helpers for the benchmarks.
+
+Run benchmarks from the pyserver directory, e.g.:
+    python -m benchmarks.bench_event_loop
+
+MongoDB and Redis are replaced with in-process stand-ins (mongomock-motor and
+fakeredis), optionally wrapped in a proxy that adds a fixed round-trip time so
+network latency can be modelled without a real server.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import socket
+import time
+import warnings
+from typing import List, Sequence
+
+
+def setup_env() -> None:
+    """Provide placeholder settings so the app modules import without a real backend."""
+    os.environ.setdefault("REDIS_URL", "rediss://localhost:6379")
+    os.environ.setdefault("REDIS_TOKEN", "benchmark")
+    os.environ.setdefault("JWT_SECRET", "secrethrejnrsibrgjfskib")
+    # Single process: no cross-worker fan-out to measure
+    os.environ.setdefault("WS_BROKER", "memory")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    warnings.filterwarnings("ignore", module="jwt")
+
+
+class LatencyProxy:
+    """
+    Wraps a client/collection and delays every awaitable call by `rtt` seconds.
+    blocking=True sleeps with time.sleep, which models calling a synchronous
+    driver from inside an async route (the event loop is stalled for the RTT).
+    """
+
+    def __init__(self, target, rtt: float, blocking: bool = False) -> None:
+        self._target = target
+        self._rtt = rtt
+        self._blocking = blocking
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or self._rtt <= 0:
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if not inspect.isawaitable(result):
+                return result
+
+            async def delayed():
+                if self._blocking:
+                    time.sleep(self._rtt)
+                else:
+                    await asyncio.sleep(self._rtt)
+                return await result
+
+            return delayed()
+
+        return call
+
+
+def install_stand_ins(rtt: float = 0.0, blocking: bool = False):
+    """Point the repository and cache layer at fresh in-process stand-ins."""
+    import fakeredis
+    from mongomock_motor import AsyncMongoMockClient
+    from utils import redis_utils
+    from utils.notes_repository import notes_repo
+
+    db = AsyncMongoMockClient()["notes_app"]
+    collection = db["notes"]
+    # Large pool: with a simulated RTT the stand-in would otherwise run out of connections
+    redis_client = fakeredis.aioredis.FakeRedis(max_connections=10000)
+
+    notes_repo.collection = LatencyProxy(collection, rtt, blocking)
+    notes_repo.counters = LatencyProxy(db["counters"], rtt, blocking)
+    notes_repo.revisions = LatencyProxy(db["note_revisions"], rtt, blocking)
+    notes_repo.tag_counts = LatencyProxy(db["tag_counts"], rtt, blocking)
+    redis_utils.redis_client = LatencyProxy(redis_client, rtt, blocking)
+    return collection, redis_client
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(app, port: int = 0):
+    """
+    Serve `app` with uvicorn on this event loop (real HTTP and WebSocket sockets).
+    Returns (server, serve_task, port); set server.should_exit and await the task to stop.
+    The lifespan is skipped: it would try to reach MongoDB.
+    """
+    import uvicorn
+    port = port or free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off",
+                            backlog=4096)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task, port
+
+
+def make_token(user_id: str) -> str:
+    import jwt
+    return jwt.encode({"_id": user_id}, os.environ["JWT_SECRET"], algorithm="HS256")
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoopLagProbe:
+    """Measures how late the event loop wakes up a task that sleeps for `interval`."""
+
+    def __init__(self, interval: float = 0.001) -> None:
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,60 @@
+"""
+Compare two JSON result files written by a benchmark's --out option.
+
+Prints every latency (*_ms) and throughput (rps) figure side by side with the
+relative change, and flags changes for the worse beyond --threshold percent.
+Exits with status 1 when there is at least one regression, so it can gate CI.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+
+def metrics(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        if key == "config":
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from metrics(value, path + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and (
+                key.endswith("_ms") or key == "rps"):
+            yield path, float(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before: {before.get('commit')} {before.get('timestamp')}")
+    print(f"after:  {after.get('commit')} {after.get('timestamp')}")
+    if before.get("config") != after.get("config"):
+        print("warning: the runs used different settings")
+
+    new = dict(metrics(after))
+    regressions = 0
+    print(f"{'metric':<32}{'before':>12}{'after':>12}{'change':>10}")
+    for path, old in metrics(before):
+        if path not in new:
+            continue
+        value = new[path]
+        change = (value - old) / old * 100 if old else 0.0
+        # Latencies should go down, throughput up
+        worse = change > args.threshold if path.endswith("_ms") else change < -args.threshold
+        regressions += worse
+        print(f"{path:<32}{old:>12.2f}{value:>12.2f}{change:>+9.1f}%{'  <- worse' if worse else ''}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
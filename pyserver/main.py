@@ -1,15 +1,107 @@
 import logging
+from contextlib import asynccontextmanager
+import os
+from dotenv import load_dotenv
+
+# Before the imports below, which read their settings at import time
+load_dotenv()
+
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import notes
-from utils.websocket_manager import manager
+from utils.db import close_db, connect_db, ping_db, warm_db_pool
+from utils.notes_repository import notes_repo
+from utils.codec import FastJSONResponse, loads
+from utils.collab import collab
+from utils.compression import get_compression_stats
+from utils.search import search_backend
+from utils.jwt import get_auth_metrics, verify_ws_token
+from utils.logging_utils import install_rate_limit
+from utils.metrics import RequestMetricsMiddleware, registry, stats_families
+from utils.profiler import profiler
+from utils.revisions import get_revision_stats, revision_sweeper
+from utils.redis_utils import (close_redis, connect_redis, get_cache_stats, ping_redis,
+                               start_cache_invalidation_listener, warm_redis_pool)
+from utils.websocket_manager import WS_PER_MESSAGE_DEFLATE, manager
+from utils.write_batcher import write_batcher
 import asyncio
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
+install_rate_limit()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Notes Service")
+# ---------------- Startup ----------------
+# Retry delays of the background warm-up (doubling up to the cap), in seconds
+WARMUP_BACKOFF_INITIAL = float(os.getenv("WARMUP_BACKOFF_INITIAL", "0.5"))
+WARMUP_BACKOFF_MAX = float(os.getenv("WARMUP_BACKOFF_MAX", "30"))
+
+# Set once each backend has answered, its indexes exist and its pool is warm
+readiness = {"database": False, "redis": False}
+
+
+async def warm_database() -> bool:
+    if not await ping_db():
+        return False
+    await notes_repo.ensure_indexes()
+    numbered = await notes_repo.assign_missing_revisions()
+    if numbered:
+        logger.info("Gave %d older notes a revision", numbered)
+    await search_backend.ensure_indexes()
+    await warm_db_pool()
+    return True
+
+
+async def warm_redis() -> bool:
+    if not await ping_redis():
+        return False
+    await warm_redis_pool()
+    return True
+
+
+async def warm_up(name: str, step) -> None:
+    """Run a warm-up step until it succeeds, backing off between attempts."""
+    delay = WARMUP_BACKOFF_INITIAL
+    while True:
+        try:
+            if await step():
+                readiness[name] = True
+                logger.info("%s ready", name)
+                return
+        except Exception as e:
+            logger.error("Warm-up of %s failed: %s", name, e)
+        logger.warning("%s not ready, retrying in %.1fs", name, delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_BACKOFF_MAX)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creating the clients does no I/O; reaching the servers happens in the
+    # background, so the process serves /ping right away and a brief outage
+    # delays readiness instead of stopping it from booting.
+    notes_repo.bind(connect_db())
+    connect_redis()
+    await start_cache_invalidation_listener()
+    await manager.start()
+    collab.start()
+    revision_sweeper.start(notes_repo)
+    warmups = [asyncio.create_task(warm_up("database", warm_database)),
+               asyncio.create_task(warm_up("redis", warm_redis))]
+    yield
+    for task in warmups:
+        task.cancel()
+    await asyncio.gather(*warmups, return_exceptions=True)
+    await revision_sweeper.stop()
+    await collab.stop()
+    await write_batcher.stop()
+    await manager.stop()
+    await close_redis()
+    close_db()
+
+
+app = FastAPI(title="Notes Service", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # allow frontend origin
 origins = [
@@ -26,7 +118,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+# Pure ASGI (no BaseHTTPMiddleware), so the endpoint runs in the same task and context
+app.add_middleware(RequestMetricsMiddleware, profiler=profiler)
 
 
 
@@ -34,23 +129,130 @@ app.add_middleware(
 def ping():
     return {"message": "pong"}
 
+@app.get("/ready")
+def ready():
+    """200 once the warm-up has reached every backend, 503 until then."""
+    status = dict(readiness, ready=all(readiness.values()))
+    return FastJSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/ws/metrics")
+def websocket_metrics():
+    return manager.get_metrics()
+
+@app.get("/cache/metrics")
+def cache_metrics():
+    return get_cache_stats()
+
+@app.get("/auth/metrics")
+def auth_metrics():
+    return get_auth_metrics()
+
+@app.get("/writes/metrics")
+def write_metrics():
+    return write_batcher.get_metrics()
+
+@app.get("/compression/metrics")
+def compression_metrics():
+    return get_compression_stats()
+
+@app.get("/revisions/metrics")
+def revision_metrics():
+    return get_revision_stats()
+
+# ---------------- Prometheus ----------------
+def collect_stats():
+    """The JSON metrics above, as Prometheus families. Gauges carry the worker pid."""
+    worker = {"worker": str(os.getpid())}
+    families = stats_families("notes_ws", manager.get_metrics(),
+                              counters=("sent", "dropped", "coalesced", "slow_disconnects", "send_errors",
+                                        "heartbeats", "idle_disconnects", "rejected", "batches",
+                                        "batched_events"),
+                              gauges=("users", "connections", "queue_depth_total", "queue_depth_max"),
+                              labels=worker)
+    cache = get_cache_stats()
+    for kind in ("hits", "misses"):
+        families.append((f"notes_cache_{kind}_total", "counter", f"Cache {kind} per tier.",
+                         [({"tier": tier}, cache[tier][kind]) for tier in ("local", "redis")]))
+    families += stats_families("notes_cache_local", cache["local"], counters=("evictions",),
+                               gauges=("entries", "bytes"), labels=worker)
+    families += stats_families("notes_cache_redis", cache["redis"], counters=("errors",))
+    families += stats_families("notes_cache_rebuild", cache["rebuilds"],
+                               counters=("rebuilds", "coalesced", "lock_waits", "stale_served"))
+    families += stats_families("notes_auth", get_auth_metrics(), counters=("hits", "misses", "expired", "invalid"),
+                               gauges=("cached_tokens",), labels=worker)
+    families += stats_families("notes_writes", write_batcher.get_metrics(), counters=("batches", "ops", "errors"),
+                               gauges=("pending",), labels=worker)
+    kinds = get_compression_stats()["kinds"]
+    for key, help_text in (("compressed", "Values stored compressed."),
+                           ("skipped", "Values over the threshold left as they were (no gain)."),
+                           ("bytes_in", "Bytes before compression."),
+                           ("bytes_out", "Bytes after compression."),
+                           ("spilled", "Values moved to GridFS."),
+                           ("spilled_bytes", "Bytes moved to GridFS.")):
+        families.append((f"notes_compression_{key}_total", "counter", help_text,
+                         [(dict(worker, kind=kind), stats[key]) for kind, stats in kinds.items()]))
+    families.append(("notes_compression_cpu_seconds_total", "counter", "CPU time spent compressing and decompressing.",
+                     [(dict(worker, kind=kind, op=op), stats[f"{op}_seconds"])
+                      for kind, stats in kinds.items() for op in ("compress", "decompress")]))
+    families.append(("notes_compression_ratio", "gauge", "Bytes before / after compression, over compressed values.",
+                     [(dict(worker, kind=kind), stats["ratio"]) for kind, stats in kinds.items()]))
+    families += stats_families("notes_revisions", get_revision_stats(),
+                               counters=("snapshots", "deltas", "rebuilds", "deltas_applied", "pruned"),
+                               labels=worker)
+    return families
+
+
+registry.collector(collect_stats)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # WebSocket endpoint
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str = None, userId: str = None):
-    if not token or not userId:
+async def websocket_endpoint(websocket: WebSocket, token: str = None, userId: str = None, since: int = None,
+                             device: str = None, batch: int = None):
+    """
+    The client may name itself with `device` (shown by GET /presence; the
+    User-Agent otherwise). The server sends {"type": "ping"} when the socket has
+    been quiet and closes it after WS_IDLE_TIMEOUT without any frame.
+
+    `batch` opts into batched delivery: events are collected for that many
+    milliseconds (capped by WS_BATCH_MAX_WINDOW_MS) and sent as one
+    {"type": "events", "data": [...]} frame. Such a client first gets a
+    {"type": "config"} frame with the granted window and whether
+    permessage-deflate applies (negotiated by the usual
+    Sec-WebSocket-Extensions offer).
+    """
+    if verify_ws_token(token, userId) is None:
         await websocket.close(code=1008)  # Policy violation
         return
+    if manager.at_capacity(userId):
+        await websocket.close(code=1008)  # Too many sockets for this user
+        return
 
-    logger.info(f"New WebSocket connection attempt for user {userId}")
+    connection_id = None
     
     try:
         # Accept the WebSocket connection
         await websocket.accept()
-        logger.info(f"WebSocket connection accepted for user {userId}")
         
         # Register the connection with the manager
-        await manager.connect(websocket, userId)
-        logger.info(f"User {userId} connected successfully")
+        batch_window_ms = manager.grant_batch_window(batch)
+        connection_id = await manager.connect(websocket, userId, device or websocket.headers.get("user-agent"),
+                                              batch_window_ms)
+        logger.debug("User %s connected", userId)
+        if batch is not None:
+            offered = "permessage-deflate" in websocket.headers.get("sec-websocket-extensions", "")
+            manager.send_to_connection(userId, connection_id, {"type": "config", "data": {
+                "batchWindowMs": batch_window_ms,
+                "compression": WS_PER_MESSAGE_DEFLATE and offered,
+            }})
+
+        # Resuming client: send what it missed since its last seen revision
+        if since is not None:
+            await notes.replay_missed_events(userId, connection_id, since)
         
         try:
             # Keep the connection alive and handle incoming messages
@@ -58,31 +260,50 @@ async def websocket_endpoint(websocket: WebSocket, token: str = None, userId: st
                 try:
                     # Wait for any message from client
                     data = await websocket.receive_text()
-                    logger.debug(f"Received message from user {userId}: {data}")
-                    
+                    manager.touch(userId, connection_id)
+
                     # Handle ping/pong for keep-alive
                     if data.strip().lower() == 'ping':
-                        logger.debug(f"Received ping from user {userId}, sending pong")
-                        await websocket.send_json({"type": "pong", "data": "pong"})
+                        manager.send_to_connection(userId, connection_id, {"type": "pong", "data": "pong"})
+                        continue
+
+                    try:
+                        message = loads(data)
+                    except ValueError:
+                        continue
+                    if not isinstance(message, dict):
+                        continue
+                    if message.get("type") == "ping":
+                        manager.send_to_connection(userId, connection_id, {"type": "pong", "data": "pong"})
+                    elif message.get("type") == "pong":
+                        continue  # Answer to a server heartbeat; touch() above is all it's for
+                    else:
+                        # Collaborative editing: join / edit / leave
+                        await collab.handle_message(userId, connection_id, message)
                         
                 except WebSocketDisconnect:
-                    logger.info(f"Client {userId} disconnected")
+                    logger.debug("Client %s disconnected", userId)
                     break
                 except Exception as e:
-                    logger.error(f"Error in WebSocket connection for {userId}: {str(e)}")
+                    logger.error("Error in WebSocket connection for %s: %s", userId, e)
                     break
                     
         except Exception as e:
-            logger.error(f"Error in WebSocket message loop for {userId}: {str(e)}")
+            logger.error("Error in WebSocket message loop for %s: %s", userId, e)
             
     except Exception as e:
-        logger.error(f"WebSocket connection error for {userId}: {str(e)}")
+        logger.error("WebSocket connection error for %s: %s", userId, e)
     finally:
-        # Ensure the connection is removed from the manager
-        await manager.disconnect(userId)
-        logger.info(f"Connection cleanup complete for user {userId}")
+        # Ensure only this connection is removed; the user's other devices stay connected
+        if connection_id is not None:
+            await collab.leave_all(userId, connection_id)
+            await manager.disconnect(userId, connection_id, close=False)
         
 app.include_router(notes.router)
 
 
-
+if __name__ == "__main__":
+    # Entry point of the packaged desktop backend (notes_app.spec)
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8001")),
+                ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
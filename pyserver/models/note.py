@@ -1,8 +1,48 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, field_validator
+from typing import List, Optional
+
+# Tags per note, and characters per tag
+MAX_TAGS = 20
+MAX_TAG_CHARS = 64
+
+
+def normalize_tags(tags: List[str]) -> List[str]:
+    """Trimmed, without blanks or repeats, in the order given. Raises ValueError past the limits."""
+    normalized: List[str] = []
+    for tag in tags:
+        tag = tag.strip()
+        if not tag or tag in normalized:
+            continue
+        if len(tag) > MAX_TAG_CHARS:
+            raise ValueError(f"tags are at most {MAX_TAG_CHARS} characters")
+        normalized.append(tag)
+    if len(normalized) > MAX_TAGS:
+        raise ValueError(f"at most {MAX_TAGS} tags per note")
+    return normalized
+
 
 class Note(BaseModel):
     title: str
     content: str
     id: Optional[str] = None
+    # Tags double as folders: a folder is a tag such as "work/clients"
+    tags: List[str] = []
+
+    _normalize_tags = field_validator("tags")(normalize_tags)
+
+
+class NoteTags(BaseModel):
+    """Body of PUT /notes/{id}/tags: the note's complete new set of tags."""
+    tags: List[str]
+
+    _normalize_tags = field_validator("tags")(normalize_tags)
+
+
+class ImportedNote(BaseModel):
+    """One line of a bulk import (same shape as a line of the export; other fields are ignored)."""
+    title: str
+    content: str
+    createdAt: Optional[str] = None
+    tags: List[str] = []
 
+    _normalize_tags = field_validator("tags")(normalize_tags)
@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.security import HTTPBearer
-from utils.db import notes_collection
-from models.note import Note
-from utils.redis_utils import get_cached_notes, set_cached_notes, invalidate_notes_cache
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from utils.codec import FastJSONResponse, RawJSONResponse, dumps, loads
+from utils.notes_repository import notes_repo, decode_cursor
+from utils.collab import collab
+from models.note import MAX_TAG_CHARS, ImportedNote, Note, NoteTags
+from utils.redis_utils import get_or_load_notes, invalidate_notes_cache
 from utils.websocket_manager import manager
-import jwt, os, logging, asyncio
+from utils.search import search_backend
+from utils.jwt import verify_jwt
+from utils.write_batcher import WRITE_BATCHING, write_batcher
+import os, logging, asyncio, codecs, zlib
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
 from fastapi import APIRouter
@@ -13,21 +20,14 @@ router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
-security = HTTPBearer()
+# Notes per insert_many / invalidation / notes_added event during a bulk import
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(1024 * 1024)))
+BULK_MAX_ERRORS = 100
+# Documents per Mongo round trip, and bytes per written chunk, during an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
 
-JWT_SECRET = os.getenv("JWT_SECRET", "secrethrejnrsibrgjfskib")
-ALGORITHM = "HS256"
-
-
-# ---------------- JWT verification ----------------
-def verify_jwt(token=Depends(security)):
-    try:
-        payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
 #for testing
 
 @router.get("/test")
@@ -44,23 +44,35 @@ async def add_note(note: Note, payload: dict = Depends(verify_jwt)):
             "title": note.title,
             "content": note.content,
             "userId": user_id,
+            "tags": note.tags,
             "createdAt": datetime.now(timezone.utc).isoformat()
         }
-        result = notes_collection.insert_one(note_data)
-        invalidate_notes_cache(user_id)
+        if WRITE_BATCHING:
+            # Shares one bulk write, invalidation and broadcast with concurrent inserts
+            new_note = await write_batcher.insert_note(note_data)
+            return {"message": "Note added successfully", "note": new_note}
+
+        inserted_id = await notes_repo.insert_note(note_data)
+        await invalidate_notes_cache(user_id)
 
         new_note = {
-            "id": str(result.inserted_id),
+            "id": inserted_id,
             "title": note.title,
             "content": note.content,
+            "tags": note.tags,
             "userId": user_id,
-            "createdAt": note_data["createdAt"]
+            "createdAt": note_data["createdAt"],
+            "updatedAt": note_data["updatedAt"],
+            "rev": note_data["rev"]
         }
 
+        await search_backend.index_note(user_id, new_note)
+
         # Broadcast
         await manager.send_to_user(user_id, {
             "type": "note_added",
             "data": new_note,
+            "rev": note_data["rev"],
             "timestamp": datetime.now(timezone.utc).isoformat()
         })
 
@@ -68,20 +80,428 @@ async def add_note(note: Note, payload: dict = Depends(verify_jwt)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------------- Bulk import ----------------
+async def iter_ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Lines of an NDJSON request body (gzip allowed), yielded as the upload arrives."""
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else None
+    buffer = b""
+    async for chunk in request.stream():
+        while chunk:
+            if decompressor is not None:
+                try:
+                    # Bounded output per step, so a small upload can't inflate into a huge buffer
+                    data = decompressor.decompress(chunk, BULK_MAX_LINE_BYTES)
+                except zlib.error:
+                    raise HTTPException(status_code=400, detail="Invalid gzip body")
+                chunk = decompressor.unconsumed_tail
+            else:
+                data, chunk = chunk, b""
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                yield line
+            if len(buffer) > BULK_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail="NDJSON line too long")
+    if buffer:
+        yield buffer
+
+
+def describe_error(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+
+async def import_batch(user_id: str, batch: List[Dict[str, Any]]) -> int:
+    """Insert one batch, then invalidate and notify once for all of it. Returns the last revision."""
+    first_rev, last_rev = await notes_repo.insert_notes(user_id, batch)
+    await invalidate_notes_cache(user_id)
+
+    summaries = []
+    for note in batch:
+        note_id = str(note["_id"])
+        await search_backend.index_note(user_id, {"id": note_id, "title": note["title"],
+                                                  "content": note["content"], "createdAt": note["createdAt"]})
+        summaries.append({"id": note_id, "title": note["title"], "preview": note["preview"], "size": note["size"],
+                          "tags": note["tags"], "createdAt": note["createdAt"], "updatedAt": note["updatedAt"],
+                          "rev": note["rev"]})
+
+    # One event for the whole batch; clients fetch bodies they need with GET /notes/{id}
+    await manager.send_to_user(user_id, {
+        "type": "notes_added",
+        "data": {"notes": summaries},
+        "firstRev": first_rev,
+        "rev": last_rev,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    return last_rev
+
+
+@router.post("/notes/bulk")
+async def bulk_import(request: Request, payload: dict = Depends(verify_jwt)):
+    """
+    Import notes from an NDJSON body, one {"title", "content", "createdAt"?, "tags"?} object
+    per line (the format of GET /notes/export). Send Content-Encoding: gzip for a
+    compressed upload. Lines are inserted in batches while the upload streams in;
+    invalid lines are skipped and reported by line number.
+    """
+    user_id = payload["_id"]
+    imported = failed = 0
+    errors: List[Dict[str, Any]] = []
+    rev = None
+    batch: List[Dict[str, Any]] = []
+    line_no = 0
+    try:
+        async for line in iter_ndjson_lines(request):
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                obj = loads(line)
+                if not isinstance(obj, dict):
+                    raise ValueError("expected a JSON object")
+                item = ImportedNote(**obj)
+            except ValueError as e:
+                failed += 1
+                if len(errors) < BULK_MAX_ERRORS:
+                    errors.append({"line": line_no, "error": describe_error(e)})
+                continue
+            note = {"title": item.title, "content": item.content, "tags": item.tags}
+            if item.createdAt:
+                note["createdAt"] = item.createdAt
+            batch.append(note)
+            if len(batch) >= BULK_BATCH_SIZE:
+                rev = await import_batch(user_id, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            rev = await import_batch(user_id, batch)
+            imported += len(batch)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Bulk import failed for %s after %d notes: %s", user_id, imported, e)
+        raise HTTPException(status_code=500, detail=f"Import failed after {imported} notes")
+
+    return {"imported": imported, "failed": failed, "errors": errors, "rev": rev}
+
 # ---------------- Get notes ----------------
+def pack_page(notes: list, next_cursor: Optional[str]) -> bytes:
+    """Cache form of a page: the next cursor on the first line, then the encoded body."""
+    return (next_cursor or "").encode() + b"\n" + dumps(notes)
+
+
+def unpack_page(page: bytes):
+    next_cursor, _, body = page.partition(b"\n")
+    return next_cursor.decode(), body
+
+
 @router.get("/notes")
-def get_notes(skip: int = 0, limit: int = 20, payload: dict = Depends(verify_jwt)):
+async def get_notes(limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                    view: Literal["full", "summary"] = "full",
+                    tag: Optional[str] = Query(None, min_length=1, max_length=MAX_TAG_CHARS),
+                    payload: dict = Depends(verify_jwt)):
+    """
+    Keyset-paginated list of the user's notes, newest first.
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    view=summary returns id, title, preview, size, tags and timestamps instead
+    of the full content; fetch a body with GET /notes/{id}.
+    tag=x lists only the notes tagged x (a folder); its cursors only work with
+    the same tag.
+    """
+    user_id = payload["_id"]
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def load_page():
+        notes, next_cursor = await notes_repo.list_notes(user_id, limit=limit, after=after,
+                                                         summary=(view == "summary"), tag=tag)
+        return pack_page(notes, next_cursor)
+
+    # Concurrent misses (e.g. every client refetching after one broadcast) share one rebuild.
+    # Filtered pages are versioned with the rest, so every write invalidates them too.
+    page_key = f"{view}:{limit}:{cursor or 'first'}"
+    if tag is not None:
+        page_key += f":tag:{tag}"
+    page = await get_or_load_notes(user_id, page_key, load_page)
+
+    # The body is already encoded; write it out without decoding it again
+    next_cursor, body = unpack_page(page)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return RawJSONResponse(body, headers=headers)
+
+# ---------------- Tags ----------------
+@router.get("/tags")
+async def get_tags(payload: dict = Depends(verify_jwt)):
+    """The user's tags (folders) and how many notes carry each, by name."""
+    user_id = payload["_id"]
+
+    async def load_tags():
+        return dumps({"tags": await notes_repo.list_tags(user_id)})
+
+    body = await get_or_load_notes(user_id, "tags", load_tags)
+    return RawJSONResponse(body)
+
+
+@router.put("/notes/{note_id}/tags")
+async def set_note_tags(note_id: str, body: NoteTags, payload: dict = Depends(verify_jwt)):
+    """Replace the tags of a note (moving it between folders is the same call)."""
+    user_id = payload["_id"]
+    try:
+        note_oid = ObjectId(note_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid note ID format")
+
+    result = await notes_repo.set_tags(note_oid, user_id, body.tags)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    rev, updated_at = result
+
+    await invalidate_notes_cache(user_id)
+    note = {"id": note_id, "tags": body.tags, "updatedAt": updated_at, "rev": rev}
+    await manager.send_to_user(user_id, {
+        "type": "note_tagged",
+        "data": note,
+        "rev": rev,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    return {"message": "Tags updated", "note": note}
+
+# ---------------- Search notes ----------------
+@router.get("/notes/search")
+async def search_notes(q: str = Query(..., min_length=1, max_length=256), limit: int = Query(20, ge=1, le=100),
+                       payload: dict = Depends(verify_jwt)):
+    """Ranked full-text search over title and content, with highlighted snippets."""
+    user_id = payload["_id"]
+    try:
+        return await search_backend.search(user_id, q, limit)
+    except Exception as e:
+        logger.error("Search failed for %s: %s", user_id, e)
+        raise HTTPException(status_code=500, detail="Search failed")
+
+# ---------------- Change feed ----------------
+@router.get("/notes/changes")
+async def get_changes(since: int = Query(0, ge=0), limit: int = Query(500, ge=1, le=1000),
+                      payload: dict = Depends(verify_jwt)):
+    """
+    Everything that changed after revision `since`: updated notes and tombstones
+    of deleted ones, oldest first. Call again with the returned `rev` while `hasMore`.
+    """
+    user_id = payload["_id"]
+    changes = await notes_repo.list_changes(user_id, since, limit)
+    return {
+        "changes": changes,
+        "rev": changes[-1]["rev"] if changes else since,
+        "hasMore": len(changes) == limit,
+    }
+
+
+# ---------------- Export ----------------
+@router.get("/notes/export")
+async def export_notes(payload: dict = Depends(verify_jwt), accept_encoding: Optional[str] = Header(None)):
+    """
+    All of the user's notes as NDJSON, streamed straight from a database cursor
+    (gzip-compressed when the client accepts it). The output can be fed back
+    into POST /notes/bulk.
+    """
+    user_id = payload["_id"]
+    gzipped = "gzip" in (accept_encoding or "").lower()
+
+    async def stream() -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16) if gzipped else None
+        lines: List[bytes] = []
+        size = 0
+        async for note in notes_repo.export_notes(user_id, EXPORT_BATCH_SIZE):
+            line = dumps({"id": str(note["_id"]), "title": note.get("title"), "content": note.get("content"),
+                          "tags": note.get("tags", []), "createdAt": note.get("createdAt"),
+                          "updatedAt": note.get("updatedAt"), "rev": note.get("rev")}) + b"\n"
+            lines.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                chunk = b"".join(lines)
+                lines, size = [], 0
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        chunk = b"".join(lines)
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    headers = {"Content-Disposition": 'attachment; filename="notes.ndjson"', "Vary": "Accept-Encoding"}
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers=headers)
+
+
+async def replay_missed_events(user_id: str, connection_id: str, since: int) -> None:
+    """
+    Bring a resumed socket up to date: replay from this worker's event log when it
+    holds every revision after `since`, otherwise send a page of the change feed.
+    """
+    current = await notes_repo.current_revision(user_id)
+    events = manager.event_log.since(user_id, since, current)
+    if events is not None:
+        for event in events:
+            manager.send_to_connection(user_id, connection_id, event)
+        return
+
+    changes = await notes_repo.list_changes(user_id, since, 500)
+    manager.send_to_connection(user_id, connection_id, {
+        "type": "sync",
+        "data": {
+            "changes": changes,
+            "rev": changes[-1]["rev"] if changes else since,
+            "hasMore": len(changes) == 500,
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+# ---------------- Get one note ----------------
+def note_etag(note: dict) -> str:
+    version = note.get("rev")
+    if version is None:
+        version = note.get("updatedAt") or note.get("createdAt")
+    return f'"{note["_id"]}-{version}"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Weak comparison, as required for If-None-Match."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+async def stream_note(note_id: str, note: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """The get_note JSON with the content read from storage and escaped chunk by chunk."""
+    head = dumps({"id": note_id, "title": note.get("title"), "tags": note.get("tags", []),
+                  "createdAt": note.get("createdAt"), "updatedAt": note.get("updatedAt"), "rev": note.get("rev")})
+    yield head[:-1] + b',"content":"'
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in notes_repo.stream_body(note):
+        text = decoder.decode(chunk)
+        if text:
+            yield dumps(text)[1:-1]
+    yield dumps(decoder.decode(b"", final=True))[1:-1] + b'"}'
+
+
+@router.get("/notes/{note_id}")
+async def get_note(note_id: str, payload: dict = Depends(verify_jwt),
+                   if_none_match: Optional[str] = Header(None)):
+    """Full body of one note. Supports If-None-Match so unchanged notes cost a 304."""
     user_id = payload["_id"]
-    cached_notes = get_cached_notes(user_id)
-    if cached_notes is not None:
-        return cached_notes
+    try:
+        note_oid = ObjectId(note_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid note ID format")
+
+    note = await notes_repo.find_note(note_oid, user_id, load_body=False)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
 
-    notes_cursor = notes_collection.find({"userId": user_id}).skip(skip).limit(limit)
-    notes = [{"id": str(note["_id"]), "title": note["title"], "content": note["content"]} for note in notes_cursor]
+    etag = note_etag(note)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
 
-    if notes:
-        set_cached_notes(user_id, notes)
-    return notes
+    if note.get("contentFile") is not None:
+        # Large body kept in GridFS: stream it instead of loading it into memory
+        return StreamingResponse(stream_note(note_id, note), media_type="application/json", headers=headers)
+
+    body = {
+        "id": note_id,
+        "title": note.get("title"),
+        "content": note.get("content"),
+        "tags": note.get("tags", []),
+        "createdAt": note.get("createdAt"),
+        "updatedAt": note.get("updatedAt"),
+        "rev": note.get("rev"),
+    }
+    return FastJSONResponse(body, headers=headers)
+
+# ---------------- Revisions ----------------
+@router.get("/notes/{note_id}/revisions")
+async def list_revisions(note_id: str, limit: int = Query(50, ge=1, le=200), before: Optional[int] = Query(None, ge=1),
+                         payload: dict = Depends(verify_jwt)):
+    """
+    Saved versions of a note, newest first, without their text (deleted notes
+    keep theirs too). Pass the returned `next` as `before` for older ones.
+    """
+    user_id = payload["_id"]
+    try:
+        note_oid = ObjectId(note_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid note ID format")
+
+    revisions = await notes_repo.list_revisions(note_oid, user_id, limit, before)
+    return {"revisions": revisions, "next": revisions[-1]["rev"] if len(revisions) == limit else None}
+
+
+@router.get("/notes/{note_id}/revisions/{rev}")
+async def get_revision(note_id: str, rev: int, payload: dict = Depends(verify_jwt)):
+    """One saved version of a note, with its text."""
+    user_id = payload["_id"]
+    try:
+        note_oid = ObjectId(note_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid note ID format")
+
+    version = await notes_repo.get_revision(note_oid, user_id, rev)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return {"id": note_id, **version}
+
+
+@router.post("/notes/{note_id}/revisions/{rev}/restore")
+async def restore_revision(note_id: str, rev: int, payload: dict = Depends(verify_jwt)):
+    """Make a saved version the current one, as a new revision. Undeletes the note if needed."""
+    user_id = payload["_id"]
+    try:
+        note_oid = ObjectId(note_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid note ID format")
+
+    version = await notes_repo.get_revision(note_oid, user_id, rev)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    result = await notes_repo.restore_note(note_oid, user_id, version["title"], version["content"])
+    if result is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    new_rev, undeleted = result
+
+    await invalidate_notes_cache(user_id)
+    # Tags and dates come from the note itself: clients replace their copy with the event's data
+    stored = await notes_repo.find_note(note_oid, user_id, load_body=False) or {}
+    note = {
+        "id": note_id,
+        "title": version["title"],
+        "content": version["content"],
+        "tags": stored.get("tags", []),
+        "userId": user_id,
+        "createdAt": stored.get("createdAt"),
+        "updatedAt": stored.get("updatedAt"),
+        "rev": new_rev
+    }
+    await search_backend.index_note(user_id, note)
+    # Sockets editing the note switch to the restored text
+    collab.reset(note_id, user_id, version["content"], version["title"] or "")
+
+    await manager.send_to_user(user_id, {
+        "type": "note_added" if undeleted else "note_updated",
+        "data": note,
+        "rev": new_rev,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+    return {"message": "Note restored", "note": note, "restoredFrom": rev}
 
 # ---------------- Delete note ----------------
 @router.delete("/notes/{note_id}")
@@ -93,35 +513,31 @@ async def delete_note(note_id: str, payload: dict = Depends(verify_jwt)):
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid note ID format")
 
-    note = notes_collection.find_one({"_id": note_oid, "userId": user_id})
+    note = await notes_repo.find_note(note_oid, user_id, load_body=False)
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
 
-    notes_collection.delete_one({"_id": note_oid, "userId": user_id})
-    invalidate_notes_cache(user_id)
+    # Soft delete; the tombstone lets offline clients learn about it via /notes/changes
+    rev = await notes_repo.delete_note(note_oid, user_id)
+    if rev is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    await invalidate_notes_cache(user_id)
+    await search_backend.remove_note(user_id, note_id)
+    # Sockets editing the note stop right away rather than at the next snapshot
+    collab.close(note_id, user_id, "Note was deleted")
 
     await manager.send_to_user(user_id, {
         "type": "note_deleted",
-        "data": {"id": note_id},
+        "data": {"id": note_id, "rev": rev},
+        "rev": rev,
         "timestamp": datetime.now(timezone.utc).isoformat()
     })
     
     return {"message": "Note deleted successfully"}
 
-# ---------------- WebSocket ----------------
-from fastapi import WebSocket, WebSocketDisconnect
-# ...
-@router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str, userId: str):
-    # verify token -> user_id (omitted here)
-    await websocket.accept()
-    connection_id = await manager.connect(websocket, userId)
-    try:
-        while True:
-            _ = await websocket.receive_json()
-            # handle messages...
-    except WebSocketDisconnect:
-        pass
-    finally:
-        # Starlette already closed the socket on disconnect, so avoid double-close
-        await manager.disconnect(userId, connection_id, close=False)
+# ---------------- Presence ----------------
+@router.get("/presence")
+async def get_presence(payload: dict = Depends(verify_jwt)):
+    """The user's devices with an open /ws socket, oldest connection first."""
+    return {"devices": await manager.online_devices(payload["_id"])}
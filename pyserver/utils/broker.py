@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+from utils.codec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# "redis" fans out across workers/hosts; "memory" keeps everything in this process.
+WS_BROKER = os.getenv("WS_BROKER", "redis").lower()
+CHANNEL_PREFIX = os.getenv("WS_CHANNEL_PREFIX", "notes:ws")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def user_channel(user_id: str) -> str:
+    return f"{CHANNEL_PREFIX}:user:{user_id}"
+
+
+BROADCAST_CHANNEL = f"{CHANNEL_PREFIX}:broadcast"
+
+
+class InMemoryBroker:
+    """
+    Single-process broker. There are no other workers to reach, so publish is a
+    no-op: the ConnectionManager already delivers to local sockets itself.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: Dict[str, Handler] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        pass
+
+
+class RedisBroker:
+    """
+    Redis pub/sub broker with one channel per user.
+    - Each worker subscribes only to channels of users connected to it.
+    - Messages carry the publishing worker's node id; a worker ignores its own
+      messages coming back from Redis, since it delivered them locally already.
+    """
+
+    def __init__(self, node_id: str = None) -> None:
+        self.node_id = node_id or uuid.uuid4().hex
+        self._handlers: Dict[str, Handler] = {}
+        self._pubsub = None
+        self._listener = None
+
+    @property
+    def _redis(self):
+        # Resolved at call time so the client can be swapped (tests, benchmarks).
+        from utils import redis_utils
+        return redis_utils.redis_client
+
+    async def start(self) -> None:
+        if self._listener is not None:
+            return
+        if self._redis is None:
+            # No client to subscribe with: deliver to this process only, as InMemoryBroker does
+            logger.warning("Redis client not configured; WebSocket events stay in this process")
+            return
+        self._pubsub = self._redis.pubsub()
+        # The listener subscribes the channels registered so far, so starting
+        # never waits on Redis (or fails because it is down)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception as e:
+                logger.error("Error closing pubsub: %s", e)
+            self._pubsub = None
+        self._handlers.clear()
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+        if self._pubsub is None or not self._pubsub.subscribed:
+            return  # picked up by the listener once it (re)subscribes
+        try:
+            await self._pubsub.subscribe(channel)
+        except Exception as e:
+            logger.error("Error subscribing to %s: %s", channel, e)
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self._handlers.pop(channel, None) is None or self._pubsub is None:
+            return
+        try:
+            await self._pubsub.unsubscribe(channel)
+        except Exception as e:
+            logger.error("Error unsubscribing from %s: %s", channel, e)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        if self._redis is None:
+            return
+        try:
+            envelope = dumps({"origin": self.node_id, "data": message})
+            await self._redis.publish(channel, envelope)
+        except Exception as e:
+            logger.error("Error publishing to %s: %s", channel, e)
+
+    async def _listen(self) -> None:
+        backoff = 0.5
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    if not self._handlers:
+                        await asyncio.sleep(0.1)
+                        continue
+                    # First subscription, or a retry while Redis is unreachable
+                    channels = list(self._handlers)
+                    await self._pubsub.subscribe(*channels)
+                    late = [channel for channel in self._handlers if channel not in channels]
+                    if late:
+                        await self._pubsub.subscribe(*late)
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                backoff = 0.5
+                if msg is None:
+                    continue
+                await self._dispatch(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Pub/sub listener error, retrying in %.1fs: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _dispatch(self, msg: Dict[str, Any]) -> None:
+        channel = msg.get("channel")
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return
+        envelope = loads(msg["data"])
+        if envelope.get("origin") == self.node_id:
+            return  # our own echo
+        try:
+            await handler(envelope["data"])
+        except Exception as e:
+            logger.error("Error handling message on %s: %s", channel, e)
+
+
+def create_broker():
+    # Without Redis configured there is nothing to fan out through (same test as connect_redis)
+    if WS_BROKER == "memory" or not (os.getenv("REDIS_URL") and os.getenv("REDIS_TOKEN")):
+        return InMemoryBroker()
+    return RedisBroker()
+
+
+# Shared by the WebSocket manager and the cache invalidation listener
+broker = create_broker()
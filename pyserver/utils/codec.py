@@ -0,0 +1,68 @@
+"""
+JSON encoding for API responses, cache payloads and WebSocket frames.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. Everything is encoded as compact UTF-8 JSON bytes, so a payload
+read from the cache can be written to an HTTP response as-is.
+"""
+import json
+from typing import Any, Mapping, Optional
+
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, Response
+
+from utils.metrics import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _default(obj: Any) -> str:
+    # ObjectId, datetime from older records, etc.
+    return str(obj)
+
+
+if orjson is not None:
+    CODEC_NAME = "orjson"
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    CODEC_NAME = "json"
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    with timed("serialize"):
+        return _dumps(obj)
+
+
+def dumps_str(obj: Any) -> str:
+    """Encode to str, for WebSocket text frames."""
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: same contract as JSONResponse, faster encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Response for a body that is already encoded JSON (e.g. a cache hit)."""
+    media_type = "application/json"
+
+    def __init__(self, content: bytes, status_code: int = 200, headers: Optional[Mapping[str, str]] = None,
+                 background: Optional[BackgroundTask] = None) -> None:
+        super().__init__(content, status_code=status_code, headers=headers, background=background)
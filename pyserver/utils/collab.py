@@ -0,0 +1,425 @@
+"""
+Real-time collaborative editing of a single note over the /ws socket.
+
+Edits travel as text operations (operational transformation, same model as
+ot.js). An operation is a list of components applied left to right:
+    positive int -> retain that many characters
+    str          -> insert the string
+    negative int -> delete that many characters
+Lengths count Unicode code points.
+
+The server is the sequencer: every accepted operation gets the next sequence
+number of the note. A client sends the sequence number its operation was
+based on; the server transforms it against everything accepted since, applies
+it, acks the sender and forwards only the transformed delta to the other
+sockets editing the note. Content is written to Mongo as periodic snapshots
+instead of once per keystroke. If the note is deleted meanwhile, its editors
+get note_closed and the session ends.
+
+Sessions live in the worker process that holds the sockets, so with several
+workers the /ws route needs per-user affinity for editing.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from bson.objectid import ObjectId
+
+from utils.notes_repository import notes_repo
+from utils.redis_utils import invalidate_notes_cache
+from utils.search import search_backend
+from utils.websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# How often dirty sessions are snapshotted to Mongo (seconds)
+COLLAB_FLUSH_INTERVAL = float(os.getenv("COLLAB_FLUSH_INTERVAL", "2.0"))
+# Accepted operations kept per note for transforming late edits
+COLLAB_HISTORY_SIZE = int(os.getenv("COLLAB_HISTORY_SIZE", "500"))
+# Upper bound on components in one client operation
+COLLAB_MAX_OP_COMPONENTS = int(os.getenv("COLLAB_MAX_OP_COMPONENTS", "10000"))
+
+Component = Union[int, str]
+Operation = List[Component]
+
+
+class OperationError(ValueError):
+    pass
+
+
+# ---------------- Text operations ----------------
+def _is_retain(c: Component) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c > 0
+
+
+def _is_delete(c: Component) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c < 0
+
+
+def _is_insert(c: Component) -> bool:
+    return isinstance(c, str)
+
+
+class _OpBuilder:
+    """Builds a normalized operation (merged runs, inserts before deletes)."""
+
+    def __init__(self) -> None:
+        self.ops: Operation = []
+
+    def retain(self, n: int) -> None:
+        if n <= 0:
+            return
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+
+    def insert(self, s: str) -> None:
+        if not s:
+            return
+        ops = self.ops
+        if ops and _is_insert(ops[-1]):
+            ops[-1] += s
+        elif ops and _is_delete(ops[-1]):
+            if len(ops) > 1 and _is_insert(ops[-2]):
+                ops[-2] += s
+            else:
+                ops.insert(len(ops) - 1, s)
+        else:
+            ops.append(s)
+
+    def delete(self, n: int) -> None:
+        n = abs(n)
+        if n == 0:
+            return
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+
+
+def validate_operation(op: Any) -> Operation:
+    if not isinstance(op, list) or len(op) > COLLAB_MAX_OP_COMPONENTS:
+        raise OperationError("ops must be a list of components")
+    builder = _OpBuilder()
+    for c in op:
+        if _is_retain(c):
+            builder.retain(c)
+        elif _is_delete(c):
+            builder.delete(c)
+        elif _is_insert(c):
+            builder.insert(c)
+        else:
+            raise OperationError(f"Invalid component: {c!r}")
+    return builder.ops
+
+
+def base_length(op: Operation) -> int:
+    return sum(abs(c) if isinstance(c, int) else 0 for c in op)
+
+
+def apply_operation(text: str, op: Operation) -> str:
+    if base_length(op) != len(text):
+        raise OperationError("Operation base length does not match the document")
+    parts: List[str] = []
+    pos = 0
+    for c in op:
+        if _is_retain(c):
+            parts.append(text[pos:pos + c])
+            pos += c
+        elif _is_insert(c):
+            parts.append(c)
+        else:
+            pos -= c
+    return "".join(parts)
+
+
+def transform(op1: Operation, op2: Operation) -> Tuple[Operation, Operation]:
+    """
+    Given two operations on the same document, return (op1', op2') such that
+    apply(apply(doc, op1), op2') == apply(apply(doc, op2), op1').
+    Inserts of op1 win ties at the same position.
+    """
+    if base_length(op1) != base_length(op2):
+        raise OperationError("Both operations must have the same base length")
+
+    a_prime, b_prime = _OpBuilder(), _OpBuilder()
+    i1 = i2 = 0
+    a = op1[0] if op1 else None
+    b = op2[0] if op2 else None
+
+    def next1():
+        nonlocal i1
+        i1 += 1
+        return op1[i1] if i1 < len(op1) else None
+
+    def next2():
+        nonlocal i2
+        i2 += 1
+        return op2[i2] if i2 < len(op2) else None
+
+    while a is not None or b is not None:
+        if a is not None and _is_insert(a):
+            a_prime.insert(a)
+            b_prime.retain(len(a))
+            a = next1()
+            continue
+        if b is not None and _is_insert(b):
+            a_prime.retain(len(b))
+            b_prime.insert(b)
+            b = next2()
+            continue
+        if a is None or b is None:
+            raise OperationError("Operations are incompatible")
+
+        if _is_retain(a) and _is_retain(b):
+            n = min(a, b)
+            a_prime.retain(n)
+            b_prime.retain(n)
+            a, b = (a - n) or next1(), (b - n) or next2()
+        elif _is_delete(a) and _is_delete(b):
+            n = min(-a, -b)
+            a, b = (a + n) or next1(), (b + n) or next2()
+        elif _is_delete(a) and _is_retain(b):
+            n = min(-a, b)
+            a_prime.delete(n)
+            a, b = (a + n) or next1(), (b - n) or next2()
+        else:  # retain a, delete b
+            n = min(a, -b)
+            b_prime.delete(n)
+            a, b = (a - n) or next1(), (b + n) or next2()
+
+    return a_prime.ops, b_prime.ops
+
+
+# ---------------- Sessions ----------------
+class NoteSession:
+    """Authoritative in-memory state of one note while it is being edited."""
+
+    def __init__(self, note_id: str, user_id: str, content: str, title: str = "") -> None:
+        self.note_id = note_id
+        self.user_id = user_id
+        self.title = title
+        self.content = content
+        self.seq = 0
+        # (seq, op) for the most recent accepted operations
+        self.history: Deque[Tuple[int, Operation]] = deque(maxlen=COLLAB_HISTORY_SIZE)
+        self.participants: Set[str] = set()
+        self.dirty = False
+
+    def apply_client_op(self, base_seq: int, op: Operation) -> Operation:
+        """Transform op (made against base_seq) onto the current state, apply it and return it."""
+        if base_seq > self.seq:
+            raise OperationError("Unknown base sequence")
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        if base_seq < self.seq and base_seq + 1 < oldest:
+            raise OperationError("Base sequence is too old, rejoin the note")
+
+        for seq, concurrent in self.history:
+            if seq > base_seq:
+                op, _ = transform(op, concurrent)
+
+        self.content = apply_operation(self.content, op)
+        self.seq += 1
+        self.history.append((self.seq, op))
+        self.dirty = True
+        return op
+
+
+class CollabHub:
+    """Routes edit-protocol messages from /ws sockets to per-note sessions."""
+
+    def __init__(self, flush_interval: float = COLLAB_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+        self._sessions: Dict[str, NoteSession] = {}
+        # (user_id, connection_id) -> note ids joined by that socket
+        self._joined: Dict[Tuple[str, str], Set[str]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_all()
+
+    async def handle_message(self, user_id: str, connection_id: str, message: Dict[str, Any]) -> bool:
+        """Handle an edit-protocol message. Returns False if the type is not ours."""
+        msg_type = message.get("type")
+        note_id = message.get("noteId")
+        if msg_type not in ("join", "edit", "leave"):
+            return False
+        if not isinstance(note_id, str):
+            self._reply(user_id, connection_id, {"type": "error", "data": "noteId is required"})
+            return True
+
+        if msg_type == "join":
+            await self.join(user_id, connection_id, note_id)
+        elif msg_type == "edit":
+            self.edit(user_id, connection_id, note_id, message.get("seq"), message.get("ops"))
+        else:
+            await self.leave(user_id, connection_id, note_id)
+        return True
+
+    async def join(self, user_id: str, connection_id: str, note_id: str) -> None:
+        session = self._sessions.get(note_id)
+        if session is None or session.user_id != user_id:
+            try:
+                note = await notes_repo.find_note(ObjectId(note_id), user_id)
+            except Exception:
+                note = None
+            if not note:
+                self._reply(user_id, connection_id, {"type": "error", "noteId": note_id, "data": "Note not found"})
+                return
+            # Another join may have created it while we were loading
+            session = self._sessions.setdefault(note_id, NoteSession(note_id, user_id, note.get("content", ""), note.get("title", "")))
+
+        session.participants.add(connection_id)
+        self._joined.setdefault((user_id, connection_id), set()).add(note_id)
+        self._reply(user_id, connection_id, {
+            "type": "note_snapshot",
+            "noteId": note_id,
+            "seq": session.seq,
+            "content": session.content,
+        })
+
+    def edit(self, user_id: str, connection_id: str, note_id: str, base_seq: Any, ops: Any) -> None:
+        session = self._sessions.get(note_id)
+        if session is None or session.user_id != user_id or connection_id not in session.participants:
+            self._reply(user_id, connection_id, {"type": "edit_rejected", "noteId": note_id, "reason": "not joined"})
+            return
+        try:
+            if not isinstance(base_seq, int):
+                raise OperationError("seq is required")
+            op = session.apply_client_op(base_seq, validate_operation(ops))
+        except OperationError as e:
+            self._reply(user_id, connection_id, {
+                "type": "edit_rejected", "noteId": note_id, "reason": str(e), "seq": session.seq,
+            })
+            return
+
+        self._reply(user_id, connection_id, {"type": "edit_ack", "noteId": note_id, "seq": session.seq})
+        delta = {"type": "note_delta", "noteId": note_id, "seq": session.seq, "ops": op}
+        for cid in session.participants:
+            if cid != connection_id:
+                manager.send_to_connection(user_id, cid, delta, reliable=True)
+
+    async def leave(self, user_id: str, connection_id: str, note_id: str) -> None:
+        joined = self._joined.get((user_id, connection_id))
+        if joined is not None:
+            joined.discard(note_id)
+            if not joined:
+                self._joined.pop((user_id, connection_id), None)
+
+        session = self._sessions.get(note_id)
+        if session is None or session.user_id != user_id:
+            return
+        session.participants.discard(connection_id)
+        if not session.participants:
+            await self._flush(session)
+            # Only drop it if nobody joined while we were flushing
+            if not session.participants:
+                self._sessions.pop(note_id, None)
+
+    async def leave_all(self, user_id: str, connection_id: str) -> None:
+        """Called when a socket goes away."""
+        for note_id in list(self._joined.get((user_id, connection_id), ())):
+            await self.leave(user_id, connection_id, note_id)
+
+    def reset(self, note_id: str, user_id: str, content: str, title: str) -> None:
+        """Replace the text of a note being edited (e.g. after a restore); participants get a fresh snapshot."""
+        session = self._sessions.get(note_id)
+        if session is None or session.user_id != user_id:
+            return
+        session.content = content
+        session.title = title
+        session.seq += 1
+        # Edits made against the old text can't be transformed onto this one
+        session.history.clear()
+        session.dirty = False
+        for cid in session.participants:
+            self._reply(user_id, cid, {"type": "note_snapshot", "noteId": note_id, "seq": session.seq,
+                                       "content": content})
+
+    def close(self, note_id: str, user_id: str, reason: str) -> None:
+        """End the session of a note that can no longer be saved (e.g. deleted); its editors are told why."""
+        session = self._sessions.get(note_id)
+        if session is None or session.user_id != user_id:
+            return
+        del self._sessions[note_id]
+        session.dirty = False
+        for cid in session.participants:
+            joined = self._joined.get((user_id, cid))
+            if joined is not None:
+                joined.discard(note_id)
+                if not joined:
+                    self._joined.pop((user_id, cid), None)
+            self._reply(user_id, cid, {"type": "note_closed", "noteId": note_id, "reason": reason})
+        session.participants.clear()
+
+    def _reply(self, user_id: str, connection_id: str, message: Dict[str, Any]) -> None:
+        # A client that misses an ack, snapshot or rejection loses track of the session
+        manager.send_to_connection(user_id, connection_id, message, reliable=True)
+
+    async def _flush(self, session: NoteSession) -> None:
+        if not session.dirty:
+            return
+        session.dirty = False
+        content, seq = session.content, session.seq
+        try:
+            rev = await notes_repo.update_note_content(ObjectId(session.note_id), session.user_id, content)
+            if rev is None:
+                logger.info("Note %s was deleted while being edited", session.note_id)
+                self.close(session.note_id, session.user_id, "Note was deleted")
+                return
+            await invalidate_notes_cache(session.user_id)
+            # Tags change outside the session, so they (and the dates) come from the stored note
+            stored = await notes_repo.find_note(ObjectId(session.note_id), session.user_id, load_body=False) or {}
+            note = {
+                "id": session.note_id,
+                "title": session.title,
+                "content": content,
+                "tags": stored.get("tags", []),
+                "userId": session.user_id,
+                "createdAt": stored.get("createdAt"),
+                "updatedAt": stored.get("updatedAt"),
+                "rev": rev
+            }
+            await search_backend.index_note(session.user_id, note)
+        except Exception as e:
+            session.dirty = True
+            logger.error("Error saving snapshot of note %s: %s", session.note_id, e)
+            return
+        # List views replace the note with the event's data, so it carries the whole note
+        await manager.send_to_user(session.user_id, {
+            "type": "note_updated",
+            "data": {**note, "seq": seq},
+            "rev": rev,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+
+    async def flush_all(self) -> None:
+        for session in list(self._sessions.values()):
+            await self._flush(session)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_all()
+            except Exception as e:
+                logger.error("Error flushing collaborative sessions: %s", e)
+
+
+# Global instance
+collab = CollabHub()
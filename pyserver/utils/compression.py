@@ -0,0 +1,154 @@
+"""
+Transparent compression for cache values and stored note bodies.
+
+Uses zstd when the zstandard package is installed and falls back to zlib
+otherwise. Compressed values are self-describing: a two-byte header names
+the codec, so values written with either codec (or left uncompressed) can
+always be read back. Plain values never start with a NUL byte, since they
+are JSON, a page cursor or UTF-8 text.
+
+Values below the caller's threshold, and values that don't get smaller,
+are stored as they are. Per kind ("cache", "body", "revision") the module
+counts bytes in and out and the CPU time spent, for /metrics.
+"""
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+COMPRESSION_CODEC = os.getenv("COMPRESSION_CODEC", "zstd" if zstandard is not None else "zlib").lower()
+if COMPRESSION_CODEC == "zstd" and zstandard is None:
+    COMPRESSION_CODEC = "zlib"
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "3" if COMPRESSION_CODEC == "zstd" else "1"))
+
+ZSTD_HEADER = b"\x00S"
+ZLIB_HEADER = b"\x00Z"
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _zstd_compressor():
+    # zstandard contexts are not thread-safe; SQLite and the executor use other threads
+    compressor = getattr(_local, "compressor", None)
+    if compressor is None:
+        compressor = _local.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    return compressor
+
+
+def _zstd_decompressor():
+    decompressor = getattr(_local, "decompressor", None)
+    if decompressor is None:
+        decompressor = _local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def _new_stats() -> Dict[str, float]:
+    # spilled: values too big to store inline, written to GridFS instead
+    return {"compressed": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "compress_seconds": 0.0,
+            "decompressed": 0, "decompress_seconds": 0.0, "spilled": 0, "spilled_bytes": 0}
+
+
+_stats["cache"] = _new_stats()
+_stats["body"] = _new_stats()
+_stats["revision"] = _new_stats()
+
+
+def _record(kind: str, **amounts: float) -> None:
+    with _lock:
+        stats = _stats.get(kind)
+        if stats is None:
+            stats = _stats[kind] = _new_stats()
+        for key, amount in amounts.items():
+            stats[key] += amount
+
+
+def compress(data: bytes, kind: str, min_bytes: int) -> bytes:
+    """`data` with a codec header if it is at least min_bytes (0 = never) and compression pays off."""
+    if min_bytes <= 0 or len(data) < min_bytes:
+        return data
+    start = time.thread_time()
+    if COMPRESSION_CODEC == "zstd":
+        packed = ZSTD_HEADER + _zstd_compressor().compress(data)
+    else:
+        packed = ZLIB_HEADER + zlib.compress(data, COMPRESSION_LEVEL)
+    elapsed = time.thread_time() - start
+    if len(packed) >= len(data):
+        _record(kind, skipped=1, compress_seconds=elapsed)
+        return data
+    _record(kind, compressed=1, bytes_in=len(data), bytes_out=len(packed), compress_seconds=elapsed)
+    return packed
+
+
+def decompress(data: bytes, kind: str) -> bytes:
+    """Inverse of compress(); plain values are returned as they are."""
+    header = data[:2]
+    if header not in (ZSTD_HEADER, ZLIB_HEADER):
+        return data
+    start = time.thread_time()
+    if header == ZSTD_HEADER:
+        plain = _zstd_decompressor().decompress(memoryview(data)[2:])
+    else:
+        plain = zlib.decompress(memoryview(data)[2:])
+    _record(kind, decompressed=1, decompress_seconds=time.thread_time() - start)
+    return plain
+
+
+def record_spill(kind: str, size: int) -> None:
+    _record(kind, spilled=1, spilled_bytes=size)
+
+
+class StreamDecompressor:
+    """Incremental decompress() for values read in chunks (GridFS bodies)."""
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self._head = b""
+        self._inner = None
+        self._plain = False
+        self._seconds = 0.0
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._inner is None and not self._plain:
+            self._head += chunk
+            if len(self._head) < 2:
+                return b""
+            chunk, header, self._head = self._head, self._head[:2], b""
+            if header == ZSTD_HEADER:
+                self._inner = zstandard.ZstdDecompressor().decompressobj()
+            elif header == ZLIB_HEADER:
+                self._inner = zlib.decompressobj()
+            else:
+                self._plain = True
+                return chunk
+            chunk = chunk[2:]
+        if self._plain:
+            return chunk
+        start = time.thread_time()
+        out = self._inner.decompress(chunk)
+        self._seconds += time.thread_time() - start
+        return out
+
+    def close(self) -> bytes:
+        """Whatever is left: buffered output, or a value shorter than the header."""
+        rest, self._head = self._head, b""
+        if self._inner is not None:
+            start = time.thread_time()
+            rest = self._inner.flush()
+            _record(self.kind, decompressed=1, decompress_seconds=self._seconds + time.thread_time() - start)
+        return rest
+
+
+def get_compression_stats() -> Dict[str, Any]:
+    with _lock:
+        stats = {kind: dict(values) for kind, values in _stats.items()}
+    for values in stats.values():
+        values["ratio"] = values["bytes_in"] / values["bytes_out"] if values["bytes_out"] else 0.0
+    return {"codec": COMPRESSION_CODEC, "level": COMPRESSION_LEVEL, "kinds": stats}
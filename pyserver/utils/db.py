@@ -1,25 +1,83 @@
-from pymongo import MongoClient, errors
+import asyncio
+import logging
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# "mongo", or "sqlite" for an embedded database file (the default in the
+# packaged desktop build, which then needs no network at all)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite" if getattr(sys, "frozen", False) else "mongo").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.expanduser("~"), ".notes-app", "notes.db"))
+
 DB_URI = os.getenv("DB_URI")
 DB_NAME = os.getenv("DB_NAME", "notes_app")
 
-print("*"*10, "DB_URI:", DB_URI, "*"*10)
-print("*"*10, "DB_NAME:", DB_NAME, "*"*10)
-
-try:
-    client = MongoClient(DB_URI, serverSelectionTimeoutMS=5000)
-    
-    client.admin.command("ping")
-    
-    db = client[DB_NAME]
-    print("*"*10, "Connected to DB:", db.name, "*"*10)
-    
-    notes_collection = db["notes"]
-
-except errors.ServerSelectionTimeoutError as err:
-    print("Failed to connect to MongoDB:", err)
-    notes_collection = None
+# Connection pool sizing (per worker process)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Connections opened during warm-up so the first requests don't pay for the handshakes
+MONGO_WARM_CONNECTIONS = int(os.getenv("MONGO_WARM_CONNECTIONS", str(max(MONGO_MIN_POOL_SIZE, 4))))
+# Acknowledge writes only once they are in the on-disk journal
+MONGO_JOURNAL = os.getenv("MONGO_JOURNAL", "0") == "1"
+
+# Created by connect_db() from the lifespan handler, never at import time.
+# With SQLite both name the same SQLiteDatabase.
+client = None
+db = None
+
+
+def connect_db():
+    """
+    Create the shared client and return the database. Idempotent.
+    The driver (Motor and pymongo, or sqlite3) is imported here rather than
+    at module load. Motor connects lazily, so this never blocks startup;
+    SQLite opens the file and creates the schema.
+    """
+    global client, db
+    if client is None:
+        if STORAGE_BACKEND == "sqlite":
+            from utils.sqlite_db import SQLiteDatabase
+            client = db = SQLiteDatabase(SQLITE_PATH)
+            return db
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(
+            DB_URI,
+            serverSelectionTimeoutMS=5000,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            **({"journal": True} if MONGO_JOURNAL else {}),
+        )
+        db = client[DB_NAME]
+    return db
+
+
+def close_db() -> None:
+    global client, db
+    if client is not None:
+        client.close()
+        client = db = None
+
+
+async def ping_db() -> bool:
+    """Check that the database is reachable."""
+    try:
+        if STORAGE_BACKEND == "sqlite":
+            await db.ping()
+        else:
+            await client.admin.command("ping")
+        logger.info("Connected to %s database %s", STORAGE_BACKEND, db.name)
+        return True
+    except Exception as err:
+        logger.error("Failed to connect to %s: %s", STORAGE_BACKEND, err)
+        return False
+
+
+async def warm_db_pool(connections: int = MONGO_WARM_CONNECTIONS) -> None:
+    """Open `connections` pooled connections up front by running that many pings at once."""
+    if STORAGE_BACKEND != "sqlite" and connections > 1:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)),
+                             return_exceptions=True)
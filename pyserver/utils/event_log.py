@@ -0,0 +1,62 @@
+import os
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Events kept per user, and users kept per worker
+EVENT_LOG_SIZE = int(os.getenv("EVENT_LOG_SIZE", "256"))
+EVENT_LOG_USERS = int(os.getenv("EVENT_LOG_USERS", "10000"))
+
+
+class EventLog:
+    """
+    Bounded, per-user log of recent revisioned events (note_added, note_deleted...),
+    used to replay what a reconnecting socket missed without touching the database.
+    An event covers the revision range [first_rev, rev]; most cover a single one.
+    Least recently active users are evicted first.
+    """
+
+    def __init__(self, size: int = EVENT_LOG_SIZE, max_users: int = EVENT_LOG_USERS) -> None:
+        self.size = size
+        self.max_users = max_users
+        self._logs: "OrderedDict[str, Deque[Tuple[int, int, Dict[str, Any]]]]" = OrderedDict()
+
+    def append(self, user_id: str, rev: int, message: Dict[str, Any], first_rev: Optional[int] = None) -> None:
+        first_rev = rev if first_rev is None else first_rev
+        log = self._logs.get(user_id)
+        if log is None:
+            log = self._logs[user_id] = deque(maxlen=self.size)
+            if len(self._logs) > self.max_users:
+                self._logs.popitem(last=False)
+        else:
+            self._logs.move_to_end(user_id)
+
+        if log and first_rev <= log[-1][1]:
+            # Late or duplicate delivery: ignore duplicates, keep the log ordered
+            if any(r == rev for _, r, _ in log):
+                return
+            ordered = sorted(list(log) + [(first_rev, rev, message)], key=lambda item: item[1])
+            log.clear()
+            log.extend(ordered)
+            return
+        log.append((first_rev, rev, message))
+
+    def since(self, user_id: str, since: int, current: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Events covering since < rev <= current, or None if the log can't prove it
+        has all of them (every revision in that range, with no gaps).
+        """
+        if current <= since:
+            return []
+        log = self._logs.get(user_id)
+        if not log:
+            return None
+        events = []
+        expected = since + 1
+        for first_rev, rev, message in log:
+            if rev < expected:
+                continue
+            if first_rev > expected:
+                return None
+            events.append(message)
+            expected = rev + 1
+        return events if expected > current else None
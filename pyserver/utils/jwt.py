@@ -1,17 +1,99 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
+import hashlib
 import jwt
 import os
+import time
 import dotenv
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 dotenv.load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET", "secrethrejnrsibrgjfskib")
+ALGORITHM = "HS256"
+# Max verified tokens remembered per worker (0 disables the cache)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
 security = HTTPBearer()  # expects Authorization: Bearer <token>
 
-def verify_jwt(token=Depends(security)):
+# token hash -> (payload, exp or None)
+_verified: "OrderedDict[bytes, Tuple[Dict[str, Any], Optional[float]]]" = OrderedDict()
+auth_stats = {"hits": 0, "misses": 0, "expired": 0, "invalid": 0, "decode_seconds": 0.0, "decode_max_seconds": 0.0}
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """
+    Verify a JWT and return its payload.
+    Verified tokens are remembered (keyed by a hash of the token, never the
+    token itself) until their exp, so repeat requests skip the HMAC check.
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError like jwt.decode.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _verified.get(key)
+    if cached is not None:
+        payload, exp = cached
+        if exp is None or exp > time.time():
+            _verified.move_to_end(key)
+            auth_stats["hits"] += 1
+            return payload
+        _verified.pop(key, None)
+        auth_stats["expired"] += 1
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    auth_stats["misses"] += 1
+    start = time.perf_counter()
     try:
-        payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
-        return payload
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        auth_stats["expired"] += 1
+        raise
+    except jwt.InvalidTokenError:
+        auth_stats["invalid"] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        auth_stats["decode_seconds"] += elapsed
+        auth_stats["decode_max_seconds"] = max(auth_stats["decode_max_seconds"], elapsed)
+
+    if JWT_CACHE_SIZE > 0:
+        exp = payload.get("exp")
+        _verified[key] = (payload, float(exp) if isinstance(exp, (int, float)) else None)
+        if len(_verified) > JWT_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return payload
+
+
+async def verify_jwt(token=Depends(security)):
+    try:
+        return decode_token(token.credentials)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def verify_ws_token(token: Optional[str], user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Check a WebSocket handshake's token; it must be valid and belong to user_id."""
+    if not token or not user_id:
+        return None
+    try:
+        payload = decode_token(token)
+    except jwt.InvalidTokenError:
+        return None
+    if str(payload.get("_id")) != user_id:
+        return None
+    return payload
+
+
+def get_auth_metrics() -> Dict[str, Any]:
+    lookups = auth_stats["hits"] + auth_stats["misses"]
+    decodes = auth_stats["misses"]
+    return {
+        "cached_tokens": len(_verified),
+        "cache_capacity": JWT_CACHE_SIZE,
+        "hits": auth_stats["hits"],
+        "misses": auth_stats["misses"],
+        "hit_rate": auth_stats["hits"] / lookups if lookups else 0.0,
+        "expired": auth_stats["expired"],
+        "invalid": auth_stats["invalid"],
+        "decode_avg_ms": auth_stats["decode_seconds"] / decodes * 1000 if decodes else 0.0,
+        "decode_max_ms": auth_stats["decode_max_seconds"] * 1000,
+    }
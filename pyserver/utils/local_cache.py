@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with per-entry TTL and size accounting.
+
+    Entries belong to a group (the user id) so everything cached for a user can
+    be dropped at once when an invalidation arrives. Each group has a
+    generation counter: a caller that read from a slower tier can pass the
+    generation it saw, and the value is discarded if the group was invalidated
+    in the meantime.
+
+    Generations are drawn from one counter and kept for the max_entries most
+    recently invalidated groups only. Every other group reports the highest
+    generation forgotten so far: still different from any generation read
+    before one of its invalidations, so a stale value is never accepted
+    (forgetting can at worst turn away a fresh one).
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, size, expires_at, group)
+        self._entries: "OrderedDict[str, Tuple[Any, int, float, str]]" = OrderedDict()
+        self._groups: Dict[str, Set[str]] = {}
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        # Last generation handed out, and the generation of groups not tracked
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self, group: str) -> int:
+        return self._generations.get(group, self._floor)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, size: int, group: str,
+            generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if generation is not None and generation != self._generations.get(group, self._floor):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + (ttl or self.ttl), group)
+            self._groups.setdefault(group, set()).add(key)
+            self.size += size
+            while self._entries and (self.size > self.max_bytes or len(self._entries) > self.max_entries):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate_group(self, group: str) -> None:
+        with self._lock:
+            self._counter += 1
+            self._generations[group] = self._counter
+            self._generations.move_to_end(group)
+            while len(self._generations) > self.max_entries:
+                _, forgotten = self._generations.popitem(last=False)
+                self._floor = max(self._floor, forgotten)
+            for key in list(self._groups.get(group, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._generations.clear()
+            # Never hand out a generation again that was seen before the clear
+            self._floor = self._counter
+            self.size = 0
+
+    def _remove(self, key: str) -> None:
+        _, size, _, group = self._entries.pop(key)
+        self.size -= size
+        keys = self._groups.get(group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._groups.pop(group, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
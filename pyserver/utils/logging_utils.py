@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+# Records allowed per message template per window; the rest are counted and summarized
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "10"))
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per (logger, message template) every
+    `window` seconds. Keyed on the unformatted template, so "Error sending to
+    %s" from a thousand dead sockets is one key; the first record after a
+    window in which records were dropped says how many.
+    """
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW) -> None:
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # key -> [window start, records let through, records dropped]
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                dropped = bucket[2] if bucket is not None else 0
+                self._buckets[key] = [now, 1, 0]
+                if len(self._buckets) > 10000:
+                    self._buckets.clear()
+                if dropped:
+                    record.msg = f"{record.msg} [{dropped} similar messages suppressed]"
+                return True
+            if bucket[1] < self.limit:
+                bucket[1] += 1
+                return True
+            bucket[2] += 1
+            return False
+
+
+def install_rate_limit() -> None:
+    """Rate-limit everything that reaches the root logger's handlers."""
+    rate_limit = RateLimitFilter()
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(rate_limit)
@@ -0,0 +1,298 @@
+"""
+Prometheus metrics and per-request timing.
+
+A small in-house registry (counters, gauges, histograms, and collectors that
+read existing stats dicts at scrape time) rendered in the Prometheus text
+format by GET /metrics.
+
+Each HTTP request carries a timing breakdown in a context variable: code on
+the hot path wraps its Mongo, Redis, serialization and fan-out work in
+`timed(component)`, and RequestMetricsMiddleware turns the totals into
+per-route histograms (and, with METRICS_SERVER_TIMING=1, a Server-Timing
+response header).
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Send the per-request breakdown back in a Server-Timing header
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+# (name, type, help, [(labels, value)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, callback: Callable[[], Iterable[Family]]) -> None:
+        """Metric families read at scrape time, e.g. from an existing stats dict."""
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for callback in self._collectors:
+            for name, kind, documentation, samples in callback():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def stats_families(prefix: str, stats: Dict[str, Any], counters: Sequence[str] = (), gauges: Sequence[str] = (),
+                   labels: Optional[Dict[str, str]] = None) -> List[Family]:
+    """Turn selected keys of a stats dict into metric families (counters get a _total suffix)."""
+    labels = labels or {}
+    families: List[Family] = []
+    for key in counters:
+        families.append((f"{prefix}_{key}_total", "counter", f"{key} (from {prefix} stats)", [(labels, stats[key])]))
+    for key in gauges:
+        families.append((f"{prefix}_{key}", "gauge", f"{key} (from {prefix} stats)", [(labels, stats[key])]))
+    return families
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "notes_http_request_duration_seconds", "Time to handle an HTTP request.",
+    ("method", "route", "status"))
+COMPONENT_SECONDS = registry.histogram(
+    "notes_http_request_component_seconds",
+    "Time an HTTP request spent in one component (mongo or sqlite, redis, serialize, fanout; fanout includes "
+    "encoding the frame).",
+    ("route", "component"))
+SLOW_REQUESTS = registry.counter(
+    "notes_http_slow_requests_total", "Requests slower than PROFILE_SLOW_REQUEST_MS.", ("route",))
+
+
+# ---------------- Per-request timing ----------------
+class RequestTimings:
+    """Seconds per component for one request. Nested or overlapping blocks of
+    the same component are counted once (wall time while any is open)."""
+    __slots__ = ("totals", "_open")
+
+    def __init__(self) -> None:
+        self.totals: Dict[str, float] = {}
+        # component -> (open blocks, start of the outermost one)
+        self._open: Dict[str, Tuple[int, float]] = {}
+
+    def enter(self, component: str) -> None:
+        depth, start = self._open.get(component, (0, 0.0))
+        self._open[component] = (depth + 1, time.perf_counter() if depth == 0 else start)
+
+    def exit(self, component: str) -> None:
+        depth, start = self._open[component]
+        if depth == 1:
+            del self._open[component]
+            self.totals[component] = self.totals.get(component, 0.0) + time.perf_counter() - start
+        else:
+            self._open[component] = (depth - 1, start)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+class timed:
+    """
+    Add the time spent in the block to `component` of the current request's
+    breakdown. A no-op outside a request (background tasks, sockets).
+    """
+    __slots__ = ("component", "timings")
+
+    def __init__(self, component: str) -> None:
+        self.component = component
+
+    def __enter__(self) -> "timed":
+        self.timings = _timings.get()
+        if self.timings is not None:
+            self.timings.enter(self.component)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.timings is not None:
+            self.timings.exit(self.component)
+
+
+def untimed() -> None:
+    """Detach the current task from the request it was spawned from."""
+    _timings.set(None)
+
+
+def timed_async(component: str):
+    """Decorator form of `timed` for coroutine functions."""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timed(component):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware (so the endpoint runs in the same task and context):
+    records request duration and the component breakdown per route template,
+    and hands slow requests to the sampling profiler when it is enabled.
+    """
+
+    def __init__(self, app, profiler=None) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if SERVER_TIMING:
+                    elapsed = time.perf_counter() - start
+                    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.totals.items()]
+                    entries.append(f"app;dur={elapsed * 1000:.2f}")
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", ", ".join(entries).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        sampling = self.profiler.begin() if self.profiler is not None else None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _timings.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=str(status["code"]))
+            for component, seconds in timings.totals.items():
+                COMPONENT_SECONDS.observe(seconds, route=route, component=component)
+            if sampling is not None:
+                if self.profiler.end(sampling, elapsed, f"{scope['method']} {route}"):
+                    SLOW_REQUESTS.inc(route=route)
@@ -0,0 +1,630 @@
+import asyncio
+import base64
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from utils.compression import StreamDecompressor, compress, decompress, record_spill
+from utils.db import STORAGE_BACKEND
+from utils.metrics import timed_async
+from utils.revisions import (REVISION_HISTORY, count_pruned, plan_revisions, plan_unchanged_revision, prune_point,
+                             rebuild, revision_summary)
+
+logger = logging.getLogger(__name__)
+
+# Soft-deleted notes stay behind as tombstones for the change feed
+NOT_DELETED = {"$ne": True}
+
+# Characters of content kept as the list-view preview
+PREVIEW_CHARS = int(os.getenv("NOTE_PREVIEW_CHARS", "200"))
+# Fields returned by the summary list view (no content)
+SUMMARY_PROJECTION = {"title": 1, "preview": 1, "size": 1, "tags": 1, "createdAt": 1, "updatedAt": 1, "rev": 1}
+# Fields written by the NDJSON export
+# The stored forms of a note's body
+BODY_PROJECTION = {"content": 1, "contentZ": 1, "contentFile": 1}
+EXPORT_PROJECTION = {"title": 1, "content": 1, "contentZ": 1, "contentFile": 1, "tags": 1, "createdAt": 1,
+                     "updatedAt": 1, "rev": 1}
+
+# Bodies at least this big are stored compressed, as `contentZ` (0 = never).
+# MongoDB's text index only sees a plain `content`, so with the database
+# search backend compressed bodies are found by their title only.
+NOTE_COMPRESS_MIN_BYTES = int(os.getenv("NOTE_COMPRESS_MIN_BYTES", "0"))
+# Bodies at least this big go to GridFS, referenced by `contentFile` (0 = never)
+NOTE_GRIDFS_MIN_BYTES = int(os.getenv("NOTE_GRIDFS_MIN_BYTES", "0"))
+GRIDFS_BUCKET = "note_bodies"
+# Clears whichever body field a note had before a rewrite
+UNSET_BODY = {"content": "", "contentZ": "", "contentFile": ""}
+# What a rewrite reads back of the version it replaces: the file to delete,
+# the tags to count, and with revision history the whole version
+PREVIOUS_PROJECTION = ({"title": 1, "content": 1, "contentZ": 1, "contentFile": 1, "updatedAt": 1, "rev": 1,
+                        "deleted": 1, "tags": 1} if REVISION_HISTORY else {"contentFile": 1, "deleted": 1, "tags": 1})
+# Everything a revision listing needs (not the snapshot or delta)
+REVISION_SUMMARY_PROJECTION = {"rev": 1, "createdAt": 1, "title": 1, "size": 1, "deleted": 1}
+
+
+def summary_fields(content: str) -> Dict[str, Any]:
+    """Precomputed list-view fields, stored with the note on every write."""
+    return {"preview": content[:PREVIEW_CHARS], "size": len(content)}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def stamp_notes(user_id: str, notes: List[Dict[str, Any]], first_rev: int) -> None:
+    """Fill in the fields every new note carries, numbering revisions from first_rev."""
+    now = _now()
+    for rev, note_data in enumerate(notes, first_rev):
+        note_data["userId"] = user_id
+        note_data["rev"] = rev
+        note_data.setdefault("createdAt", now)
+        note_data.setdefault("updatedAt", note_data["createdAt"])
+        note_data.update(summary_fields(note_data.get("content", "")))
+
+
+def tag_deltas(added: Iterable[str] = (), removed: Iterable[str] = ()) -> Dict[str, int]:
+    """Net change of each tag's note count, without the tags that cancel out."""
+    deltas = Counter(added)
+    deltas.subtract(removed)
+    return {tag: delta for tag, delta in deltas.items() if delta}
+
+
+def encode_cursor(created_at: str, note_id: str) -> str:
+    """Opaque keyset cursor pointing just past (createdAt, _id)."""
+    raw = f"{created_at}|{note_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, ObjectId]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, note_id = base64.urlsafe_b64decode(padded).decode().rsplit("|", 1)
+        return created_at, ObjectId(note_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class NotesRepository:
+    """
+    Async data access for the notes collection in MongoDB.
+    Routes go through this instead of touching the collection directly,
+    so every database call is awaited and never blocks the event loop.
+
+    Every write stamps the note with updatedAt and the next value of a
+    per-user revision counter; deletes leave a tombstone. That is what the
+    change feed (list_changes) is built on.
+
+    Content changes, deletes and restores also append to the note's revision
+    history (see utils.revisions) in the note_revisions collection.
+
+    Notes carry a `tags` array (folders are tags too). Each user's count of
+    live notes per tag is kept in tag_counts, adjusted with $inc by every write
+    that adds or removes a tag, so listing a user's tags reads a handful of
+    small documents instead of scanning the notes. Tombstones keep their tags,
+    uncounted, so a restore can count them again.
+
+    Time spent in these methods counts as "mongo" in the request breakdown.
+    The collections are bound by the lifespan handler once the client exists.
+    """
+
+    def __init__(self, collection=None, counters=None, bodies=None, revisions=None, tag_counts=None) -> None:
+        self.collection = collection
+        self.counters = counters
+        # GridFS bucket for large bodies; without one they stay in the document
+        self.bodies = bodies
+        # Revision history; without it none is recorded
+        self.revisions = revisions
+        # Per-user note count of each tag
+        self.tag_counts = tag_counts
+
+    def bind(self, database) -> None:
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        self.collection = database["notes"]
+        # Per-user revision counters for the change feed
+        self.counters = database["counters"]
+        self.bodies = AsyncIOMotorGridFSBucket(database, bucket_name=GRIDFS_BUCKET)
+        self.revisions = database["note_revisions"]
+        self.tag_counts = database["tag_counts"]
+
+    # ---------------- Body storage ----------------
+    async def _encode_body(self, content: str, note_id: ObjectId, user_id: str) -> Dict[str, Any]:
+        """The fields that store `content`: plain, compressed, or a GridFS file id."""
+        if NOTE_COMPRESS_MIN_BYTES <= 0 and NOTE_GRIDFS_MIN_BYTES <= 0:
+            return {"content": content}
+        raw = content.encode("utf-8")
+        data = compress(raw, "body", NOTE_COMPRESS_MIN_BYTES)
+        if self.bodies is not None and 0 < NOTE_GRIDFS_MIN_BYTES <= len(raw):
+            file_id = await self.bodies.upload_from_stream(str(note_id), data, metadata={"userId": user_id})
+            record_spill("body", len(data))
+            return {"contentFile": file_id}
+        if data is not raw:
+            return {"contentZ": data}
+        return {"content": content}
+
+    async def _stored(self, note: Dict[str, Any]) -> Dict[str, Any]:
+        """The document to write for a new note (note itself unless its body is stored differently)."""
+        content = note.get("content")
+        if not isinstance(content, str):
+            return note
+        note.setdefault("_id", ObjectId())
+        body = await self._encode_body(content, note["_id"], note["userId"])
+        if "content" in body:
+            return note
+        doc = {key: value for key, value in note.items() if key != "content"}
+        doc.update(body)
+        return doc
+
+    async def load_body(self, note: Dict[str, Any]) -> Dict[str, Any]:
+        """Put the plain `content` back on a note read from the collection."""
+        if "contentZ" in note:
+            note["content"] = decompress(note.pop("contentZ"), "body").decode("utf-8")
+        elif "contentFile" in note:
+            note["content"] = b"".join([chunk async for chunk in self.stream_body(note)]).decode("utf-8")
+            del note["contentFile"]
+        return note
+
+    async def stream_body(self, note: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """The body of a note kept in GridFS, as UTF-8 chunks, without reading it all into memory."""
+        stream = await self.bodies.open_download_stream(note["contentFile"])
+        decompressor = StreamDecompressor("body")
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            data = decompressor.feed(chunk)
+            if data:
+                yield data
+        rest = decompressor.close()
+        if rest:
+            yield rest
+
+    async def _delete_body_file(self, note: Optional[Dict[str, Any]]) -> None:
+        if note and note.get("contentFile") is not None and self.bodies is not None:
+            try:
+                await self.bodies.delete(note["contentFile"])
+            except Exception:
+                pass  # Already gone; nothing references it any more
+
+    @timed_async("mongo")
+    async def next_revision(self, user_id: str, count: int = 1) -> int:
+        """Reserve `count` revisions for a user and return the highest one."""
+        doc = await self.counters.find_one_and_update(
+            {"_id": f"rev:{user_id}"},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["seq"]
+
+    @timed_async("mongo")
+    async def current_revision(self, user_id: str) -> int:
+        doc = await self.counters.find_one({"_id": f"rev:{user_id}"})
+        return doc["seq"] if doc else 0
+
+    @timed_async("mongo")
+    async def insert_note(self, note_data: Dict[str, Any]) -> str:
+        """Insert a note; sets rev and updatedAt on note_data."""
+        note_data["rev"] = await self.next_revision(note_data["userId"])
+        note_data.update(summary_fields(note_data.get("content", "")))
+        note_data.setdefault("updatedAt", note_data.get("createdAt") or _now())
+        result = await self.collection.insert_one(await self._stored(note_data))
+        note_data["_id"] = result.inserted_id
+        await self._count_tags(note_data["userId"], tag_deltas(note_data.get("tags", ())))
+        return str(result.inserted_id)
+
+    @timed_async("mongo")
+    async def insert_notes(self, user_id: str, notes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Insert a batch of one user's notes with a single insert_many.
+        One counter update reserves a contiguous block of revisions for the whole
+        batch. Sets _id, rev and updatedAt on each dict; returns (first_rev, last_rev).
+        """
+        first_rev, last_rev = await self.stamp_new_notes(user_id, notes)
+        await self.collection.insert_many([await self._stored(note) for note in notes], ordered=True)
+        await self._count_tags(user_id, tag_deltas(tag for note in notes for tag in note.get("tags", ())))
+        return first_rev, last_rev
+
+    @timed_async("mongo")
+    async def stamp_new_notes(self, user_id: str, notes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Reserve a block of revisions and fill in the fields every new note carries."""
+        last_rev = await self.next_revision(user_id, len(notes))
+        first_rev = last_rev - len(notes) + 1
+        stamp_notes(user_id, notes, first_rev)
+        return first_rev, last_rev
+
+    @timed_async("mongo")
+    async def bulk_insert(self, notes: List[Dict[str, Any]]) -> Dict[int, str]:
+        """
+        Insert already-stamped notes (from any users) with one unordered bulk_write.
+        Returns {index: error} for the notes that were not written.
+        """
+        errors: Dict[int, str] = {}
+        try:
+            await self.collection.bulk_write([InsertOne(await self._stored(note)) for note in notes], ordered=False)
+        except BulkWriteError as e:
+            errors = {err["index"]: err.get("errmsg", "write failed") for err in e.details.get("writeErrors", [])}
+        added: Dict[str, List[str]] = {}
+        for index, note in enumerate(notes):
+            if index not in errors:
+                added.setdefault(note["userId"], []).extend(note.get("tags", ()))
+        for user_id, tags in added.items():
+            await self._count_tags(user_id, tag_deltas(tags))
+        return errors
+
+    async def export_notes(self, user_id: str, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """All of a user's notes, newest first, fetched from one cursor batch_size at a time."""
+        cursor = (self.collection.find({"userId": user_id, "deleted": NOT_DELETED}, EXPORT_PROJECTION)
+                  .sort([("createdAt", DESCENDING), ("_id", DESCENDING)])
+                  .batch_size(batch_size))
+        async for note in cursor:
+            yield await self.load_body(note)
+
+    @timed_async("mongo")
+    async def find_note(self, note_id: ObjectId, user_id: str, load_body: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        One note, or None. With load_body=False a body kept in GridFS is left
+        there (as `contentFile`) for the caller to stream with stream_body().
+        """
+        note = await self.collection.find_one({"_id": note_id, "userId": user_id, "deleted": NOT_DELETED})
+        if note is not None and (load_body or "contentFile" not in note):
+            await self.load_body(note)
+        return note
+
+    @timed_async("mongo")
+    async def update_note_content(self, note_id: ObjectId, user_id: str, content: str) -> Optional[int]:
+        """Replace a note's content. Returns the new revision, or None if the note is gone."""
+        rev = await self.next_revision(user_id)
+        body = await self._encode_body(content, note_id, user_id)
+        previous = await self.collection.find_one_and_update(
+            {"_id": note_id, "userId": user_id, "deleted": NOT_DELETED},
+            {"$set": {**body, "updatedAt": _now(), "rev": rev, **summary_fields(content)},
+             "$unset": {field: "" for field in UNSET_BODY if field not in body}},
+            projection=PREVIOUS_PROJECTION,
+        )
+        if previous is None:
+            await self._delete_body_file(body)
+            return None
+        await self._record_revision(note_id, user_id, previous, rev, previous.get("title"), content)
+        await self._delete_body_file(previous)
+        return rev
+
+    @timed_async("mongo")
+    async def delete_note(self, note_id: ObjectId, user_id: str) -> Optional[int]:
+        """Soft-delete: drop the body and keep a tombstone. Returns the revision of the delete."""
+        rev = await self.next_revision(user_id)
+        now = _now()
+        previous = await self.collection.find_one_and_update(
+            {"_id": note_id, "userId": user_id, "deleted": NOT_DELETED},
+            {"$set": {"deleted": True, "deletedAt": now, "updatedAt": now, "rev": rev},
+             "$unset": {"title": "", "preview": "", "size": "", **UNSET_BODY}},
+            projection=PREVIOUS_PROJECTION,
+        )
+        if previous is None:
+            return None
+        await self._record_revision(note_id, user_id, previous, rev, previous.get("title"), None, deleted=True)
+        await self._delete_body_file(previous)
+        await self._count_tags(user_id, tag_deltas(removed=previous.get("tags", ())))
+        return rev
+
+    @timed_async("mongo")
+    async def restore_note(self, note_id: ObjectId, user_id: str, title: Optional[str],
+                           content: str) -> Optional[Tuple[int, bool]]:
+        """
+        Put an old version back as the current one, undeleting the note if needed.
+        Returns (revision, whether it was deleted), or None if there is no such note.
+        """
+        rev = await self.next_revision(user_id)
+        body = await self._encode_body(content, note_id, user_id)
+        previous = await self.collection.find_one_and_update(
+            {"_id": note_id, "userId": user_id},
+            {"$set": {**body, "title": title, "updatedAt": _now(), "rev": rev, **summary_fields(content)},
+             "$unset": {"deleted": "", "deletedAt": "", **{field: "" for field in UNSET_BODY if field not in body}}},
+            projection=PREVIOUS_PROJECTION,
+        )
+        if previous is None:
+            await self._delete_body_file(body)
+            return None
+        await self._record_revision(note_id, user_id, previous, rev, title, content)
+        await self._delete_body_file(previous)
+        if previous.get("deleted"):
+            await self._count_tags(user_id, tag_deltas(previous.get("tags", ())))
+        return rev, bool(previous.get("deleted"))
+
+    # ---------------- Tags ----------------
+    @timed_async("mongo")
+    async def set_tags(self, note_id: ObjectId, user_id: str, tags: List[str]) -> Optional[Tuple[int, str]]:
+        """Replace a note's tags. Returns (revision, updatedAt), or None if the note is gone."""
+        rev = await self.next_revision(user_id)
+        now = _now()
+        previous = await self.collection.find_one_and_update(
+            {"_id": note_id, "userId": user_id, "deleted": NOT_DELETED},
+            {"$set": {"tags": tags, "updatedAt": now, "rev": rev}},
+            projection={"tags": 1, "title": 1, "size": 1, "rev": 1},
+        )
+        if previous is None:
+            return None
+        await self._record_unchanged_revision(note_id, user_id, previous, rev)
+        await self._count_tags(user_id, tag_deltas(tags, previous.get("tags", ())))
+        return rev, now
+
+    async def _count_tags(self, user_id: str, deltas: Dict[str, int]) -> None:
+        """
+        Apply the changes of a write to the user's tag counts. Runs after the
+        note write, so a failure here is logged rather than failing the write.
+        """
+        if self.tag_counts is None or not deltas:
+            return
+        try:
+            # A note has a few tags at most: one concurrent upsert each
+            await asyncio.gather(*(
+                self.tag_counts.update_one({"userId": user_id, "tag": tag}, {"$inc": {"count": delta}}, upsert=True)
+                for tag, delta in deltas.items()))
+            emptied = [tag for tag, delta in deltas.items() if delta < 0]
+            if emptied:
+                await self.tag_counts.delete_many({"userId": user_id, "tag": {"$in": emptied}, "count": {"$lte": 0}})
+        except Exception as e:
+            logger.warning("Could not update tag counts of %s: %s", user_id, e)
+
+    @timed_async("mongo")
+    async def list_tags(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's tags with the number of notes carrying each, by name."""
+        if self.tag_counts is None:
+            return []
+        cursor = self.tag_counts.find({"userId": user_id, "count": {"$gt": 0}}, {"_id": 0, "tag": 1, "count": 1})
+        return await cursor.sort([("tag", ASCENDING)]).to_list(None)
+
+    # ---------------- Revision history ----------------
+    async def _record_revision(self, note_id: ObjectId, user_id: str, previous: Dict[str, Any], rev: int,
+                               title: Optional[str], content: Optional[str], deleted: bool = False) -> None:
+        """
+        Append the version written at `rev` to the note's history, given the
+        document it replaced. content None keeps the text of that document
+        (a delete). Losing history never fails the write itself.
+        """
+        if self.revisions is None or not REVISION_HISTORY:
+            return
+        try:
+            before = None
+            if not previous.get("deleted"):
+                # A copy: the caller still needs contentFile to delete the old body
+                before = await self.load_body(dict(previous))
+                before.setdefault("content", "")
+                before.setdefault("rev", 0)
+            if content is None:
+                content = before["content"] if before is not None else ""
+            latest = await self.revisions.find_one({"noteId": note_id}, {"rev": 1, "depth": 1},
+                                                   sort=[("rev", DESCENDING)])
+            records = plan_revisions(latest, before, rev, title, content, _now(), deleted)
+            for record in records:
+                record.update(noteId=note_id, userId=user_id)
+            await self.revisions.insert_many(records, ordered=True)
+            if records[-1]["depth"] == 0:
+                await self.prune_revisions(note_id)
+        except Exception as e:
+            logger.warning("Could not record revision %d of note %s: %s", rev, note_id, e)
+
+    async def _record_unchanged_revision(self, note_id: ObjectId, user_id: str, previous: Dict[str, Any],
+                                         rev: int) -> None:
+        """Keep the note's history free of gaps across a write that kept its text (a tag change)."""
+        if self.revisions is None or not REVISION_HISTORY:
+            return
+        try:
+            latest = await self.revisions.find_one({"noteId": note_id}, {"rev": 1, "depth": 1},
+                                                   sort=[("rev", DESCENDING)])
+            record = plan_unchanged_revision(latest, previous.get("rev"), rev, previous.get("title"),
+                                             previous.get("size"), _now())
+            if record is not None:
+                record.update(noteId=note_id, userId=user_id)
+                await self.revisions.insert_one(record)
+        except Exception as e:
+            logger.warning("Could not record revision %d of note %s: %s", rev, note_id, e)
+
+    @timed_async("mongo")
+    async def list_revisions(self, note_id: ObjectId, user_id: str, limit: int = 50,
+                             before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """One page of a note's history, newest first, without the text."""
+        query: Dict[str, Any] = {"noteId": note_id, "userId": user_id}
+        if before is not None:
+            query["rev"] = {"$lt": before}
+        cursor = (self.revisions.find(query, REVISION_SUMMARY_PROJECTION)
+                  .sort([("rev", DESCENDING)])
+                  .limit(limit))
+        return [revision_summary(record) async for record in cursor]
+
+    @timed_async("mongo")
+    async def get_revision(self, note_id: ObjectId, user_id: str, rev: int) -> Optional[Dict[str, Any]]:
+        """The version written at `rev`, rebuilt from the nearest snapshot, or None."""
+        base = await self.revisions.find_one({"noteId": note_id, "userId": user_id, "rev": {"$lte": rev}, "depth": 0},
+                                             sort=[("rev", DESCENDING)])
+        if base is None:
+            return None
+        chain = [base]
+        if base["rev"] != rev:
+            cursor = (self.revisions.find({"noteId": note_id, "rev": {"$gt": base["rev"], "$lte": rev}})
+                      .sort([("rev", ASCENDING)]))
+            chain += await cursor.to_list(None)
+        if chain[-1]["rev"] != rev:
+            return None
+        version = revision_summary(chain[-1])
+        version["content"] = rebuild(chain)
+        return version
+
+    async def prune_revisions(self, note_id: ObjectId) -> int:
+        """Drop the records of a note that fall outside the retention limits."""
+        cursor = self.revisions.find({"noteId": note_id}, {"rev": 1, "createdAt": 1, "depth": 1}).sort(
+            [("rev", DESCENDING)])
+        point = prune_point(await cursor.to_list(None))
+        if point is None:
+            return 0
+        result = await self.revisions.delete_many({"noteId": note_id, "rev": {"$lt": point}})
+        count_pruned(result.deleted_count)
+        return result.deleted_count
+
+    async def sweep_revisions(self, cutoff: str) -> int:
+        """Prune every note with records written before cutoff (an ISO timestamp)."""
+        removed = 0
+        for note_id in await self.revisions.distinct("noteId", {"createdAt": {"$lt": cutoff}}):
+            removed += await self.prune_revisions(note_id)
+        return removed
+
+    @timed_async("mongo")
+    async def list_changes(self, user_id: str, since: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """Notes (and tombstones) changed after revision `since`, oldest change first."""
+        cursor = (self.collection.find({"userId": user_id, "rev": {"$gt": since}})
+                  .sort([("rev", ASCENDING)])
+                  .limit(limit))
+        changes = []
+        async for note in cursor:
+            change = {"id": str(note["_id"]), "rev": note["rev"], "updatedAt": note.get("updatedAt")}
+            if note.get("deleted"):
+                change["deleted"] = True
+            else:
+                await self.load_body(note)
+                change.update({"title": note.get("title"), "content": note.get("content"),
+                               "tags": note.get("tags", []), "createdAt": note.get("createdAt")})
+            changes.append(change)
+        return changes
+
+    async def iter_user_notes(self, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """All of a user's notes (used to build in-process indexes)."""
+        async for note in self.collection.find({"userId": user_id, "deleted": NOT_DELETED}):
+            yield await self.load_body(note)
+
+    async def text_search(self, user_id: str, query: str, limit: int) -> AsyncIterator[Dict[str, Any]]:
+        """Notes matching a $text query, best matches first."""
+        cursor = (self.collection.find({"userId": user_id, "$text": {"$search": query}, "deleted": NOT_DELETED},
+                                       {"score": {"$meta": "textScore"}})
+                  .sort([("score", {"$meta": "textScore"})])
+                  .limit(limit))
+        async for note in cursor:
+            yield await self.load_body(note)
+
+    async def ensure_indexes(self) -> None:
+        # Serves keyset pagination: equality on userId, then newest first.
+        await self.collection.create_index(
+            [("userId", 1), ("createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="userId_createdAt_id",
+        )
+        # Serves the change feed
+        await self.collection.create_index([("userId", 1), ("rev", ASCENDING)], name="userId_rev")
+        # Multikey: one entry per tag, so a tag's notes are one range, already newest first
+        await self.collection.create_index(
+            [("userId", 1), ("tags", 1), ("createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="userId_tags_createdAt_id",
+        )
+        if self.tag_counts is not None:
+            await self.tag_counts.create_index([("userId", 1), ("tag", 1)], unique=True, name="userId_tag")
+        if self.revisions is not None:
+            # One note's history, newest first; unique so racing writers can't fork it
+            await self.revisions.create_index([("noteId", 1), ("rev", DESCENDING)], unique=True, name="noteId_rev")
+            # Age sweep
+            await self.revisions.create_index([("createdAt", 1)], name="createdAt")
+
+    async def assign_missing_revisions(self) -> int:
+        """
+        Give notes written before revisions existed one, oldest first, so the
+        change feed returns them. Runs once per database; returns how many were numbered.
+        """
+        marker = "migration:revisions"
+        if await self.counters.find_one({"_id": marker}) is not None:
+            return 0
+        by_user: Dict[str, List[ObjectId]] = {}
+        cursor = self.collection.find({"rev": {"$exists": False}}, {"userId": 1}).sort([("createdAt", ASCENDING)])
+        async for note in cursor:
+            by_user.setdefault(note["userId"], []).append(note["_id"])
+        for user_id, ids in by_user.items():
+            last_rev = await self.next_revision(user_id, len(ids))
+            for rev, note_id in enumerate(ids, last_rev - len(ids) + 1):
+                # A write since the scan numbered it already
+                await self.collection.update_one({"_id": note_id, "rev": {"$exists": False}}, {"$set": {"rev": rev}})
+        await self.counters.update_one({"_id": marker}, {"$set": {"seq": 1}}, upsert=True)
+        return sum(map(len, by_user.values()))
+
+    async def ensure_text_index(self, title_weight: int) -> None:
+        # Compound (userId, text), so every query stays inside one user's notes
+        await self.collection.create_index(
+            [("userId", 1), ("title", TEXT), ("content", TEXT)],
+            weights={"title": title_weight, "content": 1},
+            name="userId_text",
+        )
+
+    @timed_async("mongo")
+    async def list_notes(self, user_id: str, limit: int = 20,
+                         after: Optional[Tuple[str, ObjectId]] = None,
+                         summary: bool = False,
+                         tag: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of a user's notes (newest first) and the cursor for the next page.
+        Uses keyset pagination so deep pages cost the same as the first one.
+        With summary=True the content is left out (projection) in favour of a short preview.
+        With a tag, only the notes carrying it (a range of the userId_tags index).
+        """
+        query: Dict[str, Any] = {"userId": user_id, "deleted": NOT_DELETED}
+        if tag is not None:
+            query["tags"] = tag
+        if after is not None:
+            created_at, last_id = after
+            query["$or"] = [
+                {"createdAt": {"$lt": created_at}},
+                {"createdAt": created_at, "_id": {"$lt": last_id}},
+            ]
+
+        cursor = (self.collection.find(query, SUMMARY_PROJECTION if summary else None)
+                  .sort([("createdAt", DESCENDING), ("_id", DESCENDING)])
+                  .limit(limit))
+        notes = []
+        unsummarized = []
+        async for note in cursor:
+            item = {"id": str(note["_id"]), "title": note["title"]}
+            if summary:
+                item["preview"] = note.get("preview", "")
+                item["size"] = note.get("size", 0)
+                if "size" not in note:
+                    unsummarized.append(item)
+            else:
+                item["content"] = (await self.load_body(note))["content"]
+            item.update({"tags": note.get("tags", []), "createdAt": note.get("createdAt"),
+                         "updatedAt": note.get("updatedAt"), "rev": note.get("rev")})
+            notes.append(item)
+        if unsummarized:
+            await self._backfill_summaries(user_id, unsummarized)
+
+        next_cursor = None
+        if len(notes) == limit:
+            last = notes[-1]
+            next_cursor = encode_cursor(last["createdAt"], last["id"])
+        return notes, next_cursor
+
+    async def _backfill_summaries(self, user_id: str, items: List[Dict[str, Any]]) -> None:
+        """
+        Fill in preview and size of listed notes written before those fields
+        existed, from their bodies, and store them so it happens once per note.
+        """
+        ids = [ObjectId(item["id"]) for item in items]
+        contents = {}
+        async for note in self.collection.find({"_id": {"$in": ids}, "userId": user_id}, BODY_PROJECTION):
+            contents[str(note["_id"])] = (await self.load_body(note)).get("content", "")
+        for item in items:
+            fields = summary_fields(contents.get(item["id"], ""))
+            item.update(fields)
+            try:
+                await self.collection.update_one({"_id": ObjectId(item["id"]), "size": {"$exists": False}},
+                                                 {"$set": fields})
+            except Exception as e:
+                logger.warning("Could not store the summary of note %s: %s", item["id"], e)
+
+
+def create_repository():
+    if STORAGE_BACKEND == "sqlite":
+        from utils.sqlite_repository import SQLiteNotesRepository
+        return SQLiteNotesRepository()
+    return NotesRepository()
+
+
+# Global instance; bound to a database by the lifespan handler
+notes_repo = create_repository()
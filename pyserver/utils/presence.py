@@ -0,0 +1,103 @@
+"""
+Which of a user's devices are online, across workers.
+
+Every socket is a field of the user's Redis hash presence:{user_id}:
+connection id -> device, connect time and the worker holding the socket.
+A worker that dies can't remove its entries, so each worker keeps a
+short-lived key of its own alive (from the heartbeat wheel, see
+utils.websocket_manager) and readers drop entries whose worker key is gone.
+
+Without Redis the connection manager answers from this worker's sockets.
+"""
+import logging
+import os
+import socket
+from typing import Any, Dict, List, Optional
+
+from utils import redis_utils
+from utils.codec import dumps, loads
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# A worker that hasn't refreshed its key for this long is presumed dead (seconds)
+PRESENCE_WORKER_TTL = int(os.getenv("PRESENCE_WORKER_TTL", "90"))
+# Safety net for hashes nobody touches any more (seconds)
+PRESENCE_KEY_TTL = 24 * 3600
+
+
+def _key(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+def _worker_key(worker: str) -> str:
+    return f"presence:worker:{worker}"
+
+
+async def add(user_id: str, connection_id: str, info: Dict[str, Any]) -> None:
+    client = redis_utils.redis_client
+    if client is None:
+        return
+    try:
+        with timed("redis"):
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.hset(_key(user_id), connection_id, dumps(dict(info, worker=WORKER_ID)))
+                pipe.expire(_key(user_id), PRESENCE_KEY_TTL)
+                await pipe.execute()
+    except Exception as e:
+        logger.error("Error recording presence of %s: %s", user_id, e)
+
+
+async def remove(user_id: str, connection_id: str) -> None:
+    client = redis_utils.redis_client
+    if client is None:
+        return
+    try:
+        with timed("redis"):
+            await client.hdel(_key(user_id), connection_id)
+    except Exception as e:
+        logger.error("Error clearing presence of %s: %s", user_id, e)
+
+
+async def keep_alive() -> None:
+    """Refresh this worker's liveness key; called well within PRESENCE_WORKER_TTL."""
+    client = redis_utils.redis_client
+    if client is None:
+        return
+    try:
+        await client.set(_worker_key(WORKER_ID), b"1", ex=PRESENCE_WORKER_TTL)
+    except Exception as e:
+        logger.error("Error refreshing presence worker key: %s", e)
+
+
+async def retire() -> None:
+    """On shutdown: readers stop listing this worker's sockets right away."""
+    client = redis_utils.redis_client
+    if client is None:
+        return
+    try:
+        await client.delete(_worker_key(WORKER_ID))
+    except Exception as e:
+        logger.error("Error removing presence worker key: %s", e)
+
+
+async def online(user_id: str) -> Optional[List[Dict[str, Any]]]:
+    """The user's sockets on live workers, oldest first; None without Redis (or if it fails)."""
+    client = redis_utils.redis_client
+    if client is None:
+        return None
+    try:
+        with timed("redis"):
+            raw = await client.hgetall(_key(user_id))
+            entries = {cid.decode(): loads(value) for cid, value in raw.items()}
+            workers = sorted({entry.get("worker", "") for entry in entries.values()})
+            alive = dict(zip(workers, await client.mget([_worker_key(w) for w in workers]))) if workers else {}
+            dead = [cid for cid, entry in entries.items() if alive.get(entry.get("worker", "")) is None]
+            if dead:
+                await client.hdel(_key(user_id), *dead)
+    except Exception as e:
+        logger.error("Error reading presence of %s: %s", user_id, e)
+        return None
+    devices = [entry for cid, entry in entries.items() if cid not in dead]
+    return sorted(devices, key=lambda entry: entry.get("connectedAt") or "")
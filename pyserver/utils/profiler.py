@@ -0,0 +1,133 @@
+"""
+Opt-in sampling profiler for slow requests (PROFILE_SLOW_REQUEST_MS > 0).
+
+While requests are in flight, a background thread samples the event loop
+every PROFILE_INTERVAL_MS. The request whose task is running gets the
+thread's Python stack; every other in-flight request gets the chain of
+coroutines it is suspended in, ending in "[waiting]". A request that takes
+longer than the threshold has its samples written to PROFILE_DIR in the
+folded-stack format ("frame;frame;frame count"), which flamegraph.pl,
+speedscope and inferno read directly.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Stop writing files after this many (the counter in /metrics keeps counting)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+# The running task of each loop; asyncio keeps it here for current_task()
+_current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _thread_stack(frame) -> Tuple[str, ...]:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+def _await_stack(task: "asyncio.Task") -> Tuple[str, ...]:
+    names = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            names.append(_frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    names.append("[waiting]")
+    return tuple(names)
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms: float = PROFILE_SLOW_REQUEST_MS, interval_ms: float = PROFILE_INTERVAL_MS,
+                 out_dir: str = PROFILE_DIR) -> None:
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.out_dir = out_dir
+        self.files_written = 0
+        self._active: Dict["asyncio.Task", List[Tuple[str, ...]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self) -> Optional[Tuple["asyncio.Task", List[Tuple[str, ...]]]]:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+        samples: List[Tuple[str, ...]] = []
+        self._active[task] = samples
+        return task, samples
+
+    def end(self, token, elapsed: float, label: str) -> bool:
+        """Stop sampling a request; returns True if it was slow (and its profile was saved)."""
+        if token is None:
+            return False
+        task, samples = token
+        self._active.pop(task, None)
+        if elapsed < self.threshold:
+            return False
+        if samples and self.files_written < PROFILE_MAX_FILES:
+            self._write(label, elapsed, samples)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            try:
+                running = _current_tasks.get(self._loop) if _current_tasks is not None else None
+                for task, samples in list(self._active.items()):
+                    if task is running:
+                        frame = sys._current_frames().get(self._loop_thread)
+                        if frame is not None:
+                            samples.append(_thread_stack(frame))
+                    else:
+                        samples.append(_await_stack(task))
+            except Exception:
+                # The loop thread keeps changing these structures under us; skip this tick
+                continue
+
+    def _write(self, label: str, elapsed: float, samples: List[Tuple[str, ...]]) -> None:
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+        path = os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{name}-{elapsed * 1000:.0f}ms.folded")
+        counts = Counter(";".join((label,) + stack) for stack in samples)
+        with open(path, "w") as f:
+            for stack, count in counts.items():
+                f.write(f"{stack} {count}\n")
+        self.files_written += 1
+        logger.warning("Slow request %s took %.0f ms; profile written to %s", label, elapsed * 1000, path)
+
+
+def create_profiler() -> Optional[SlowRequestProfiler]:
+    if PROFILE_SLOW_REQUEST_MS > 0:
+        return SlowRequestProfiler()
+    return None
+
+
+# Global instance (None unless enabled)
+profiler = create_profiler()
@@ -1,61 +1,344 @@
-import redis
-import json
+import asyncio
+import logging
 import os
-from typing import Optional, Any, Dict, List
+import uuid
+from typing import Optional, Any, Awaitable, Callable, Dict, List
 from bson import ObjectId
+from utils.broker import broker
+from utils.compression import compress, decompress
+from utils.local_cache import LocalCache
+from utils.metrics import timed
 
-# Initialize Redis client with Upstash
+logger = logging.getLogger(__name__)
+
+# Upstash Redis: the URL gives host and port, the token is the password.
+# Without them the cache runs on the in-process tier alone (single process).
 redis_url = os.getenv('REDIS_URL')
 redis_token = os.getenv('REDIS_TOKEN')
 
-# For Upstash Redis, we need to use the URL with the token
-if not redis_url or not redis_token:
-    raise ValueError("REDIS_URL and REDIS_TOKEN must be set in the environment")
-
-# Extract host and port from the URL
-from urllib.parse import urlparse
-parsed_url = urlparse(redis_url)
-
-redis_client = redis.Redis(
-    host=parsed_url.hostname,
-    port=parsed_url.port or 6379,
-    password=redis_token,
-    ssl=True,  # Enable SSL for Upstash
-    ssl_cert_reqs=None,  # Don't verify SSL certificate (useful for self-signed certs)
-    decode_responses=True
+# Max pooled connections per worker process
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+# Connections opened during warm-up
+REDIS_WARM_CONNECTIONS = int(os.getenv('REDIS_WARM_CONNECTIONS', '4'))
+
+# Created by connect_redis() from the lifespan handler; None when Redis is not configured
+redis_client = None
+
+def connect_redis():
+    """Create the shared client if Redis is configured. Idempotent and non-blocking."""
+    global redis_client
+    if redis_client is None and redis_url and redis_token:
+        # Imported here so a process without Redis never loads the client library
+        import redis.asyncio as redis
+        from urllib.parse import urlparse
+        parsed_url = urlparse(redis_url)
+        # The asyncio client keeps a connection pool and only connects on first use.
+        redis_client = redis.Redis(
+            host=parsed_url.hostname,
+            port=parsed_url.port or 6379,
+            password=redis_token,
+            ssl=True,  # Enable SSL for Upstash
+            ssl_cert_reqs=None,  # Don't verify SSL certificate (useful for self-signed certs)
+            # Cached pages are stored and served as encoded JSON bytes, never decoded
+            decode_responses=False,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        )
+    elif redis_client is None:
+        logger.warning("REDIS_URL/REDIS_TOKEN not set; caching in this process only")
+    return redis_client
+
+async def close_redis() -> None:
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+
+async def ping_redis() -> bool:
+    """Check that Redis is reachable (True when it is not configured at all)."""
+    if redis_client is None:
+        return True
+    try:
+        await redis_client.ping()
+        return True
+    except Exception as e:
+        logger.error("Failed to connect to Redis: %s", e)
+        return False
+
+async def warm_redis_pool(connections: int = REDIS_WARM_CONNECTIONS) -> None:
+    """Open `connections` pooled connections up front by running that many pings at once."""
+    if redis_client is not None and connections > 1:
+        await asyncio.gather(*(redis_client.ping() for _ in range(connections)), return_exceptions=True)
+
+# In-process tier in front of Redis. Kept coherent across workers by
+# invalidation messages, and bounded by a short TTL as a safety net.
+LOCAL_CACHE_ENABLED = os.getenv('LOCAL_CACHE_ENABLED', '1') != '0'
+local_cache = LocalCache(
+    max_bytes=int(os.getenv('LOCAL_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    max_entries=int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', '10000')),
+    ttl=float(os.getenv('LOCAL_CACHE_TTL', '30')),
 )
-print("*"*10, "Connected to Redis successfully", "*"*10)
+CACHE_INVALIDATION_CHANNEL = "notes:cache:invalidate"
 
-def get_notes_cache_key(user_id: str) -> str:
-    """Generate cache key for user's notes."""
-    return f"user:{user_id}:notes"
+# Pages at least this big are compressed in Redis (0 = never). The local tier
+# keeps them uncompressed, so a local hit still costs no decoding.
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '1024'))
 
-def get_cached_notes(user_id: str) -> Optional[List[Dict[str, Any]]]:
-    """Get cached notes for a user."""
+# Remote tier hit counters (the local tier keeps its own)
+redis_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+# Cache rebuild coalescing (single-flight)
+REBUILD_LOCK_TTL_MS = int(os.getenv('CACHE_REBUILD_LOCK_TTL_MS', '5000'))
+REBUILD_WAIT_TIMEOUT = float(os.getenv('CACHE_REBUILD_WAIT_TIMEOUT', '2.0'))
+REBUILD_POLL_INTERVAL = 0.02
+# Delete the rebuild lock only if it is still ours, in one step: it may have
+# expired and been taken by another worker since we set it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+# Serve the last good page while a rebuild runs in the background
+STALE_WHILE_REVALIDATE = os.getenv('CACHE_STALE_WHILE_REVALIDATE', '0') == '1'
+rebuild_stats = {"rebuilds": 0, "coalesced": 0, "lock_waits": 0, "stale_served": 0}
+_inflight: Dict[str, "asyncio.Task"] = {}
+
+def get_notes_version_key(user_id: str) -> str:
+    """Key of the per-user counter that versions all cached note pages."""
+    return f"user:{user_id}:notes:version"
+
+def get_notes_cache_key(user_id: str, version: int, page: str) -> str:
+    """Generate cache key for one page of a user's notes."""
+    return f"user:{user_id}:notes:v{version}:{page}"
+
+async def get_notes_cache_version(user_id: str) -> int:
+    """Current cache version for a user's notes (0 if never invalidated)."""
+    if redis_client is None:
+        # Single process: the local tier's generation, which every invalidation
+        # bumps, versions the pages (and the in-flight rebuilds keyed by them)
+        return local_cache.generation(user_id)
+    version_key = get_notes_version_key(user_id)
+    if LOCAL_CACHE_ENABLED:
+        version = local_cache.get(version_key)
+        if version is not None:
+            return version
+    generation = local_cache.generation(user_id)
     try:
-        cache_key = get_notes_cache_key(user_id)
-        cached_data = redis_client.get(cache_key)
+        with timed("redis"):
+            version = await redis_client.get(version_key)
+        version = int(version) if version else 0
+    except Exception as e:
+        redis_stats["errors"] += 1
+        logger.error("Error getting cache version: %s", e)
+        return -1
+    if LOCAL_CACHE_ENABLED:
+        local_cache.set(version_key, version, len(version_key) + 8, user_id, generation)
+    return version
+
+async def get_cached_notes(user_id: str, version: int, page: str) -> Optional[bytes]:
+    """Get a cached page of notes for a user, as the bytes that were stored."""
+    if version < 0:
+        return None
+    cache_key = get_notes_cache_key(user_id, version, page)
+    if LOCAL_CACHE_ENABLED:
+        cached = local_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    if redis_client is None:
+        return None
+    generation = local_cache.generation(user_id)
+    try:
+        with timed("redis"):
+            cached_data = await redis_client.get(cache_key)
         if cached_data:
-            return json.loads(cached_data)
+            redis_stats["hits"] += 1
+            cached_data = decompress(cached_data, "cache")
+            if LOCAL_CACHE_ENABLED:
+                local_cache.set(cache_key, cached_data, len(cached_data), user_id, generation)
+            return cached_data
+        redis_stats["misses"] += 1
     except Exception as e:
-        print(f"Error getting cached notes: {e}")
+        redis_stats["errors"] += 1
+        logger.error("Error getting cached notes: %s", e)
     return None
 
-def set_cached_notes(user_id: str, notes: List[Dict[str, Any]], expire: int = 3600) -> bool:
-    """Cache user's notes with an optional expiration time in seconds."""
+async def set_cached_notes(user_id: str, version: int, page: str, data: bytes, expire: int = 3600,
+                           generation: Optional[int] = None) -> bool:
+    """
+    Cache a page of a user's notes with an optional expiration time in seconds.
+    Pass the local generation read before the page was loaded: if the user's
+    notes were invalidated since, the local tier won't keep the page.
+    """
+    if version < 0:
+        return False
+    cache_key = get_notes_cache_key(user_id, version, page)
+    if generation is None:
+        generation = local_cache.generation(user_id)
+    if redis_client is None:
+        if LOCAL_CACHE_ENABLED:
+            return local_cache.set(cache_key, data, len(data), user_id, generation)
+        return False
+    stored = compress(data, "cache", CACHE_COMPRESS_MIN_BYTES)
     try:
-        cache_key = get_notes_cache_key(user_id)
-        redis_client.setex(cache_key, expire, json.dumps(notes, default=str))
+        with timed("redis"):
+            await redis_client.setex(cache_key, expire, stored)
+        if LOCAL_CACHE_ENABLED:
+            local_cache.set(cache_key, data, len(data), user_id, generation)
         return True
     except Exception as e:
-        print(f"Error caching notes: {e}")
+        logger.error("Error caching notes: %s", e)
         return False
 
-def invalidate_notes_cache(user_id: str) -> bool:
-    """Invalidate (delete) the cache for a user's notes."""
+async def invalidate_notes_cache(user_id: str) -> bool:
+    """
+    Invalidate every cached page of a user's notes in O(1) by bumping the version.
+    Pages cached under older versions are never read again and expire via TTL.
+    """
+    local_cache.invalidate_group(user_id)
+    if redis_client is None:
+        return True
     try:
-        cache_key = get_notes_cache_key(user_id)
-        return bool(redis_client.delete(cache_key))
+        with timed("redis"):
+            await redis_client.incr(get_notes_version_key(user_id))
+        # Again: a read on this worker during the INCR may have cached the old version locally,
+        # and our own broadcast never comes back to evict it
+        local_cache.invalidate_group(user_id)
+        # Other workers drop their local copies when they see this
+        await broker.publish(CACHE_INVALIDATION_CHANNEL, {"userId": user_id})
+        return True
     except Exception as e:
-        print(f"Error invalidating cache: {e}")
+        logger.error("Error invalidating cache: %s", e)
         return False
+
+def get_notes_stale_key(user_id: str, page: str) -> str:
+    """Version-independent copy of a page, used for stale-while-revalidate."""
+    return f"user:{user_id}:notes:stale:{page}"
+
+async def get_or_load_notes(user_id: str, page: str, loader: Callable[[], Awaitable[bytes]],
+                            expire: int = 3600) -> bytes:
+    """
+    Return a cached page, rebuilding it with `loader` on a miss.
+    Pages are opaque bytes (the loader does the encoding), so a hit costs no
+    JSON work at all.
+    Concurrent misses for the same page share one rebuild: inside this process
+    through an in-flight task, across processes through a short Redis lock
+    that the other workers wait on. The rebuild runs in its own task, so a
+    caller that is cancelled (a client gone away) does not cancel it for the
+    others. With CACHE_STALE_WHILE_REVALIDATE=1 a miss returns the previous
+    copy of the page right away and rebuilds in the background.
+    """
+    version = await get_notes_cache_version(user_id)
+    cached = await get_cached_notes(user_id, version, page)
+    if cached is not None:
+        return cached
+
+    cache_key = get_notes_cache_key(user_id, version, page)
+    inflight = _inflight.get(cache_key)
+    if inflight is not None:
+        rebuild_stats["coalesced"] += 1
+        return await asyncio.shield(inflight)
+
+    task = asyncio.create_task(_rebuild_page(user_id, version, page, cache_key, loader, expire))
+    _inflight[cache_key] = task
+    task.add_done_callback(lambda t: _settle(cache_key, t))
+
+    if STALE_WHILE_REVALIDATE and version >= 0:
+        stale = await _get_stale_page(user_id, page)
+        if stale is not None:
+            rebuild_stats["stale_served"] += 1
+            return stale
+
+    return await asyncio.shield(task)
+
+def _settle(cache_key: str, task: "asyncio.Task") -> None:
+    if _inflight.get(cache_key) is task:
+        del _inflight[cache_key]
+    # Mark retrieved so a failure nobody awaited is not reported as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+async def _rebuild_page(user_id: str, version: int, page: str, cache_key: str,
+                        loader: Callable[[], Awaitable[bytes]], expire: int) -> bytes:
+    if version < 0:
+        # Redis is unavailable: go straight to the database
+        return await loader()
+
+    lock_key = f"lock:{cache_key}"
+    token = uuid.uuid4().hex
+    if redis_client is None:
+        # No other workers to coordinate with; the in-flight future already coalesces
+        acquired = False
+    else:
+        try:
+            with timed("redis"):
+                acquired = await redis_client.set(lock_key, token, nx=True, px=REBUILD_LOCK_TTL_MS)
+        except Exception as e:
+            logger.error("Error acquiring rebuild lock: %s", e)
+            acquired = True
+
+    if not acquired and redis_client is not None:
+        # Another worker is rebuilding this page; wait for it to land in Redis
+        rebuild_stats["lock_waits"] += 1
+        deadline = asyncio.get_running_loop().time() + REBUILD_WAIT_TIMEOUT
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(REBUILD_POLL_INTERVAL)
+            cached = await get_cached_notes(user_id, version, page)
+            if cached is not None:
+                return cached
+        # The other rebuild is too slow or died; do it ourselves
+
+    try:
+        rebuild_stats["rebuilds"] += 1
+        # Read before loading, so a write that lands during the load keeps this page out of the local tier
+        generation = local_cache.generation(user_id)
+        data = await loader()
+        await set_cached_notes(user_id, version, page, data, expire, generation)
+        if STALE_WHILE_REVALIDATE:
+            await _set_stale_page(user_id, page, data, expire)
+        return data
+    finally:
+        if acquired:
+            try:
+                with timed("redis"):
+                    await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                logger.error("Error releasing rebuild lock: %s", e)
+
+async def _get_stale_page(user_id: str, page: str) -> Optional[bytes]:
+    if redis_client is None:
+        return None
+    try:
+        with timed("redis"):
+            cached_data = await redis_client.get(get_notes_stale_key(user_id, page))
+        if cached_data:
+            return decompress(cached_data, "cache")
+    except Exception as e:
+        logger.error("Error getting stale notes: %s", e)
+    return None
+
+async def _set_stale_page(user_id: str, page: str, data: bytes, expire: int) -> None:
+    if redis_client is None:
+        return
+    stored = compress(data, "cache", CACHE_COMPRESS_MIN_BYTES)
+    try:
+        with timed("redis"):
+            await redis_client.setex(get_notes_stale_key(user_id, page), expire, stored)
+    except Exception as e:
+        logger.error("Error caching stale notes: %s", e)
+
+async def _on_cache_invalidation(message: Dict[str, Any]) -> None:
+    user_id = message.get("userId")
+    if user_id:
+        local_cache.invalidate_group(user_id)
+
+async def start_cache_invalidation_listener() -> None:
+    """Subscribe to invalidations published by other workers."""
+    await broker.subscribe(CACHE_INVALIDATION_CHANNEL, _on_cache_invalidation)
+
+def get_cache_stats() -> Dict[str, Any]:
+    lookups = redis_stats["hits"] + redis_stats["misses"]
+    return {
+        "local": local_cache.stats(),
+        "redis": dict(redis_stats, hit_rate=redis_stats["hits"] / lookups if lookups else 0.0),
+        "rebuilds": dict(rebuild_stats, inflight=len(_inflight)),
+    }
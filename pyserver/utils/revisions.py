@@ -0,0 +1,279 @@
+"""
+Revision history of notes, stored as compact deltas.
+
+Every content change of a note, its delete and a restore append a record
+to the note's history, keyed by the revision number of that write; a tag
+change appends an empty delta, so the history has no gap in it. Most
+records are deltas: the text operation that turns the previous version into
+this one, with the components of the collab edit protocol (positive int:
+retain, str: insert, negative int: delete). Every REVISION_SNAPSHOT_INTERVAL
+versions the full text is stored instead (compressed like note bodies), so
+rebuilding any version reads one snapshot and fewer than
+REVISION_SNAPSHOT_INTERVAL deltas, however long the history is.
+
+A note gets its history on its first edit, when the version it had until
+then is stored as a snapshot; creating and importing notes costs nothing
+extra. The delete record keeps the last text, so deleted notes can be
+restored.
+
+Old records are dropped per note, oldest first, beyond the newest
+REVISION_MAX_COUNT versions and after REVISION_MAX_AGE_DAYS, but never a
+snapshot that a kept version is rebuilt from. Counts are applied whenever a
+snapshot is written; ages by a periodic sweep.
+
+The repositories store the records; this module decides what to store and
+rebuilds versions from it.
+"""
+import asyncio
+import difflib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from utils.compression import compress, decompress
+
+logger = logging.getLogger(__name__)
+
+# Record revisions at all
+REVISION_HISTORY = os.getenv("REVISION_HISTORY", "1") == "1"
+# A full snapshot every this many versions; bounds the deltas applied per rebuild
+REVISION_SNAPSHOT_INTERVAL = max(1, int(os.getenv("REVISION_SNAPSHOT_INTERVAL", "20")))
+# Versions kept per note (0 = no limit)
+REVISION_MAX_COUNT = int(os.getenv("REVISION_MAX_COUNT", "100"))
+# Versions older than this are dropped by the sweep (0 = keep forever)
+REVISION_MAX_AGE_DAYS = float(os.getenv("REVISION_MAX_AGE_DAYS", "90"))
+# Seconds between age sweeps
+REVISION_SWEEP_INTERVAL = float(os.getenv("REVISION_SWEEP_INTERVAL", "3600"))
+# Snapshots at least this big are stored compressed (0 = never)
+REVISION_COMPRESS_MIN_BYTES = int(os.getenv("REVISION_COMPRESS_MIN_BYTES", "512"))
+# Above this many line pairs a changed region is stored as delete + insert
+# instead of being diffed line by line (difflib is quadratic in the worst case)
+REVISION_DIFF_MAX_CELLS = 1_000_000
+
+Component = Union[int, str]
+Delta = List[Component]
+
+_lock = threading.Lock()
+_stats = {"snapshots": 0, "deltas": 0, "rebuilds": 0, "deltas_applied": 0, "pruned": 0}
+
+
+def _count(**amounts: int) -> None:
+    # Also called from the SQLite writer thread
+    with _lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+
+def get_revision_stats() -> Dict[str, Any]:
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+    stats["snapshot_interval"] = REVISION_SNAPSHOT_INTERVAL
+    return stats
+
+
+# ---------------- Deltas ----------------
+def _append(delta: Delta, c: Component) -> None:
+    """Append a component, merging it into the previous one of the same kind."""
+    if delta and type(delta[-1]) is type(c) and (isinstance(c, str) or (delta[-1] > 0) == (c > 0)):
+        delta[-1] += c
+    else:
+        delta.append(c)
+
+
+def make_delta(old: str, new: str) -> Delta:
+    """The operation turning old into new: common prefix and suffix, then a line diff of the rest."""
+    start = 0
+    end = min(len(old), len(new))
+    while start < end and old[start] == new[start]:
+        start += 1
+    tail = 0
+    while tail < end - start and old[len(old) - 1 - tail] == new[len(new) - 1 - tail]:
+        tail += 1
+
+    delta: Delta = []
+    if start:
+        delta.append(start)
+    old_mid, new_mid = old[start:len(old) - tail], new[start:len(new) - tail]
+    old_lines, new_lines = old_mid.splitlines(True), new_mid.splitlines(True)
+    if old_lines and new_lines and len(old_lines) * len(new_lines) <= REVISION_DIFF_MAX_CELLS:
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                _append(delta, sum(map(len, old_lines[i1:i2])))
+                continue
+            if j2 > j1:
+                _append(delta, "".join(new_lines[j1:j2]))
+            if i2 > i1:
+                _append(delta, -sum(map(len, old_lines[i1:i2])))
+    else:
+        if new_mid:
+            _append(delta, new_mid)
+        if old_mid:
+            _append(delta, -len(old_mid))
+    if tail:
+        _append(delta, tail)
+    return delta
+
+
+def apply_delta(text: str, delta: Sequence[Component]) -> str:
+    parts: List[str] = []
+    pos = 0
+    for c in delta:
+        if isinstance(c, str):
+            parts.append(c)
+        elif c > 0:
+            parts.append(text[pos:pos + c])
+            pos += c
+        else:
+            pos -= c
+    if pos != len(text):
+        raise ValueError("Revision delta does not match the version it applies to")
+    return "".join(parts)
+
+
+# ---------------- Records ----------------
+def _snapshot(rev: int, created_at: Optional[str], title: Optional[str], content: str,
+              deleted: bool = False) -> Dict[str, Any]:
+    record = {"rev": rev, "createdAt": created_at, "title": title, "size": len(content), "depth": 0,
+              "snapshot": compress(content.encode("utf-8"), "revision", REVISION_COMPRESS_MIN_BYTES)}
+    if deleted:
+        record["deleted"] = True
+    return record
+
+
+def plan_revisions(latest: Optional[Dict[str, Any]], previous: Optional[Dict[str, Any]], rev: int,
+                   title: Optional[str], content: str, now: str, deleted: bool = False) -> List[Dict[str, Any]]:
+    """
+    The records to append for a write of revision `rev`.
+
+    latest: {"rev", "depth"} of the newest stored record of the note, or None.
+    previous: {"rev", "title", "content", "updatedAt"} of the version the
+    write replaced, or None if there was none to read (a restored tombstone);
+    then the new version is stored in full. deleted marks the delete record.
+    """
+    records = []
+    depth = latest["depth"] if latest is not None else None
+    if previous is not None and (latest is None or latest["rev"] != previous["rev"]):
+        # No history yet (or a gap in it): start from the version being replaced
+        records.append(_snapshot(previous["rev"], previous.get("updatedAt"), previous.get("title"),
+                                 previous["content"]))
+        depth = 0
+    if previous is None or depth is None or depth + 1 >= REVISION_SNAPSHOT_INTERVAL:
+        records.append(_snapshot(rev, now, title, content, deleted))
+    else:
+        record = {"rev": rev, "createdAt": now, "title": title, "size": len(content), "depth": depth + 1,
+                  "delta": make_delta(previous["content"], content)}
+        if deleted:
+            record["deleted"] = True
+        records.append(record)
+    snapshots = sum(1 for record in records if record["depth"] == 0)
+    _count(snapshots=snapshots, deltas=len(records) - snapshots)
+    return records
+
+
+def plan_unchanged_revision(latest: Optional[Dict[str, Any]], previous_rev: Optional[int], rev: int,
+                            title: Optional[str], size: Optional[int], now: str) -> Optional[Dict[str, Any]]:
+    """
+    The record for a write of revision `rev` that kept the title and text (a
+    tag change), or None if none is needed: without history, or with a gap
+    in it already, the next edit starts from a snapshot anyway, as it does
+    when the chain is due one. size is the length of the unchanged text.
+    """
+    if latest is None or previous_rev is None or size is None or latest["rev"] != previous_rev:
+        return None
+    if latest["depth"] + 1 >= REVISION_SNAPSHOT_INTERVAL:
+        return None
+    _count(deltas=1)
+    return {"rev": rev, "createdAt": now, "title": title, "size": size, "depth": latest["depth"] + 1,
+            "delta": [size] if size else []}
+
+
+def rebuild(chain: List[Dict[str, Any]]) -> str:
+    """The text of the last record of chain, which runs from a snapshot forward."""
+    content = decompress(chain[0]["snapshot"], "revision").decode("utf-8")
+    for record in chain[1:]:
+        content = apply_delta(content, record["delta"])
+    _count(rebuilds=1, deltas_applied=len(chain) - 1)
+    return content
+
+
+def revision_summary(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A record as listed by GET /notes/{id}/revisions."""
+    item = {"rev": record["rev"], "createdAt": record.get("createdAt"), "title": record.get("title"),
+            "size": record.get("size", 0)}
+    if record.get("deleted"):
+        item["deleted"] = True
+    return item
+
+
+def age_cutoff() -> Optional[str]:
+    if REVISION_MAX_AGE_DAYS <= 0:
+        return None
+    return (datetime.now(timezone.utc) - timedelta(days=REVISION_MAX_AGE_DAYS)).isoformat()
+
+
+def prune_point(records: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    Given {"rev", "createdAt", "depth"} of all of a note's records, newest
+    first, the revision below which every record can be deleted (None: keep all).
+    """
+    keep = len(records)
+    if REVISION_MAX_COUNT > 0:
+        keep = min(keep, REVISION_MAX_COUNT)
+    cutoff = age_cutoff()
+    if cutoff is not None:
+        fresh = 0
+        while fresh < keep and (records[fresh].get("createdAt") or "") >= cutoff:
+            fresh += 1
+        keep = fresh
+    if keep >= len(records):
+        return None
+    if keep == 0:
+        return records[0]["rev"] + 1
+    # The oldest kept version is rebuilt from the newest snapshot at or before it
+    for index in range(keep - 1, len(records)):
+        if records[index]["depth"] == 0:
+            return records[index]["rev"] if index < len(records) - 1 else None
+    return None
+
+
+def count_pruned(removed: int) -> None:
+    _count(pruned=removed)
+
+
+# ---------------- Age sweep ----------------
+class RevisionSweeper:
+    """Periodically prunes the history of notes that have records past REVISION_MAX_AGE_DAYS."""
+
+    def __init__(self, interval: float = REVISION_SWEEP_INTERVAL) -> None:
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, repository) -> None:
+        if REVISION_HISTORY and REVISION_MAX_AGE_DAYS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop(repository))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self, repository) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await repository.sweep_revisions(age_cutoff())
+                if removed:
+                    logger.info("Pruned %d expired note revisions", removed)
+            except Exception as e:
+                logger.error("Error pruning note revisions: %s", e)
+
+
+# Global instance
+revision_sweeper = RevisionSweeper()
@@ -0,0 +1,208 @@
+"""
+Full-text search over a user's notes (title and content).
+
+Two backends, chosen by SEARCH_BACKEND:
+- "database" (default; "mongo" also selects it): the storage backend's own
+  text index, a per-user compound text index in MongoDB or FTS5 in SQLite.
+- "memory": a pure-Python inverted index kept in this process and updated
+  incrementally on every write. Meant for local runs; each worker only sees
+  the writes it handled itself.
+
+Both return ranked results with a highlighted snippet.
+"""
+import heapq
+import math
+import os
+import re
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.notes_repository import notes_repo
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "database").lower()
+SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return [w.lower() for w in _WORD_RE.findall(text or "")]
+
+
+def make_snippet(title: str, content: str, terms: Set[str], width: int = SNIPPET_CHARS) -> Dict[str, Any]:
+    """
+    Cut a window of `width` characters around the first matching term (content
+    first, then title) and report the [start, end) offsets of every match in it.
+    Offsets are returned instead of markup so clients can render them safely.
+    """
+    for text in (content or "", title or ""):
+        first = next((m for m in _WORD_RE.finditer(text) if m.group().lower() in terms), None)
+        if first is None:
+            continue
+        start = max(0, first.start() - width // 4)
+        end = min(len(text), start + width)
+        window = text[start:end]
+        highlights = [
+            [m.start(), m.end()] for m in _WORD_RE.finditer(window)
+            if m.group().lower() in terms
+        ]
+        return {"snippet": window, "highlights": highlights,
+                "truncatedStart": start > 0, "truncatedEnd": end < len(text)}
+    text = content or title or ""
+    return {"snippet": text[:width], "highlights": [], "truncatedStart": False, "truncatedEnd": len(text) > width}
+
+
+# ---------------- In-memory inverted index ----------------
+class InvertedIndex:
+    """
+    BM25-ranked inverted index for one user's notes.
+    Title terms count TITLE_WEIGHT times so title matches rank first.
+    The length-normalized term weight is computed once when a note is indexed
+    (against the average length at that time), so a query is just a sum of
+    idf * weight over the matching postings.
+    """
+    TITLE_WEIGHT = 3
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self) -> None:
+        # term -> {note_id: bm25 term weight}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        # note_id -> (title, content, createdAt, terms)
+        self.docs: Dict[str, Tuple[str, str, Optional[str], Tuple[str, ...]]] = {}
+        self.total_length = 0
+        self._lengths: Dict[str, int] = {}
+
+    def add(self, note_id: str, title: str, content: str, created_at: Optional[str] = None) -> None:
+        if note_id in self.docs:
+            self.remove(note_id)
+        counts: Dict[str, int] = {}
+        for term in tokenize(title):
+            counts[term] = counts.get(term, 0) + self.TITLE_WEIGHT
+        for term in tokenize(content):
+            counts[term] = counts.get(term, 0) + 1
+        length = sum(counts.values())
+        self.total_length += length
+        avg_len = self.total_length / (len(self.docs) + 1)
+        norm = self.K1 * (1 - self.B + self.B * length / avg_len) if avg_len else self.K1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[note_id] = tf * (self.K1 + 1) / (tf + norm)
+        self.docs[note_id] = (title, content, created_at, tuple(counts))
+        self._lengths[note_id] = length
+
+    def remove(self, note_id: str) -> None:
+        doc = self.docs.pop(note_id, None)
+        if doc is None:
+            return
+        self.total_length -= self._lengths.pop(note_id, 0)
+        for term in doc[3]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(note_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        terms = set(tokenize(query))
+        n_docs = len(self.docs)
+        if not terms or not n_docs:
+            return []
+
+        weighted = []
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting:
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                weighted.append((idf, posting))
+        if not weighted:
+            return []
+
+        if len(weighted) == 1:
+            idf, posting = weighted[0]
+            top = [(note_id, idf * w) for note_id, w in heapq.nlargest(limit, posting.items(), key=itemgetter(1))]
+        else:
+            scores: Dict[str, float] = {}
+            get = scores.get
+            for idf, posting in weighted:
+                for note_id, w in posting.items():
+                    scores[note_id] = get(note_id, 0.0) + idf * w
+            top = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+        results = []
+        for note_id, score in top:
+            title, content, created_at, _ = self.docs[note_id]
+            result = {"id": note_id, "title": title, "score": round(score, 4), "createdAt": created_at}
+            result.update(make_snippet(title, content, terms))
+            results.append(result)
+        return results
+
+
+class InMemorySearch:
+    def __init__(self) -> None:
+        self._indexes: Dict[str, InvertedIndex] = {}
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def _index_for(self, user_id: str) -> InvertedIndex:
+        index = self._indexes.get(user_id)
+        if index is None:
+            # First search for this user in this process: build from the database
+            index = InvertedIndex()
+            async for note in notes_repo.iter_user_notes(user_id):
+                index.add(str(note["_id"]), note.get("title", ""), note.get("content", ""), note.get("createdAt"))
+            self._indexes[user_id] = index
+        return index
+
+    async def index_note(self, user_id: str, note: Dict[str, Any]) -> None:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.add(note["id"], note.get("title", ""), note.get("content", ""), note.get("createdAt"))
+
+    async def remove_note(self, user_id: str, note_id: str) -> None:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove(note_id)
+
+    async def search(self, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        index = await self._index_for(user_id)
+        return index.search(query, limit)
+
+
+# ---------------- Database text index ----------------
+class DatabaseTextSearch:
+    """
+    The storage backend's own text index: a per-user compound text index in
+    MongoDB, or FTS5 in SQLite.
+    """
+
+    async def ensure_indexes(self) -> None:
+        await notes_repo.ensure_text_index(InvertedIndex.TITLE_WEIGHT)
+
+    async def index_note(self, user_id: str, note: Dict[str, Any]) -> None:
+        pass  # The database maintains the text index on write
+
+    async def remove_note(self, user_id: str, note_id: str) -> None:
+        pass
+
+    async def search(self, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        results = []
+        async for note in notes_repo.text_search(user_id, query, limit):
+            result = {"id": str(note["_id"]), "title": note.get("title", ""),
+                      "score": round(note.get("score", 0.0), 4), "createdAt": note.get("createdAt")}
+            result.update(make_snippet(note.get("title", ""), note.get("content", ""), terms))
+            results.append(result)
+        return results
+
+
+def create_search_backend():
+    if SEARCH_BACKEND == "memory":
+        return InMemorySearch()
+    return DatabaseTextSearch()
+
+
+# Global instance
+search_backend = create_search_backend()
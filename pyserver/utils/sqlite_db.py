@@ -0,0 +1,190 @@
+"""
+Embedded SQLite database for the single-process desktop build (STORAGE_BACKEND=sqlite).
+
+The file runs in WAL mode: readers never wait for the writer. There are two
+connections, each used only from its own thread:
+- a writer, which serializes all writes;
+- a reader.
+Queries run on those threads, so the event loop never blocks on disk.
+sqlite3 caches compiled statements per connection, and the repository uses
+fixed SQL strings, so the same prepared statement is reused on every call.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# NORMAL in WAL mode syncs on checkpoint, not on every commit: a crash of the
+# app loses nothing, a power cut can lose the last few commits
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", str(16 * 1024)))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(64 * 1024 * 1024)))
+# Prepared statements kept per connection
+SQLITE_STATEMENT_CACHE = 256
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    preview TEXT,
+    size INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    rev INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    deleted_at TEXT,
+    -- JSON array; tombstones keep theirs for a restore
+    tags TEXT
+);
+-- Keyset pagination, newest first
+CREATE INDEX IF NOT EXISTS notes_user_created ON notes (user_id, created_at DESC, id DESC);
+-- Change feed
+CREATE INDEX IF NOT EXISTS notes_user_rev ON notes (user_id, rev);
+
+-- Tags of live notes, a row per note and tag. The key is the equivalent of
+-- MongoDB's multikey index: a tag's notes are one range, newest first
+CREATE TABLE IF NOT EXISTS note_tags (
+    user_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    note_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, tag, created_at, note_id)
+) WITHOUT ROWID;
+-- Per-user note count of each tag, kept by the triggers below
+CREATE TABLE IF NOT EXISTS tag_counts (
+    user_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, tag)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS note_tags_count_insert AFTER INSERT ON note_tags BEGIN
+    INSERT INTO tag_counts (user_id, tag, count) VALUES (new.user_id, new.tag, 1)
+        ON CONFLICT (user_id, tag) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS note_tags_count_delete AFTER DELETE ON note_tags BEGIN
+    UPDATE tag_counts SET count = count - 1 WHERE user_id = old.user_id AND tag = old.tag;
+    DELETE FROM tag_counts WHERE user_id = old.user_id AND tag = old.tag AND count <= 0;
+END;
+
+-- Per-user revision counters
+CREATE TABLE IF NOT EXISTS counters (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+-- Revision history (see utils.revisions): a full snapshot or a JSON delta per version
+CREATE TABLE IF NOT EXISTS note_revisions (
+    note_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    created_at TEXT,
+    title TEXT,
+    size INTEGER,
+    depth INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    snapshot BLOB,
+    delta TEXT,
+    PRIMARY KEY (note_id, rev)
+) WITHOUT ROWID;
+-- Age sweep
+CREATE INDEX IF NOT EXISTS note_revisions_created ON note_revisions (created_at);
+
+-- Full-text index over title and content, kept in sync by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5 (
+    title, content, content='notes', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, title, content) VALUES (new.rowid, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.rowid, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF title, content ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, title, content) VALUES ('delete', old.rowid, old.title, old.content);
+    INSERT INTO notes_fts (rowid, title, content) VALUES (new.rowid, new.title, new.content);
+END;
+"""
+
+# Columns added since the first release: (table, column, declaration).
+# CREATE TABLE IF NOT EXISTS leaves older files alone, so add them there.
+MIGRATIONS = (
+    ("notes", "tags", "TEXT"),
+)
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    for table, column, declaration in MIGRATIONS:
+        if column not in {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}:
+            logger.info("Adding column %s.%s", table, column)
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+class SQLiteDatabase:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.name = path
+        in_memory = path == ":memory:"
+        if not in_memory:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._writer = self._open()
+        self._writer.executescript(SCHEMA)
+        migrate(self._writer)
+        self._write_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+        if in_memory:
+            # A second connection would open a different, empty database
+            self._reader, self._read_thread = self._writer, self._write_thread
+        else:
+            self._reader = self._open()
+            self._read_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-read")
+
+    def _open(self) -> sqlite3.Connection:
+        # Autocommit; writes open their own transaction (see transaction())
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    async def read(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run fn(connection, *args) on the reader thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._read_thread, fn, self._reader, *args)
+
+    async def write(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run fn(connection, *args) on the writer thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._write_thread, fn, self._writer, *args)
+
+    async def ping(self) -> None:
+        await self.read(lambda conn: conn.execute("SELECT 1").fetchone())
+
+    def close(self) -> None:
+        self._write_thread.shutdown(wait=True)
+        if self._reader is not self._writer:
+            self._read_thread.shutdown(wait=True)
+            self._reader.close()
+        self._writer.close()
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
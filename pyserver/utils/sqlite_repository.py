@@ -0,0 +1,491 @@
+"""
+NotesRepository on the embedded SQLite database (STORAGE_BACKEND=sqlite).
+
+Same methods and return shapes as the MongoDB repository, so routes, the
+write batcher, collaboration and search work unchanged: documents come back
+with an ObjectId `_id` and camelCase fields, and ids are ObjectIds stored as
+their hex string (which sorts the same way).
+
+Each method runs one function on the database thread (see utils.sqlite_db),
+and a write, its revision bump and its revision history record share a
+single transaction.
+
+A note's tags are stored with it (JSON) and, while it is live, as rows of
+note_tags, whose triggers keep tag_counts exact in the same transaction.
+"""
+import re
+import sqlite3
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from bson.objectid import ObjectId
+from utils.codec import dumps_str, loads
+from utils.metrics import timed_async
+from utils.notes_repository import _now, encode_cursor, stamp_notes, summary_fields, tag_deltas
+from utils.revisions import (REVISION_HISTORY, count_pruned, plan_revisions, plan_unchanged_revision, prune_point,
+                             rebuild, revision_summary)
+from utils.sqlite_db import transaction
+
+# Fixed statements, so each connection prepares them once
+BUMP_REVISION = ("INSERT INTO counters (id, seq) VALUES (?, ?) "
+                 "ON CONFLICT (id) DO UPDATE SET seq = seq + excluded.seq")
+GET_REVISION = "SELECT seq FROM counters WHERE id = ?"
+INSERT_NOTE = ("INSERT INTO notes (id, user_id, title, content, preview, size, created_at, updated_at, rev, tags) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+FIND_NOTE = "SELECT * FROM notes WHERE id = ? AND user_id = ? AND deleted = 0"
+FIND_ANY_NOTE = "SELECT * FROM notes WHERE id = ? AND user_id = ?"
+UPDATE_CONTENT = ("UPDATE notes SET content = ?, preview = ?, size = ?, updated_at = ?, rev = ? "
+                  "WHERE id = ? AND user_id = ? AND deleted = 0")
+DELETE_NOTE = ("UPDATE notes SET deleted = 1, deleted_at = ?, updated_at = ?, rev = ?, "
+               "title = NULL, content = NULL, preview = NULL, size = NULL "
+               "WHERE id = ? AND user_id = ? AND deleted = 0")
+RESTORE_NOTE = ("UPDATE notes SET title = ?, content = ?, preview = ?, size = ?, updated_at = ?, rev = ?, "
+                "deleted = 0, deleted_at = NULL WHERE id = ? AND user_id = ?")
+SET_TAGS = "UPDATE notes SET tags = ?, updated_at = ?, rev = ? WHERE id = ? AND user_id = ? AND deleted = 0"
+INSERT_TAG = "INSERT INTO note_tags (user_id, tag, created_at, note_id) VALUES (?, ?, ?, ?)"
+DELETE_TAG = "DELETE FROM note_tags WHERE user_id = ? AND tag = ? AND created_at = ? AND note_id = ?"
+LIST_TAGS = "SELECT tag, count FROM tag_counts WHERE user_id = ? ORDER BY tag"
+LIST_CHANGES = "SELECT * FROM notes WHERE user_id = ? AND rev > ? ORDER BY rev LIMIT ?"
+_PAGE = ("SELECT id, title, {fields}, tags, created_at, updated_at, rev FROM notes "
+         "WHERE user_id = ? AND deleted = 0 {after}ORDER BY created_at DESC, id DESC LIMIT ?")
+_AFTER = "AND (created_at, id) < (?, ?) "
+# A tag's page walks its range of the note_tags key, joining each row to its note
+_TAG_PAGE = ("SELECT notes.id, title, {fields}, tags, notes.created_at, updated_at, rev FROM note_tags "
+             "JOIN notes ON notes.id = note_tags.note_id "
+             "WHERE note_tags.user_id = ? AND note_tags.tag = ? {after}"
+             "ORDER BY note_tags.created_at DESC, note_tags.note_id DESC LIMIT ?")
+_TAG_AFTER = "AND (note_tags.created_at, note_tags.note_id) < (?, ?) "
+LIST_PAGE = {
+    (summary, after, tagged): (_TAG_PAGE if tagged else _PAGE).format(
+        fields="preview, size" if summary else "content", after=(_TAG_AFTER if tagged else _AFTER) if after else "")
+    for summary in (False, True) for after in (False, True) for tagged in (False, True)
+}
+EXPORT_PAGE = LIST_PAGE[False, False, False], LIST_PAGE[False, True, False]
+TEXT_SEARCH = ("SELECT notes.*, -bm25(notes_fts, ?, 1.0) AS score "
+               "FROM notes_fts JOIN notes ON notes.rowid = notes_fts.rowid "
+               "WHERE notes_fts MATCH ? AND notes.user_id = ? AND notes.deleted = 0 "
+               "ORDER BY score DESC LIMIT ?")
+LATEST_REVISION = "SELECT rev, depth FROM note_revisions WHERE note_id = ? ORDER BY rev DESC LIMIT 1"
+INSERT_REVISION = ("INSERT INTO note_revisions (note_id, user_id, rev, created_at, title, size, depth, deleted, "
+                   "snapshot, delta) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+_LIST_REVISIONS = ("SELECT rev, created_at, title, size, depth, deleted FROM note_revisions "
+                   "WHERE note_id = ? AND user_id = ? {before}ORDER BY rev DESC LIMIT ?")
+LIST_REVISIONS = _LIST_REVISIONS.format(before=""), _LIST_REVISIONS.format(before="AND rev < ? ")
+REVISION_BASE = ("SELECT * FROM note_revisions WHERE note_id = ? AND user_id = ? AND rev <= ? AND depth = 0 "
+                 "ORDER BY rev DESC LIMIT 1")
+REVISION_CHAIN = "SELECT * FROM note_revisions WHERE note_id = ? AND rev > ? AND rev <= ? ORDER BY rev"
+REVISION_AGES = "SELECT rev, created_at, depth FROM note_revisions WHERE note_id = ? ORDER BY rev DESC"
+PRUNE_REVISIONS = "DELETE FROM note_revisions WHERE note_id = ? AND rev < ?"
+EXPIRED_REVISION_NOTES = "SELECT DISTINCT note_id FROM note_revisions WHERE created_at < ?"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _doc(row: sqlite3.Row) -> Dict[str, Any]:
+    """A notes row in the shape the MongoDB repository returns."""
+    doc = {"_id": ObjectId(row["id"]), "userId": row["user_id"], "title": row["title"], "content": row["content"],
+           "preview": row["preview"], "size": row["size"], "createdAt": row["created_at"],
+           "updatedAt": row["updated_at"], "rev": row["rev"], "tags": _tags(row)}
+    if row["deleted"]:
+        doc["deleted"] = True
+        doc["deletedAt"] = row["deleted_at"]
+    return doc
+
+
+def _tags(row: sqlite3.Row) -> List[str]:
+    return loads(row["tags"]) if row["tags"] else []
+
+
+def _bump_revision(conn: sqlite3.Connection, user_id: str, count: int = 1) -> int:
+    key = f"rev:{user_id}"
+    conn.execute(BUMP_REVISION, (key, count))
+    return conn.execute(GET_REVISION, (key,)).fetchone()[0]
+
+
+def _note_row(note: Dict[str, Any]) -> Tuple:
+    tags = note.get("tags")
+    return (str(note["_id"]), note["userId"], note.get("title"), note.get("content"), note.get("preview"),
+            note.get("size"), note["createdAt"], note.get("updatedAt"), note["rev"], dumps_str(tags) if tags else None)
+
+
+def _tag_rows(user_id: str, created_at: str, note_id: str, tags) -> List[Tuple]:
+    return [(user_id, tag, created_at, note_id) for tag in tags]
+
+
+def _insert_note(conn: sqlite3.Connection, note: Dict[str, Any]) -> None:
+    conn.execute(INSERT_NOTE, _note_row(note))
+    conn.executemany(INSERT_TAG, _tag_rows(note["userId"], note["createdAt"], str(note["_id"]), note.get("tags", ())))
+
+
+# ---------------- Revision history ----------------
+def _revision(row: sqlite3.Row) -> Dict[str, Any]:
+    """A note_revisions row as a record of utils.revisions."""
+    record = {"rev": row["rev"], "createdAt": row["created_at"], "title": row["title"], "size": row["size"],
+              "depth": row["depth"]}
+    if row["deleted"]:
+        record["deleted"] = True
+    if "snapshot" in row.keys():
+        record["snapshot"] = row["snapshot"]
+        record["delta"] = loads(row["delta"]) if row["delta"] is not None else None
+    return record
+
+
+def _record_revision(conn: sqlite3.Connection, note_id: str, user_id: str, previous: sqlite3.Row, rev: int,
+                     title: Optional[str], content: Optional[str], deleted: bool = False) -> None:
+    """
+    Append the version written at `rev` to the note's history, given the row
+    it replaced. content None keeps the text of that row (a delete).
+    """
+    if not REVISION_HISTORY:
+        return
+    before = None
+    if not previous["deleted"]:
+        before = {"rev": previous["rev"], "title": previous["title"], "content": previous["content"] or "",
+                  "updatedAt": previous["updated_at"]}
+    if content is None:
+        content = before["content"] if before is not None else ""
+    latest = conn.execute(LATEST_REVISION, (note_id,)).fetchone()
+    records = plan_revisions(dict(latest) if latest is not None else None, before, rev, title, content, _now(),
+                             deleted)
+    conn.executemany(INSERT_REVISION, [_revision_row(note_id, user_id, record) for record in records])
+    if records[-1]["depth"] == 0:
+        _prune_revisions(conn, note_id)
+
+
+def _record_unchanged_revision(conn: sqlite3.Connection, note_id: str, user_id: str, previous: sqlite3.Row,
+                               rev: int) -> None:
+    """Keep the note's history free of gaps across a write that kept its text (a tag change)."""
+    if not REVISION_HISTORY:
+        return
+    latest = conn.execute(LATEST_REVISION, (note_id,)).fetchone()
+    record = plan_unchanged_revision(dict(latest) if latest is not None else None, previous["rev"], rev,
+                                     previous["title"], previous["size"], _now())
+    if record is not None:
+        conn.execute(INSERT_REVISION, _revision_row(note_id, user_id, record))
+
+
+def _revision_row(note_id: str, user_id: str, record: Dict[str, Any]) -> tuple:
+    return (note_id, user_id, record["rev"], record["createdAt"], record["title"], record["size"], record["depth"],
+            int(record.get("deleted", False)), record.get("snapshot"),
+            dumps_str(record["delta"]) if "delta" in record else None)
+
+
+def _prune_revisions(conn: sqlite3.Connection, note_id: str) -> int:
+    rows = conn.execute(REVISION_AGES, (note_id,)).fetchall()
+    point = prune_point([{"rev": row["rev"], "createdAt": row["created_at"], "depth": row["depth"]} for row in rows])
+    if point is None:
+        return 0
+    removed = conn.execute(PRUNE_REVISIONS, (note_id, point)).rowcount
+    count_pruned(removed)
+    return removed
+
+
+class SQLiteNotesRepository:
+    """
+    Time spent in these methods counts as "sqlite" in the request breakdown.
+    The database is bound by the lifespan handler once it is open.
+    """
+
+    def __init__(self, database=None) -> None:
+        self.db = database
+        # Title terms outrank content terms by this factor (set with the text index)
+        self.title_weight = 1.0
+
+    def bind(self, database) -> None:
+        self.db = database
+
+    @timed_async("sqlite")
+    async def next_revision(self, user_id: str, count: int = 1) -> int:
+        """Reserve `count` revisions for a user and return the highest one."""
+        def run(conn):
+            with transaction(conn):
+                return _bump_revision(conn, user_id, count)
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def current_revision(self, user_id: str) -> int:
+        row = await self.db.read(lambda conn: conn.execute(GET_REVISION, (f"rev:{user_id}",)).fetchone())
+        return row[0] if row else 0
+
+    @timed_async("sqlite")
+    async def insert_note(self, note_data: Dict[str, Any]) -> str:
+        """Insert a note; sets _id, rev and updatedAt on note_data."""
+        def run(conn):
+            with transaction(conn):
+                note_data["rev"] = _bump_revision(conn, note_data["userId"])
+                note_data.update(summary_fields(note_data.get("content", "")))
+                note_data.setdefault("createdAt", _now())
+                note_data.setdefault("updatedAt", note_data["createdAt"])
+                note_data.setdefault("_id", ObjectId())
+                _insert_note(conn, note_data)
+        await self.db.write(run)
+        return str(note_data["_id"])
+
+    @timed_async("sqlite")
+    async def insert_notes(self, user_id: str, notes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Insert a batch of one user's notes in one transaction with one counter
+        update. Sets _id, rev and updatedAt on each dict; returns (first_rev, last_rev).
+        """
+        def run(conn):
+            with transaction(conn):
+                last_rev = _bump_revision(conn, user_id, len(notes))
+                first_rev = last_rev - len(notes) + 1
+                stamp_notes(user_id, notes, first_rev)
+                for note in notes:
+                    note.setdefault("_id", ObjectId())
+                    _insert_note(conn, note)
+            return first_rev, last_rev
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def stamp_new_notes(self, user_id: str, notes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Reserve a block of revisions and fill in the fields every new note carries."""
+        last_rev = await self.next_revision(user_id, len(notes))
+        first_rev = last_rev - len(notes) + 1
+        stamp_notes(user_id, notes, first_rev)
+        return first_rev, last_rev
+
+    @timed_async("sqlite")
+    async def bulk_insert(self, notes: List[Dict[str, Any]]) -> Dict[int, str]:
+        """
+        Insert already-stamped notes (from any users) in one transaction.
+        Returns {index: error} for the notes that were not written.
+        """
+        def run(conn):
+            errors = {}
+            with transaction(conn):
+                for index, note in enumerate(notes):
+                    try:
+                        _insert_note(conn, note)
+                    except sqlite3.IntegrityError as e:
+                        errors[index] = str(e)
+            return errors
+        return await self.db.write(run)
+
+    async def export_notes(self, user_id: str, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """All of a user's notes, newest first, read batch_size at a time."""
+        after: Optional[Tuple[str, str]] = None
+        while True:
+            if after is None:
+                rows = await self.db.read(lambda conn: conn.execute(EXPORT_PAGE[0], (user_id, batch_size)).fetchall())
+            else:
+                rows = await self.db.read(
+                    lambda conn: conn.execute(EXPORT_PAGE[1], (user_id, *after, batch_size)).fetchall())
+            for row in rows:
+                yield {"_id": ObjectId(row["id"]), "title": row["title"], "content": row["content"],
+                       "tags": _tags(row), "createdAt": row["created_at"], "updatedAt": row["updated_at"],
+                       "rev": row["rev"]}
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]["created_at"], rows[-1]["id"])
+
+    @timed_async("sqlite")
+    async def find_note(self, note_id: ObjectId, user_id: str, load_body: bool = True) -> Optional[Dict[str, Any]]:
+        # Bodies always live in the row, so load_body makes no difference here
+        row = await self.db.read(lambda conn: conn.execute(FIND_NOTE, (str(note_id), user_id)).fetchone())
+        return _doc(row) if row is not None else None
+
+    async def load_body(self, note: Dict[str, Any]) -> Dict[str, Any]:
+        return note
+
+    @timed_async("sqlite")
+    async def update_note_content(self, note_id: ObjectId, user_id: str, content: str) -> Optional[int]:
+        """Replace a note's content. Returns the new revision, or None if the note is gone."""
+        summary = summary_fields(content)
+
+        def run(conn):
+            with transaction(conn):
+                previous = conn.execute(FIND_NOTE, (str(note_id), user_id)).fetchone()
+                if previous is None:
+                    return None
+                rev = _bump_revision(conn, user_id)
+                conn.execute(UPDATE_CONTENT, (content, summary["preview"], summary["size"], _now(), rev,
+                                              str(note_id), user_id))
+                _record_revision(conn, str(note_id), user_id, previous, rev, previous["title"], content)
+            return rev
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def delete_note(self, note_id: ObjectId, user_id: str) -> Optional[int]:
+        """Soft-delete: drop the body and keep a tombstone. Returns the revision of the delete."""
+        def run(conn):
+            now = _now()
+            with transaction(conn):
+                previous = conn.execute(FIND_NOTE, (str(note_id), user_id)).fetchone()
+                if previous is None:
+                    return None
+                rev = _bump_revision(conn, user_id)
+                conn.execute(DELETE_NOTE, (now, now, rev, str(note_id), user_id))
+                conn.executemany(DELETE_TAG, _tag_rows(user_id, previous["created_at"], str(note_id), _tags(previous)))
+                # The delete record keeps the last text, so the note can be restored
+                _record_revision(conn, str(note_id), user_id, previous, rev, previous["title"], None, deleted=True)
+            return rev
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def restore_note(self, note_id: ObjectId, user_id: str, title: Optional[str],
+                           content: str) -> Optional[Tuple[int, bool]]:
+        """
+        Put an old version back as the current one, undeleting the note if needed.
+        Returns (revision, whether it was deleted), or None if there is no such note.
+        """
+        summary = summary_fields(content)
+
+        def run(conn):
+            with transaction(conn):
+                previous = conn.execute(FIND_ANY_NOTE, (str(note_id), user_id)).fetchone()
+                if previous is None:
+                    return None
+                rev = _bump_revision(conn, user_id)
+                conn.execute(RESTORE_NOTE, (title, content, summary["preview"], summary["size"], _now(), rev,
+                                            str(note_id), user_id))
+                if previous["deleted"]:
+                    conn.executemany(INSERT_TAG, _tag_rows(user_id, previous["created_at"], str(note_id),
+                                                           _tags(previous)))
+                _record_revision(conn, str(note_id), user_id, previous, rev, title, content)
+            return rev, bool(previous["deleted"])
+        return await self.db.write(run)
+
+    # ---------------- Tags ----------------
+    @timed_async("sqlite")
+    async def set_tags(self, note_id: ObjectId, user_id: str, tags: List[str]) -> Optional[Tuple[int, str]]:
+        """Replace a note's tags. Returns (revision, updatedAt), or None if the note is gone."""
+        def run(conn):
+            now = _now()
+            with transaction(conn):
+                previous = conn.execute(FIND_NOTE, (str(note_id), user_id)).fetchone()
+                if previous is None:
+                    return None
+                rev = _bump_revision(conn, user_id)
+                conn.execute(SET_TAGS, (dumps_str(tags) if tags else None, now, rev, str(note_id), user_id))
+                _record_unchanged_revision(conn, str(note_id), user_id, previous, rev)
+                deltas = tag_deltas(tags, _tags(previous))
+                created_at = previous["created_at"]
+                conn.executemany(DELETE_TAG, _tag_rows(user_id, created_at, str(note_id),
+                                                       [tag for tag, delta in deltas.items() if delta < 0]))
+                conn.executemany(INSERT_TAG, _tag_rows(user_id, created_at, str(note_id),
+                                                       [tag for tag, delta in deltas.items() if delta > 0]))
+            return rev, now
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def list_tags(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's tags with the number of notes carrying each, by name."""
+        rows = await self.db.read(lambda conn: conn.execute(LIST_TAGS, (user_id,)).fetchall())
+        return [{"tag": row["tag"], "count": row["count"]} for row in rows]
+
+    @timed_async("sqlite")
+    async def list_revisions(self, note_id: ObjectId, user_id: str, limit: int = 50,
+                             before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """One page of a note's history, newest first, without the text."""
+        if before is None:
+            sql, params = LIST_REVISIONS[0], (str(note_id), user_id, limit)
+        else:
+            sql, params = LIST_REVISIONS[1], (str(note_id), user_id, before, limit)
+        rows = await self.db.read(lambda conn: conn.execute(sql, params).fetchall())
+        return [revision_summary(_revision(row)) for row in rows]
+
+    @timed_async("sqlite")
+    async def get_revision(self, note_id: ObjectId, user_id: str, rev: int) -> Optional[Dict[str, Any]]:
+        """The version written at `rev`, rebuilt from the nearest snapshot, or None."""
+        def run(conn):
+            base = conn.execute(REVISION_BASE, (str(note_id), user_id, rev)).fetchone()
+            if base is None:
+                return None
+            return [base] + conn.execute(REVISION_CHAIN, (str(note_id), base["rev"], rev)).fetchall()
+        rows = await self.db.read(run)
+        if not rows or rows[-1]["rev"] != rev:
+            return None
+        chain = [_revision(row) for row in rows]
+        version = revision_summary(chain[-1])
+        version["content"] = rebuild(chain)
+        return version
+
+    async def prune_revisions(self, note_id: ObjectId) -> int:
+        """Drop the records of a note that fall outside the retention limits."""
+        def run(conn):
+            with transaction(conn):
+                return _prune_revisions(conn, str(note_id))
+        return await self.db.write(run)
+
+    async def sweep_revisions(self, cutoff: str) -> int:
+        """Prune every note with records written before cutoff (an ISO timestamp)."""
+        def run(conn):
+            with transaction(conn):
+                note_ids = [row[0] for row in conn.execute(EXPIRED_REVISION_NOTES, (cutoff,)).fetchall()]
+                return sum(_prune_revisions(conn, note_id) for note_id in note_ids)
+        return await self.db.write(run)
+
+    @timed_async("sqlite")
+    async def list_changes(self, user_id: str, since: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """Notes (and tombstones) changed after revision `since`, oldest change first."""
+        rows = await self.db.read(lambda conn: conn.execute(LIST_CHANGES, (user_id, since, limit)).fetchall())
+        changes = []
+        for row in rows:
+            change = {"id": row["id"], "rev": row["rev"], "updatedAt": row["updated_at"]}
+            if row["deleted"]:
+                change["deleted"] = True
+            else:
+                change.update({"title": row["title"], "content": row["content"], "tags": _tags(row),
+                               "createdAt": row["created_at"]})
+            changes.append(change)
+        return changes
+
+    async def iter_user_notes(self, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """All of a user's notes (used to build in-process indexes)."""
+        async for note in self.export_notes(user_id):
+            yield note
+
+    async def text_search(self, user_id: str, query: str, limit: int) -> AsyncIterator[Dict[str, Any]]:
+        """Notes matching any term of the query (FTS5, BM25 ranking), best matches first."""
+        terms = _WORD_RE.findall(query.lower())
+        if not terms:
+            return
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = await self.db.read(
+            lambda conn: conn.execute(TEXT_SEARCH, (self.title_weight, match, user_id, limit)).fetchall())
+        for row in rows:
+            doc = _doc(row)
+            doc["score"] = row["score"]
+            yield doc
+
+    async def ensure_indexes(self) -> None:
+        pass  # Created with the schema when the database is opened
+
+    async def assign_missing_revisions(self) -> int:
+        return 0  # Every row has had a revision since the schema was created
+
+    async def ensure_text_index(self, title_weight: int) -> None:
+        # The FTS5 table exists with the schema; the weight is applied at query time
+        self.title_weight = float(title_weight)
+
+    @timed_async("sqlite")
+    async def list_notes(self, user_id: str, limit: int = 20,
+                         after: Optional[Tuple[str, ObjectId]] = None,
+                         summary: bool = False,
+                         tag: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of a user's notes (newest first) and the cursor for the next page.
+        Keyset pagination on the (user_id, created_at, id) index, or with a tag
+        on the key of note_tags.
+        """
+        sql = LIST_PAGE[summary, after is not None, tag is not None]
+        params = (user_id,) if tag is None else (user_id, tag)
+        params += (after[0], str(after[1]), limit) if after is not None else (limit,)
+        rows = await self.db.read(lambda conn: conn.execute(sql, params).fetchall())
+        notes = []
+        for row in rows:
+            item = {"id": row["id"], "title": row["title"]}
+            if summary:
+                item["preview"] = row["preview"] or ""
+                item["size"] = row["size"] or 0
+            else:
+                item["content"] = row["content"]
+            item.update({"tags": _tags(row), "createdAt": row["created_at"], "updatedAt": row["updated_at"],
+                         "rev": row["rev"]})
+            notes.append(item)
+
+        next_cursor = None
+        if len(notes) == limit:
+            last = notes[-1]
+            next_cursor = encode_cursor(last["createdAt"], last["id"])
+        return notes, next_cursor
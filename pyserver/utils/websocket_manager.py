@@ -1,20 +1,176 @@
-import json
+# utils/websocket_manager.py
+import asyncio
 import logging
+import os
+import time
 import uuid
-from typing import Dict, Optional
-from fastapi import WebSocket, WebSocketDisconnect
-import jwt
+from collections import deque
 from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from starlette.websockets import WebSocket, WebSocketState
+from utils import presence
+from utils.broker import BROADCAST_CHANNEL, broker as shared_broker, user_channel
+from utils.codec import dumps_str
+from utils.event_log import EventLog
+from utils.metrics import timed
 
 logger = logging.getLogger(__name__)
 
-# utils/websocket_manager.py
-import uuid
-import logging
-from typing import Dict, Optional
-from starlette.websockets import WebSocket, WebSocketState
+# Max frames buffered per connection before the slow-consumer policy kicks in.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# What to do when a connection's queue is full: drop_oldest | coalesce | disconnect
+# (collab frames are never dropped; a queue full of them closes the socket)
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest").lower()
+# Close code used when a slow consumer is disconnected ("try again later").
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# A connection the server hasn't heard from for this long gets a {"type": "ping"}
+# (any message counts, including the client's own pings)
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+# Connections silent for this long are closed; this is what reaps half-open
+# sockets (0 = never)
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "75"))
+# Resolution of the heartbeat wheel, in seconds
+WS_HEARTBEAT_TICK = float(os.getenv("WS_HEARTBEAT_TICK", "1"))
+# Sockets one user may hold on one worker (0 = no limit)
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "20"))
+# Close code for connections reaped by the idle timeout ("going away")
+IDLE_CLOSE_CODE = 1001
+# Device labels are client-supplied; keep them short
+MAX_DEVICE_CHARS = 200
+# Server heartbeat; clients may answer {"type": "pong"}
+PING_FRAME = dumps_str({"type": "ping"})
+# Longest event-batching window a client may ask for on the handshake (ms)
+WS_BATCH_MAX_WINDOW_MS = int(os.getenv("WS_BATCH_MAX_WINDOW_MS", "1000"))
+# Events per "events" frame; a longer burst goes out as several frames
+WS_BATCH_MAX_EVENTS = int(os.getenv("WS_BATCH_MAX_EVENTS", "256"))
+# permessage-deflate for clients that offer it in Sec-WebSocket-Extensions.
+# Applied by the desktop entry point (main.py); with the uvicorn CLI use
+# --ws-per-message-deflate, whose default is also on.
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") == "1"
+
+
+def _coalesce_key(message: dict) -> Optional[str]:
+    """Messages about the same note of the same type supersede each other."""
+    data = message.get("data")
+    if isinstance(data, dict) and data.get("id"):
+        return f"{message.get('type')}:{data['id']}"
+    return None
+
+
+class _Connection:
+    """
+    One socket plus its bounded outbound queue and writer task. Kept small, as
+    a worker may hold ~100k mostly idle sockets: the queue and the writer only
+    exist while frames are waiting to be sent.
+    """
+    __slots__ = ("ws", "user_id", "cid", "queue", "writer", "closing", "device", "connected_at", "last_seen",
+                 "slot", "batch_window", "wake")
+
+    def __init__(self, ws: WebSocket, user_id: str, cid: str, device: str, batch_window: float = 0.0) -> None:
+        self.ws = ws
+        self.user_id = user_id
+        self.cid = cid
+        # (frame, coalesce_key, enqueued_at, reliable)
+        self.queue: Optional[Deque[Tuple[str, Optional[str], float, bool]]] = None
+        self.writer: Optional[asyncio.Task] = None
+        self.closing = False
+        self.device = device
+        self.connected_at = time.time()
+        # Monotonic time of the last frame received from the client
+        self.last_seen = time.monotonic()
+        # Bucket of the heartbeat wheel
+        self.slot = 0
+        # Seconds to collect events into one "events" frame (0 = a frame per event)
+        self.batch_window = batch_window
+        # Set while the writer waits out the window; resolved early by a full batch
+        self.wake: Optional[asyncio.Future] = None
+
+    def describe(self) -> Dict[str, Any]:
+        """This socket as listed by the presence API."""
+        return {"connectionId": self.cid, "device": self.device,
+                "connectedAt": datetime.fromtimestamp(self.connected_at, timezone.utc).isoformat()}
+
+
+class HeartbeatWheel:
+    """
+    Timer wheel driving every socket's heartbeat from one task. Connections sit
+    in `slots` buckets; each tick visits the next bucket, so a connection is
+    checked once per rotation (the heartbeat interval) and costs nothing in
+    between. Adding and removing are set operations.
+    """
+
+    def __init__(self, interval: float = WS_HEARTBEAT_INTERVAL, tick: float = WS_HEARTBEAT_TICK) -> None:
+        self.tick = tick
+        self.slots: List[Set[_Connection]] = [set() for _ in range(max(1, round(interval / tick)))]
+        self.hand = 0
+        self._next_slot = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, conn: _Connection) -> None:
+        # Round robin, so a burst of reconnects (e.g. after a deploy) is spread
+        # over the whole rotation instead of landing on one tick
+        conn.slot = self._next_slot
+        self._next_slot = (self._next_slot + 1) % len(self.slots)
+        self.slots[conn.slot].add(conn)
+
+    def remove(self, conn: _Connection) -> None:
+        self.slots[conn.slot].discard(conn)
+
+    def start(self, on_due: Callable[[List[_Connection]], None], on_rotation: Callable[[], None]) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(on_due, on_rotation))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, on_due, on_rotation) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        on_rotation()
+        while True:
+            # Scheduled from the start time, so ticks don't drift
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            self.hand = (self.hand + 1) % len(self.slots)
+            if self.hand == 0:
+                on_rotation()
+            bucket = self.slots[self.hand]
+            if bucket:
+                try:
+                    on_due(list(bucket))
+                except Exception as e:
+                    logger.error("Error in WebSocket heartbeat: %s", e)
+
+
+class _SendStats:
+    """Counters and a window of recent send latencies for the metrics endpoint."""
+
+    def __init__(self, window: int = 1024) -> None:
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.errors = 0
+        self.heartbeats = 0
+        self.idle_disconnects = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_events = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def latency_percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
 
-logger = logging.getLogger(__name__)
 
 class ConnectionManager:
     """
@@ -25,30 +181,156 @@ class ConnectionManager:
     - send_to_user() sends to all of a user's active connections.
     - broadcast_all() sends to every connected user.
     All socket closes are guarded to avoid double-close errors.
+
+    Messages are also published through a broker so users connected to other
+    workers/hosts receive them. A worker subscribes to a user's channel only
+    while that user has at least one socket connected to it.
+
+    Sends never await the network: each message is serialized once per fan-out
+    and queued on every target connection, whose writer task drains its own
+    bounded queue. A slow client therefore only delays itself; when its queue
+    is full the configured slow-consumer policy applies.
+
+    Liveness is server-driven: the heartbeat wheel pings connections that have
+    gone quiet and closes those silent past the idle timeout, so sockets whose
+    peer vanished without a close don't stay in _by_user. Connections are
+    also published to utils.presence, and each connect or disconnect is sent
+    to the user's other sockets as a "presence" event.
+
+    A client may opt into batching on the handshake: its writer then waits
+    the negotiated window after the first queued event and sends everything
+    queued by then as one {"type": "events", "data": [...]} frame, in order,
+    where a later event about a note supersedes an earlier one of the same
+    type. A burst of writes costs the client one frame and one render.
     """
 
-    def __init__(self) -> None:
-        # user_id -> { connection_id: WebSocket }
-        self._by_user: Dict[str, Dict[str, WebSocket]] = {}
+    def __init__(self, broker=None, queue_size: int = WS_SEND_QUEUE_SIZE,
+                 slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY,
+                 heartbeat_interval: float = WS_HEARTBEAT_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT,
+                 max_connections_per_user: int = WS_MAX_CONNECTIONS_PER_USER,
+                 max_batch_window_ms: int = WS_BATCH_MAX_WINDOW_MS, max_batch_events: int = WS_BATCH_MAX_EVENTS) -> None:
+        # user_id -> { connection_id: _Connection }
+        self._by_user: Dict[str, Dict[str, _Connection]] = {}
+        self.broker = broker or shared_broker
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.stats = _SendStats()
+        # Recent revisioned events per user, replayed to reconnecting sockets
+        self.event_log = EventLog()
+        # Keeps fire-and-forget tasks (publishes, closes) referenced until done
+        self._background: Set[asyncio.Task] = set()
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections_per_user = max_connections_per_user
+        self.wheel = HeartbeatWheel(heartbeat_interval)
+        self.max_batch_window_ms = max_batch_window_ms
+        self.max_batch_events = max(1, max_batch_events)
+        # A batching writer stops waiting once this much is queued, well before
+        # the queue is full and the slow-consumer policy would start dropping
+        self.batch_flush_at = max(1, min(self.max_batch_events, queue_size // 2))
+
+    async def start(self) -> None:
+        await self.broker.start()
+        await self.broker.subscribe(BROADCAST_CHANNEL, self._on_broadcast)
+        self.wheel.start(self._heartbeat, lambda: self._spawn(presence.keep_alive()))
+
+    async def stop(self) -> None:
+        await self.wheel.stop()
+        for conns in self._by_user.values():
+            for conn in conns.values():
+                self._stop_writer(conn)
+        await presence.retire()
+        await self.broker.close()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
 
-    async def connect(self, websocket: WebSocket, user_id: str) -> str:
+    def at_capacity(self, user_id: str) -> bool:
+        """True if the user can't open another socket on this worker (check before accepting)."""
+        if self.max_connections_per_user > 0 and \
+                len(self._by_user.get(user_id, ())) >= self.max_connections_per_user:
+            self.stats.rejected += 1
+            return True
+        return False
+
+    def grant_batch_window(self, requested_ms: Optional[int]) -> int:
+        """The batching window (ms) granted to a client asking for `requested_ms`; 0 = no batching."""
+        return max(0, min(requested_ms or 0, self.max_batch_window_ms))
+
+    async def connect(self, websocket: WebSocket, user_id: str, device: Optional[str] = None,
+                      batch_window_ms: int = 0) -> str:
         # NOTE: Do NOT call websocket.accept() here if you already accept in your route.
         cid = str(uuid.uuid4())
-        self._by_user.setdefault(user_id, {})[cid] = websocket
-        logger.info(f"New WebSocket connection: {user_id} (connection_id: {cid})")
+        first_local = not self.has_user(user_id)
+        conn = _Connection(websocket, user_id, cid, (device or "unknown")[:MAX_DEVICE_CHARS],
+                           self.grant_batch_window(batch_window_ms) / 1000.0)
+        self._by_user.setdefault(user_id, {})[cid] = conn
+        self.wheel.add(conn)
+        if first_local:
+            await self.broker.subscribe(user_channel(user_id), self._remote_handler(user_id))
+        info = conn.describe()
+        self._spawn(presence.add(user_id, cid, info))
+        await self.send_to_user(user_id, {"type": "presence", "data": dict(info, online=True)},
+                                exclude_connection_id=cid)
+        logger.debug("New WebSocket connection: %s (connection_id: %s)", user_id, cid)
         return cid
 
-    async def _safe_close(self, ws: WebSocket, user_id: str, cid: str) -> None:
+    def touch(self, user_id: str, connection_id: str) -> None:
+        """Record that a frame arrived from this connection."""
+        conn = self._by_user.get(user_id, {}).get(connection_id)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    def _heartbeat(self, conns: List[_Connection]) -> None:
+        """Wheel callback for one bucket: ping quiet connections, close dead ones."""
+        now = time.monotonic()
+        for conn in conns:
+            if conn.closing:
+                continue
+            silent = now - conn.last_seen
+            if self.idle_timeout > 0 and silent >= self.idle_timeout:
+                self.stats.idle_disconnects += 1
+                conn.closing = True
+                logger.info("Closing idle WebSocket %s (%s), silent for %.0fs", conn.user_id, conn.cid, silent)
+                self._spawn(self.disconnect(conn.user_id, conn.cid, code=IDLE_CLOSE_CODE))
+            elif silent >= self.heartbeat_interval - self.wheel.tick:
+                self.stats.heartbeats += 1
+                self._enqueue(conn, PING_FRAME, None)
+
+    async def online_devices(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's online devices: from Redis across workers, or this worker's sockets."""
+        devices = await presence.online(user_id)
+        if devices is None:
+            devices = sorted((conn.describe() for conn in self._by_user.get(user_id, {}).values()),
+                             key=lambda device: device["connectedAt"])
+        return devices
+
+    def _remote_handler(self, user_id: str):
+        async def handler(message: dict) -> None:
+            self._record(user_id, message)
+            self._send_local(user_id, message)
+        return handler
+
+    async def _safe_close(self, ws: WebSocket, user_id: str, cid: str, code: int = 1000) -> None:
         try:
             # Guard against double-close
             if (ws.client_state != WebSocketState.DISCONNECTED and
                 ws.application_state != WebSocketState.DISCONNECTED):
-                await ws.close(code=1000)  # Normal closure
+                await ws.close(code=code)
         except Exception as e:
             # Just log; Starlette might already have sent a close frame
-            logger.error(f"Error closing connection for {user_id} ({cid}): {e}")
+            logger.error("Error closing connection for %s (%s): %s", user_id, cid, e)
+
+    def _stop_writer(self, conn: _Connection) -> None:
+        conn.closing = True
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        conn.queue = None
 
-    async def disconnect(self, user_id: str, connection_id: Optional[str] = None, *, close: bool = True) -> None:
+    async def disconnect(self, user_id: str, connection_id: Optional[str] = None, *, close: bool = True,
+                         code: int = 1000) -> None:
         """
         Remove a connection (preferred) or all connections for a user.
         Set close=False when you're being called from a WebSocketDisconnect path.
@@ -59,51 +341,216 @@ class ConnectionManager:
         if connection_id is None:
             # Remove ALL connections for this user
             conns = self._by_user.pop(user_id, {})
-            for cid, ws in list(conns.items()):
+            await self.broker.unsubscribe(user_channel(user_id))
+            for cid, conn in list(conns.items()):
+                self._forget(conn)
                 if close:
-                    await self._safe_close(ws, user_id, cid)
-            logger.info(f"Disconnected ALL for {user_id} (count={len(conns)})")
+                    await self._safe_close(conn.ws, user_id, cid, code)
+            logger.debug("Disconnected ALL for %s (count=%d)", user_id, len(conns))
             return
 
-        ws = self._by_user[user_id].pop(connection_id, None)
+        conn = self._by_user[user_id].pop(connection_id, None)
         if not self._by_user[user_id]:
             self._by_user.pop(user_id, None)
+            await self.broker.unsubscribe(user_channel(user_id))
 
-        if ws and close:
-            await self._safe_close(ws, user_id, connection_id)
+        if conn:
+            self._forget(conn)
+            if close:
+                await self._safe_close(conn.ws, user_id, connection_id, code)
+            await self.send_to_user(user_id, {"type": "presence", "data": {"connectionId": connection_id,
+                                                                            "online": False}})
 
-        logger.info(f"Disconnected: {user_id} (connection_id: {connection_id})")
+        logger.debug("Disconnected: %s (connection_id: %s)", user_id, connection_id)
+
+    def _forget(self, conn: _Connection) -> None:
+        self._stop_writer(conn)
+        self.wheel.remove(conn)
+        self._spawn(presence.remove(conn.user_id, conn.cid))
 
     def has_user(self, user_id: str) -> bool:
         return user_id in self._by_user and bool(self._by_user[user_id])
 
     async def send_to_user(self, user_id: str, message: dict, exclude_connection_id: Optional[str] = None) -> None:
         """
-        Fan-out to ALL active sockets of this user (Electron + Browser, etc).
-        If one socket fails, it's pruned.
+        Fan-out to ALL active sockets of this user (Electron + Browser, etc),
+        on this worker and, through the broker, on every other worker.
+        Returns as soon as the message is queued; nothing here waits on a client.
+        """
+        with timed("fanout"):
+            self._record(user_id, message)
+            self._send_local(user_id, message, exclude_connection_id)
+            self._spawn(self.broker.publish(user_channel(user_id), message))
+
+    def _record(self, user_id: str, message: dict) -> None:
+        rev = message.get("rev")
+        if isinstance(rev, int):
+            self.event_log.append(user_id, rev, message, message.get("firstRev"))
+
+    def send_to_connection(self, user_id: str, connection_id: str, message: dict, reliable: bool = False) -> None:
         """
-        conns = self._by_user.get(user_id, {})
-        dead = []
-        for cid, ws in list(conns.items()):
+        Queue a message for a single connection (e.g. a reply to that client).
+        A reliable message is never dropped by the slow-consumer policy: if it
+        would have to be, the connection is closed instead, so the client
+        reconnects and resyncs rather than silently missing it.
+        """
+        conn = self._by_user.get(user_id, {}).get(connection_id)
+        if conn is not None:
+            self._enqueue(conn, dumps_str(message), None, reliable)
+
+    def _send_local(self, user_id: str, message: dict, exclude_connection_id: Optional[str] = None) -> None:
+        """Queue a message for the sockets of this user connected to this worker."""
+        conns = self._by_user.get(user_id)
+        if not conns:
+            return
+        # Serialize once per fan-out, not once per socket
+        frame = dumps_str(message)
+        key = _coalesce_key(message)
+        for cid, conn in list(conns.items()):
             if cid == exclude_connection_id:
                 continue
-            try:
-                await ws.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending to {user_id} ({cid}): {e}")
-                dead.append((user_id, cid, ws))
-        # Cleanup dead sockets without double-close (Starlette likely closed them)
-        for uid, cid, ws in dead:
-            await self.disconnect(uid, cid, close=False)
+            self._enqueue(conn, frame, key)
+
+    def _enqueue(self, conn: _Connection, frame: str, key: Optional[str], reliable: bool = False) -> None:
+        if conn.closing:
+            return
+        queue = conn.queue
+        if queue is None:
+            queue = conn.queue = deque()
+        if len(queue) >= self.queue_size:
+            if self.slow_consumer_policy == "disconnect":
+                self._disconnect_slow(conn, "queue full")
+                return
+            if self.slow_consumer_policy == "coalesce" and key is not None:
+                for i, (_, queued_key, enqueued_at, _) in enumerate(queue):
+                    if queued_key == key:
+                        # Replace the superseded frame in place, keeping its position
+                        queue[i] = (frame, key, enqueued_at, False)
+                        self.stats.coalesced += 1
+                        return
+            # Drop the oldest frame that may be dropped; reliable ones (collab
+            # deltas and acks) never are, the socket is closed instead
+            victim = next((i for i, entry in enumerate(queue) if not entry[3]), None)
+            if victim is None:
+                self._disconnect_slow(conn, "queue full of reliable frames")
+                return
+            del queue[victim]
+            self.stats.dropped += 1
+        queue.append((frame, key, time.perf_counter(), reliable))
+        if conn.writer is None:
+            conn.writer = asyncio.create_task(self._writer(conn))
+        elif conn.wake is not None and len(queue) >= self.batch_flush_at and not conn.wake.done():
+            conn.wake.set_result(None)
+
+    def _disconnect_slow(self, conn: _Connection, reason: str) -> None:
+        self.stats.slow_disconnects += 1
+        conn.closing = True
+        logger.warning("Disconnecting slow consumer %s (%s): %s, queue=%d", conn.user_id, conn.cid, reason,
+                       len(conn.queue or ()))
+        self._spawn(self.disconnect(conn.user_id, conn.cid, code=SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _writer(self, conn: _Connection) -> None:
+        """Drain one connection's queue, then exit; a failed send prunes the connection."""
+        try:
+            while conn.queue:
+                if conn.batch_window:
+                    if len(conn.queue) < self.batch_flush_at:
+                        # Let the rest of the burst arrive, unless a full batch is queued first
+                        conn.wake = asyncio.get_running_loop().create_future()
+                        await asyncio.wait((conn.wake,), timeout=conn.batch_window)
+                        conn.wake = None
+                        if not conn.queue:
+                            break
+                    frame, enqueued = self._take_batch(conn.queue)
+                else:
+                    frame, _, enqueued_at, _ = conn.queue.popleft()
+                    enqueued = (enqueued_at,)
+                await conn.ws.send_text(frame)
+                self.stats.sent += 1
+                now = time.perf_counter()
+                self.stats.latencies.extend(now - enqueued_at for enqueued_at in enqueued)
+            conn.queue = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.errors += 1
+            logger.error("Error sending to %s (%s): %s", conn.user_id, conn.cid, e)
+            # Cleanup dead sockets without double-close (Starlette likely closed them)
+            await self.disconnect(conn.user_id, conn.cid, close=False)
+        finally:
+            conn.writer = None
+            conn.wake = None
+
+    def _take_batch(self, queue: Deque[Tuple[str, Optional[str], float, bool]]) -> Tuple[str, List[float]]:
+        """
+        Pop up to max_batch_events queued frames and join them into one "events"
+        frame (a lone frame is sent as is). Of several events with the same
+        coalesce key only the last is kept, at its own position, so the order
+        of what remains is unchanged.
+        """
+        count = min(len(queue), self.max_batch_events)
+        taken = [queue.popleft() for _ in range(count)]
+        enqueued = [enqueued_at for _, _, enqueued_at, _ in taken]
+        if count == 1:
+            return taken[0][0], enqueued
+        seen: Set[str] = set()
+        frames: List[str] = []
+        for frame, key, _, _ in reversed(taken):
+            if key is not None:
+                if key in seen:
+                    self.stats.coalesced += 1
+                    continue
+                seen.add(key)
+            frames.append(frame)
+        frames.reverse()
+        self.stats.batches += 1
+        self.stats.batched_events += len(frames)
+        # The frames are serialized already: splice them in rather than re-encoding
+        timestamp = dumps_str(datetime.now(timezone.utc).isoformat())
+        return '{"type":"events","data":[' + ",".join(frames) + '],"timestamp":' + timestamp + "}", enqueued
 
     async def broadcast_all(self, message: dict, exclude_user_id: Optional[str] = None) -> None:
         """
         Global broadcast (rarely needed for user data).
         """
-        for user_id in list(self._by_user.keys()):
+        with timed("fanout"):
+            self._broadcast_local(message, exclude_user_id)
+            self._spawn(self.broker.publish(BROADCAST_CHANNEL, {"message": message, "exclude_user_id": exclude_user_id}))
+
+    def _broadcast_local(self, message: dict, exclude_user_id: Optional[str] = None) -> None:
+        frame = dumps_str(message)
+        key = _coalesce_key(message)
+        for user_id, conns in list(self._by_user.items()):
             if user_id == exclude_user_id:
                 continue
-            await self.send_to_user(user_id, message)
+            for conn in list(conns.values()):
+                self._enqueue(conn, frame, key)
+
+    async def _on_broadcast(self, envelope: dict) -> None:
+        self._broadcast_local(envelope["message"], envelope.get("exclude_user_id"))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        depths = [len(c.queue) if c.queue else 0 for conns in self._by_user.values() for c in conns.values()]
+        return {
+            "users": len(self._by_user),
+            "connections": len(depths),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_capacity": self.queue_size,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "sent": self.stats.sent,
+            "dropped": self.stats.dropped,
+            "coalesced": self.stats.coalesced,
+            "slow_disconnects": self.stats.slow_disconnects,
+            "send_errors": self.stats.errors,
+            "heartbeats": self.stats.heartbeats,
+            "idle_disconnects": self.stats.idle_disconnects,
+            "rejected": self.stats.rejected,
+            "batches": self.stats.batches,
+            "batched_events": self.stats.batched_events,
+            "send_latency_p50_ms": self.stats.latency_percentile(50) * 1000,
+            "send_latency_p99_ms": self.stats.latency_percentile(99) * 1000,
+        }
 
 # Global instance
 manager = ConnectionManager()
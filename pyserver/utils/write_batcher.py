@@ -0,0 +1,165 @@
+"""
+Write-behind batching of note inserts (opt-in with WRITE_BATCHING=1).
+
+Inserts from concurrent requests are collected for up to WRITE_BATCH_WINDOW_MS
+or WRITE_BATCH_MAX_OPS notes, whichever comes first, then written with one
+unordered bulk_write. Each caller still waits for that write to be
+acknowledged (set MONGO_JOURNAL=1 for journaled acks) and gets its own note,
+id and revision back, or its own error.
+
+The side effects are merged per user: one revision-counter update, one cache
+invalidation and one WebSocket event for everything a user wrote in a batch.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson.objectid import ObjectId
+
+from utils.metrics import untimed
+from utils.notes_repository import notes_repo
+from utils.redis_utils import invalidate_notes_cache
+from utils.search import search_backend
+from utils.websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "0") == "1"
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "5"))
+WRITE_BATCH_MAX_OPS = int(os.getenv("WRITE_BATCH_MAX_OPS", "100"))
+
+
+class WriteBatcher:
+    """Collects note inserts from concurrent requests into bulk writes."""
+
+    def __init__(self, window_ms: float = WRITE_BATCH_WINDOW_MS, max_ops: int = WRITE_BATCH_MAX_OPS) -> None:
+        self.window = window_ms / 1000.0
+        self.max_ops = max_ops
+        self._pending: List[Tuple[Dict[str, Any], "asyncio.Future"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self.stats = {"batches": 0, "ops": 0, "errors": 0}
+
+    async def insert_note(self, note_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue a note for the next batch and wait until it is written.
+        Returns the note as the API reports it (id, rev, updatedAt...).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((note_data, future))
+        if len(self._pending) >= self.max_ops:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_now)
+        # The write goes ahead even if this request is cancelled
+        return await asyncio.shield(future)
+
+    def _flush_now(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def stop(self) -> None:
+        """Write whatever is still queued (on shutdown)."""
+        self._flush_now()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], "asyncio.Future"]]) -> None:
+        # Spawned from whichever request filled the batch; don't bill that request for it
+        untimed()
+        self.stats["batches"] += 1
+        self.stats["ops"] += len(batch)
+        by_user: Dict[str, List[int]] = {}
+        for i, (note_data, _) in enumerate(batch):
+            by_user.setdefault(note_data["userId"], []).append(i)
+
+        notes = [note_data for note_data, _ in batch]
+        try:
+            blocks = await asyncio.gather(*(notes_repo.stamp_new_notes(user_id, [notes[i] for i in indexes])
+                                            for user_id, indexes in by_user.items()))
+            revs = dict(zip(by_user, blocks))
+            for note_data in notes:
+                note_data["_id"] = ObjectId()
+            errors = await notes_repo.bulk_insert(notes)
+        except Exception as e:
+            self.stats["errors"] += len(batch)
+            logger.error("Batched insert of %d notes failed: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        results: Dict[int, Dict[str, Any]] = {}
+        written: Dict[str, List[int]] = {}
+        try:
+            for user_id, indexes in by_user.items():
+                for i in indexes:
+                    if i in errors:
+                        continue
+                    note_data = notes[i]
+                    results[i] = {
+                        "id": str(note_data["_id"]),
+                        "title": note_data["title"],
+                        "content": note_data["content"],
+                        "tags": note_data.get("tags", []),
+                        "userId": user_id,
+                        "createdAt": note_data["createdAt"],
+                        "updatedAt": note_data["updatedAt"],
+                        "rev": note_data["rev"],
+                    }
+                    await self._side_effect("index the note", search_backend.index_note(user_id, results[i]))
+                    written.setdefault(user_id, []).append(i)
+            # Invalidate before acking so the caller's next GET /notes sees its note
+            await self._side_effect("invalidate the cache",
+                                    asyncio.gather(*(invalidate_notes_cache(user_id) for user_id in written)))
+        finally:
+            # The rows are written: every caller gets its answer, whatever fails below
+            for i, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if i in results:
+                    future.set_result(results[i])
+                else:
+                    self.stats["errors"] += 1
+                    future.set_exception(RuntimeError(errors.get(i, "write not acknowledged")))
+
+        for user_id, indexes in written.items():
+            await self._side_effect("send the event", manager.send_to_user(
+                user_id, self._event([results[i] for i in indexes], revs[user_id])))
+
+    @staticmethod
+    async def _side_effect(what: str, awaitable) -> None:
+        """Await a follow-up of a written batch; failures are logged, never raised (the rows are in)."""
+        try:
+            await awaitable
+        except Exception as e:
+            logger.error("Batched insert: could not %s: %s", what, e)
+
+    @staticmethod
+    def _event(new_notes: List[Dict[str, Any]], revs: Tuple[int, int]) -> Dict[str, Any]:
+        timestamp = datetime.now(timezone.utc).isoformat()
+        if len(new_notes) == 1:
+            return {"type": "note_added", "data": new_notes[0], "rev": new_notes[0]["rev"], "timestamp": timestamp}
+        # The bulk import event, but with whole notes (a batch is small and they
+        # are at hand), so clients list them without fetching. The range covers
+        # the whole block reserved for the batch, including failed inserts.
+        return {"type": "notes_added", "data": {"notes": new_notes}, "firstRev": revs[0], "rev": revs[1],
+                "timestamp": timestamp}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return dict(self.stats, enabled=WRITE_BATCHING, pending=len(self._pending),
+                    avg_batch=self.stats["ops"] / batches if batches else 0.0)
+
+
+# Global instance
+write_batcher = WriteBatcher()